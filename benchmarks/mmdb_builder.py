@@ -0,0 +1,165 @@
+# benchmarks/mmdb_builder.py
+
+"""Minimal MaxMind DB (v2) writer for building small City/ASN test databases.
+
+Only what the benchmarks need: IPv4 trees with 24-bit records, and the
+map/string/double/unsigned/array types used by the GeoLite2 schemas.
+"""
+
+import ipaddress
+import struct
+import time
+
+METADATA_MARKER = b"\xab\xcd\xefMaxMind.com"
+
+# Data section type numbers
+TYPE_STRING = 2
+TYPE_DOUBLE = 3
+TYPE_UINT16 = 5
+TYPE_UINT32 = 6
+TYPE_MAP = 7
+TYPE_UINT64 = 9
+TYPE_ARRAY = 11
+
+class _Typed:
+    """An unsigned integer with an explicit width; the metadata fields must use exact types."""
+
+    def __init__(self, kind, value):
+        self.kind = kind
+        self.value = value
+
+class _Encoder:
+    def __init__(self):
+        self.data = bytearray()
+        self._offsets = {} # Encoded record -> offset, so shared records are stored once
+        self._objects = {} # id(record) -> (record, offset), skips re-encoding the same object
+
+    def add(self, value):
+        """Appends a record to the data section; returns its offset."""
+        known = self._objects.get(id(value))
+        if known is not None:
+            return known[1]
+        encoded = self.encode(value)
+        offset = self._offsets.get(encoded)
+        if offset is None:
+            offset = len(self.data)
+            self.data += encoded
+            self._offsets[encoded] = offset
+        self._objects[id(value)] = (value, offset) # Keeps the object alive so its id is not reused
+        return offset
+
+    def encode(self, value):
+        if isinstance(value, _Typed):
+            raw = value.value.to_bytes((value.value.bit_length() + 7) // 8, "big")
+            return self._control(value.kind, len(raw)) + raw
+        if isinstance(value, dict):
+            body = b"".join(self.encode(str(key)) + self.encode(item) for key, item in value.items())
+            return self._control(TYPE_MAP, len(value)) + body
+        if isinstance(value, (list, tuple)):
+            return self._control(TYPE_ARRAY, len(value)) + b"".join(self.encode(item) for item in value)
+        if isinstance(value, str):
+            raw = value.encode("utf-8")
+            return self._control(TYPE_STRING, len(raw)) + raw
+        if isinstance(value, float):
+            return self._control(TYPE_DOUBLE, 8) + struct.pack(">d", value)
+        if isinstance(value, int):
+            kind = TYPE_UINT32 if value < 1 << 32 else TYPE_UINT64
+            raw = value.to_bytes((value.bit_length() + 7) // 8, "big")
+            return self._control(kind, len(raw)) + raw
+        raise TypeError(f"Cannot encode {type(value).__name__}")
+
+    @staticmethod
+    def _control(kind, size):
+        if size < 29:
+            extra = b""
+        elif size < 285:
+            extra, size = bytes([size - 29]), 29
+        elif size < 65821:
+            extra, size = (size - 285).to_bytes(2, "big"), 30
+        else:
+            extra, size = (size - 65821).to_bytes(3, "big"), 31
+        if kind <= 7:
+            return bytes([kind << 5 | size]) + extra
+        return bytes([size, kind - 7]) + extra # Extended type
+
+def build_database(path, networks, database_type, description="Conmon benchmark database"):
+    """Writes an IPv4 database mapping each (network, record dict) to its record.
+
+    A network is anything ipaddress.ip_network() accepts, e.g. "8.8.0.0/16" or (0x08080000, 16).
+    """
+    encoder = _Encoder()
+    root = [None, None] # Trie node: [left, right]; a leaf is ("data", offset)
+    for network, record in networks:
+        network = ipaddress.ip_network(network)
+        offset = encoder.add(record)
+        node = root
+        bits = int(network.network_address)
+        for depth in range(network.prefixlen):
+            bit = bits >> (31 - depth) & 1
+            if depth == network.prefixlen - 1:
+                node[bit] = ("data", offset)
+            else:
+                if not isinstance(node[bit], list):
+                    node[bit] = [None, None]
+                node = node[bit]
+
+    # Number the nodes breadth first; the root must be node 0
+    nodes = [root]
+    index = 0
+    while index < len(nodes):
+        for child in nodes[index]:
+            if isinstance(child, list):
+                nodes.append(child)
+        index += 1
+    numbers = {id(node): number for number, node in enumerate(nodes)}
+    node_count = len(nodes)
+
+    def record_value(child):
+        if child is None:
+            return node_count # "No data"
+        if isinstance(child, list):
+            return numbers[id(child)]
+        return node_count + 16 + child[1]
+
+    tree = bytearray()
+    for node in nodes:
+        tree += record_value(node[0]).to_bytes(3, "big") + record_value(node[1]).to_bytes(3, "big")
+
+    metadata = {
+        "binary_format_major_version": _Typed(TYPE_UINT16, 2),
+        "binary_format_minor_version": _Typed(TYPE_UINT16, 0),
+        "build_epoch": _Typed(TYPE_UINT64, int(time.time())),
+        "database_type": database_type,
+        "description": {"en": description},
+        "ip_version": _Typed(TYPE_UINT16, 4),
+        "languages": ["en"],
+        "node_count": _Typed(TYPE_UINT32, node_count),
+        "record_size": _Typed(TYPE_UINT16, 24),
+    }
+    with open(path, "wb") as f:
+        f.write(tree)
+        f.write(b"\x00" * 16)
+        f.write(encoder.data)
+        f.write(METADATA_MARKER)
+        f.write(_Encoder().encode(metadata))
+
+def build_test_databases(city_path, asn_path, prefixlen=16, distinct_records=256):
+    """Covers the whole IPv4 space with /prefixlen networks cycling through distinct_records cities and ASNs."""
+    cities = []
+    systems = []
+    for i in range(distinct_records):
+        cities.append({
+            "city": {"names": {"en": f"City {i}"}},
+            "country": {"iso_code": f"C{i % 100:02d}", "names": {"en": f"Country {i % 100}"}},
+            "location": {"latitude": float(i % 180 - 90) + 0.5, "longitude": float(i * 7 % 360 - 180) + 0.5},
+        })
+        systems.append({
+            "autonomous_system_number": 64512 + i,
+            "autonomous_system_organization": f"Network {i}",
+        })
+    step = 1 << (32 - prefixlen)
+    count = 1 << prefixlen
+    build_database(city_path, (((i * step, prefixlen), cities[i % distinct_records]) for i in range(count)),
+                   "GeoLite2-City")
+    build_database(asn_path, (((i * step, prefixlen), systems[i % distinct_records]) for i in range(count)),
+                   "GeoLite2-ASN")
@@ -0,0 +1,510 @@
+# benchmarks/run_benchmarks.py
+
+"""Conmon benchmark harness.
+
+Runs each benchmark in its own process (Qt allows one application object
+per process, and it keeps memory effects apart), several times, and keeps
+the median of each metric. The results are written as JSON and compared
+with a stored baseline. Absolute numbers depend on the machine, so they
+are reported for information only; the run exits with status 1 when a
+scaling ratio between the smallest and largest size is worse than its
+baseline by more than the tolerance.
+
+    python benchmarks/run_benchmarks.py                      # run and compare with baseline.json
+    python benchmarks/run_benchmarks.py --quick --only table map
+    python benchmarks/run_benchmarks.py --update-baseline    # accept the current numbers
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCHMARK_DIR), 'src')
+sys.path[:0] = [SRC_DIR, BENCHMARK_DIR]
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen') # No display needed
+
+from synthetic import SyntheticTraffic, DISTRIBUTIONS, random_ipv4
+
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, 'baseline.json')
+
+DEFAULT_CONFIG = {
+    "flows": 5000,
+    "packets": 200000,
+    "packet_rate": 20000,
+    "distribution": "zipf",
+    "flush_interval": 0.2,
+    "row_counts": [1000, 5000, 20000],
+    "marker_counts": [100, 1000, 5000],
+    "resolver_ips": 5000,
+    "resolver_workers": 1,
+    "resolver_prefixlen": 16,
+}
+
+# Same smallest and largest sizes as the default, so the quick run's scaling ratios compare with the baseline
+QUICK_CONFIG = dict(DEFAULT_CONFIG, packets=50000, row_counts=[1000, 20000], marker_counts=[100, 5000],
+                    resolver_ips=2000)
+
+def metric(value, unit, better, gate=False):
+    """A result; gate marks the machine-independent ones that fail the run when they regress."""
+    return {"value": round(value, 3), "unit": unit, "better": better, "gate": gate}
+
+def scaling(results, prefix, sizes, label):
+    """Adds the ratio of the per-operation cost at the largest size to that at the smallest."""
+    first = results[f"{prefix}[{label}={sizes[0]}]"]["value"]
+    last = results[f"{prefix}[{label}={sizes[-1]}]"]["value"]
+    results[f"{prefix}.scaling[{sizes[0]}->{sizes[-1]}]"] = metric(
+        last / first if first else 0.0, "ratio", "lower", gate=True)
+
+# --- Benchmarks (each runs in a worker process) ---
+
+def bench_ingest(config):
+    """Packets/s from a pcap file through parse_frame and the FlowAggregator (the raw/replay capture path)."""
+    import raw_capture
+    from flow_aggregator import FlowAggregator
+
+    traffic = SyntheticTraffic(config["flows"], packet_rate=config["packet_rate"], distribution=config["distribution"])
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, 'ingest.pcap')
+        traffic.write_pcap(path, config["packets"])
+        source = raw_capture.open_capture_file(path)
+        aggregator = FlowAggregator()
+        per_flush = max(1, int(config["packet_rate"] * config["flush_interval"]))
+        packets = 0
+        started = time.perf_counter()
+        for _, view, length, linktype in source.records(lambda: True):
+            headers = raw_capture.parse_frame(view, linktype, skip_private=True)
+            if headers is not None:
+                aggregator.add(headers[0], headers[2], 'Ethernet', length, "Unknown")
+            packets += 1
+            if packets % per_flush == 0:
+                aggregator.flush()
+        aggregator.flush()
+        elapsed = time.perf_counter() - started
+        source.close()
+    return {"ingest.packets_per_second": metric(packets / elapsed, "packets/s", "higher")}
+
+def bench_capture_processes(config):
+    """Packets/s with 1 and 2 replay worker processes feeding shared-memory rings, drained by CaptureEngine."""
+    import capture_ring
+    from capture_engine import CaptureEngine
+
+    traffic = SyntheticTraffic(config["flows"], packet_rate=config["packet_rate"], distribution=config["distribution"])
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, 'ingest.pcap')
+        traffic.write_pcap(path, config["packets"])
+        for workers in (1, 2):
+            engine = CaptureEngine(replay_path=path, processes=True)
+            engine.start_replay_workers(workers)
+            # Timed from the first published record, once a worker is up
+            while not any(capture_ring.PRODUCER_HEADER.unpack_from(ring.buffer, 0)[0] for _, ring, _ in engine.workers):
+                time.sleep(0.001)
+            started, cpu_started = time.perf_counter(), time.process_time()
+            engine.drain()
+            elapsed = time.perf_counter() - started
+            cpu = time.process_time() - cpu_started
+            packets = sum(engine.interface_stats[iface][1] for iface, _, _ in engine.workers)
+            engine.stop()
+            results[f"capture_processes.packets_per_second[workers={workers}]"] = metric(
+                packets / elapsed, "packets/s", "higher")
+            results[f"capture_processes.main_cpu_us_per_packet[workers={workers}]"] = metric(
+                cpu / packets * 1e6, "us", "lower")
+    first = results["capture_processes.packets_per_second[workers=1]"]["value"]
+    results["capture_processes.speedup[1->2]"] = metric(
+        results["capture_processes.packets_per_second[workers=2]"]["value"] / first if first else 0.0, "ratio", "higher")
+    return results
+
+def bench_handle_flows(config):
+    """Application.handle_flows throughput on synthetic batches (flow table, rate tracker, table model)."""
+    import gui_app # Needs the full GUI stack, including QtWebEngine
+    from main import parse_args
+
+    traffic = SyntheticTraffic(config["flows"], packet_rate=config["packet_rate"], distribution=config["distribution"])
+    batches = traffic.batches(config["packets"], config["flush_interval"])
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir) # The application writes map.html to the working directory
+        empty_capture = os.path.join(workdir, 'empty.pcap')
+        SyntheticTraffic(1).write_pcap(empty_capture, 0)
+        options, _ = parse_args(['conmon', '--no-history', '--replay', empty_capture,
+                                 '--max-flows', str(config["flows"] * 2)])
+        app = gui_app.Application(['conmon'], options)
+        try:
+            updates = sum(len(batch["deltas"]) for batch in batches)
+            started = time.perf_counter()
+            for batch in batches:
+                app.handle_flows(batch)
+            elapsed = time.perf_counter() - started
+        finally:
+            app.sniffer_thread.stop()
+            if app.resolver_thread is not None: # Started by a deferred timer, which does not fire here
+                app.resolver_thread.stop()
+                app.dns_resolver.stop()
+    return {
+        "handle_flows.batches_per_second": metric(len(batches) / elapsed, "batches/s", "higher"),
+        "handle_flows.flow_updates_per_second": metric(updates / elapsed, "updates/s", "higher"),
+        "handle_flows.packets_per_second": metric(config["packets"] / elapsed, "packets/s", "higher"),
+    }
+
+def bench_table(config):
+    """Cost of table updates against row count, one call at a time and batched, and of moving changed rows into place."""
+    from PyQt5.QtCore import QCoreApplication, Qt
+    from connection_model import ConnectionTableModel, ConnectionFilterProxyModel, COL_VOLUME
+    from flow_table import FlowRecord
+
+    app = QCoreApplication.instance() or QCoreApplication(['bench'])
+    rng = random.Random(1)
+    results = {}
+    for rows in config["row_counts"]:
+        model = ConnectionTableModel()
+        proxy = ConnectionFilterProxyModel()
+        proxy.setSourceModel(model)
+        proxy.sort(COL_VOLUME, Qt.DescendingOrder) # As the main window does
+        records = []
+        for i in range(rows):
+            record = FlowRecord(f"198.18.{i >> 8 & 255}.{i & 255}:{443 + (i >> 16)}:Ethernet",
+                                f"198.18.{i >> 8 & 255}.{i & 255}", 443 + (i >> 16), "Ethernet", "bench.exe")
+            record.volume = rng.randrange(1, 1 << 20)
+            records.append(record)
+
+        started = time.perf_counter()
+        model.begin_batch()
+        for record in records:
+            model.add_or_update(record.key, record)
+        model.end_batch()
+        results[f"table.insert_us_per_row[rows={rows}]"] = metric(
+            (time.perf_counter() - started) / rows * 1e6, "us", "lower")
+
+        model.apply_moves() # Sorts the new rows, as the model's timer would
+        app.processEvents()
+
+        # Batched: 1000 flow updates per sniffer batch
+        rounds = 20
+        elapsed = 0.0
+        for _ in range(rounds):
+            started = time.perf_counter()
+            model.begin_batch()
+            for record in rng.sample(records, min(1000, rows)):
+                record.volume += rng.randrange(1, 1 << 16)
+                model.add_or_update(record.key, record)
+            model.end_batch()
+            elapsed += time.perf_counter() - started
+            # Moving the changed rows once per batch, as the timer would at most once a second
+            started = time.perf_counter()
+            model.apply_moves()
+            proxy.rowCount()
+            resort = time.perf_counter() - started
+        results[f"table.batched_update_us[rows={rows}]"] = metric(
+            elapsed / (rounds * min(1000, rows)) * 1e6, "us", "lower")
+        results[f"table.resort_ms[rows={rows}]"] = metric(resort * 1e3, "ms", "lower")
+
+        # Single: every update notifies the view on its own
+        calls = 100
+        started = time.perf_counter()
+        for record in rng.sample(records, calls):
+            record.volume += rng.randrange(1, 1 << 16)
+            model.add_or_update(record.key, record)
+        results[f"table.single_update_us[rows={rows}]"] = metric(
+            (time.perf_counter() - started) / calls * 1e6, "us", "lower")
+        app.processEvents()
+
+    for prefix in ("table.insert_us_per_row", "table.batched_update_us", "table.single_update_us"):
+        scaling(results, prefix, config["row_counts"], "rows")
+    return results
+
+def bench_filter(config):
+    """Cost of applying a compound filter to the whole table, testing new rows and refreshing rates, at 5x the table row counts."""
+    from PyQt5.QtCore import QCoreApplication
+    from connection_model import ConnectionTableModel, ConnectionFilterProxyModel
+    from flow_filter import compile_filter
+    from flow_table import FlowRecord
+
+    app = QCoreApplication.instance() or QCoreApplication(['bench'])
+    rng = random.Random(1)
+    query = "process=bench1 OR (ip in 198.18.0.0/20 AND volume>100KB) AND NOT interface=nordlynx"
+    row_counts = [rows * 5 for rows in config["row_counts"]]
+    results = {}
+
+    def make_record(i):
+        ip = f"198.{18 + (i >> 16)}.{i >> 8 & 255}.{i & 255}"
+        record = FlowRecord(f"{ip}:443:Ethernet", ip, 443, rng.choice(("Ethernet", "NordLynx")),
+                            f"bench{rng.randrange(50)}.exe")
+        record.volume = rng.randrange(1, 1 << 20)
+        return record
+
+    for rows in row_counts:
+        model = ConnectionTableModel()
+        proxy = ConnectionFilterProxyModel()
+        proxy.setSourceModel(model)
+        model.begin_batch()
+        for i in range(rows):
+            record = make_record(i)
+            model.add_or_update(record.key, record)
+        model.end_batch()
+
+        started = time.perf_counter()
+        proxy.set_flow_filter(compile_filter(query))
+        proxy.rowCount() # The proxy rebuilds its mapping on first use
+        results[f"filter.apply_ms[rows={rows}]"] = metric((time.perf_counter() - started) * 1e3, "ms", "lower")
+
+        # New rows arrive with the filter active and are tested as they are inserted
+        added = 1000
+        new_records = [make_record(rows + i) for i in range(added)]
+        started = time.perf_counter()
+        model.begin_batch()
+        for record in new_records:
+            model.add_or_update(record.key, record)
+        model.end_batch()
+        results[f"filter.new_row_us[rows={rows}]"] = metric(
+            (time.perf_counter() - started) / added * 1e6, "us", "lower")
+
+        # The once-per-second rate refresh touches every row, but no column the filter reads
+        rates = [(record["key"], rng.random() * 1e6) for record in map(model.record, range(model.rowCount()))]
+        started = time.perf_counter()
+        model.begin_batch()
+        model.update_rates(rates)
+        model.end_batch()
+        results[f"filter.rate_refresh_ms[rows={rows}]"] = metric((time.perf_counter() - started) * 1e3, "ms", "lower")
+        app.processEvents()
+
+    scaling(results, "filter.new_row_us", row_counts, "rows")
+    scaling(results, "filter.apply_ms", row_counts, "rows")
+    return results
+
+def bench_resolver(config):
+    """ResolverThread lookups/s against generated City/ASN databases, cold and with a warm prefix cache."""
+    import numpy as np
+    from PyQt5.QtCore import QCoreApplication, Qt
+    from resolver import ResolverThread
+    from mmdb_builder import build_test_databases
+
+    app = QCoreApplication.instance() or QCoreApplication(['bench'])
+    with tempfile.TemporaryDirectory() as workdir:
+        city_path = os.path.join(workdir, 'City.mmdb')
+        asn_path = os.path.join(workdir, 'ASN.mmdb')
+        build_test_databases(city_path, asn_path, prefixlen=config["resolver_prefixlen"])
+
+        resolver = ResolverThread(workers=config["resolver_workers"], city_path=city_path, asn_path=asn_path)
+        done = threading.Event()
+        counter = {"received": 0, "expected": 0}
+        def on_results(count):
+            counter["received"] += count
+            if counter["received"] >= counter["expected"]:
+                done.set()
+        # Direct connections count results in the resolver thread, without an event loop here
+        resolver.resolved.connect(lambda result: on_results(1), Qt.DirectConnection)
+        resolver.resolved_batch.connect(lambda results: on_results(len(results)), Qt.DirectConnection)
+        resolver.start()
+
+        def run(ips):
+            counter["received"] = 0
+            counter["expected"] = len(ips)
+            done.clear()
+            started = time.perf_counter()
+            for ip in ips:
+                resolver.resolve(ip)
+            if not done.wait(timeout=300):
+                raise RuntimeError("Resolver did not answer every lookup")
+            return len(ips) / (time.perf_counter() - started)
+
+        rng = np.random.default_rng(2)
+        cold_ips = random_ipv4(rng, config["resolver_ips"], 'public')
+        # Same networks as the cold run with different host bits, so answers come from the prefix cache
+        warm_ips = [ip.rsplit('.', 1)[0] + f".{(int(ip.rsplit('.', 1)[1]) + 1) % 256}" for ip in cold_ips]
+        try:
+            results = {
+                "resolver.cold_lookups_per_second": metric(run(cold_ips), "lookups/s", "higher"),
+                "resolver.warm_lookups_per_second": metric(run(warm_ips), "lookups/s", "higher"),
+            }
+        finally:
+            resolver.stop()
+        app.processEvents()
+    return results
+
+def bench_map(config):
+    """MapGenerator cost against marker count: adding markers and saving the page."""
+    from map_generator import MapGenerator
+
+    rng = random.Random(3)
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for markers in config["marker_counts"]:
+            generator = MapGenerator(map_path=os.path.join(workdir, 'map.html'))
+            generator.save_map()
+            points = [(rng.uniform(-80, 80), rng.uniform(-180, 180)) for _ in range(markers)]
+            started = time.perf_counter()
+            for start in range(0, markers, 100):
+                new_markers = []
+                for lat, lon in points[start:start + 100]:
+                    popup = f"198.18.0.1\nNetwork {start}"
+                    if generator.add_location(lat, lon):
+                        new_markers.append((lat, lon, popup))
+                generator.markers_script(new_markers)
+            results[f"map.add_marker_us[markers={markers}]"] = metric(
+                (time.perf_counter() - started) / markers * 1e6, "us", "lower")
+
+            saves = 5
+            started = time.perf_counter()
+            for _ in range(saves):
+                generator.save_map()
+            results[f"map.save_ms[markers={markers}]"] = metric(
+                (time.perf_counter() - started) / saves * 1000, "ms", "lower")
+
+    scaling(results, "map.add_marker_us", config["marker_counts"], "markers")
+    scaling(results, "map.save_ms", config["marker_counts"], "markers")
+    return results
+
+BENCHMARKS = {
+    "ingest": bench_ingest,
+    "capture_processes": bench_capture_processes,
+    "handle_flows": bench_handle_flows,
+    "table": bench_table,
+    "filter": bench_filter,
+    "resolver": bench_resolver,
+    "map": bench_map,
+}
+
+# --- Harness ---
+
+def run_worker(name, config, result_path):
+    """Entry point of a worker process: runs one benchmark and writes its metrics (or why it was skipped)."""
+    try:
+        outcome = {"metrics": BENCHMARKS[name](config)}
+    except ImportError as e:
+        outcome = {"skipped": f"missing dependency: {e}"}
+    with open(result_path, 'w', encoding='utf-8') as f:
+        json.dump(outcome, f)
+
+def run_benchmark(name, config):
+    with tempfile.TemporaryDirectory() as workdir:
+        result_path = os.path.join(workdir, 'result.json')
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--worker', name,
+             '--config', json.dumps(config), '--result-file', result_path],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, check=False)
+        if completed.returncode != 0 or not os.path.exists(result_path):
+            return {"error": completed.stdout[-2000:]}
+        with open(result_path, encoding='utf-8') as f:
+            return json.load(f)
+
+def run_repeated(name, config, repeat):
+    """Runs a benchmark repeat times and keeps the median of each metric."""
+    outcomes = []
+    for _ in range(repeat):
+        outcome = run_benchmark(name, config)
+        if "metrics" not in outcome:
+            return outcome # Skipped or failed: running it again will not help
+        outcomes.append(outcome["metrics"])
+    metrics = {}
+    for key, first in outcomes[0].items():
+        values = [run_metrics[key]["value"] for run_metrics in outcomes if key in run_metrics]
+        metrics[key] = dict(first, value=round(statistics.median(values), 3))
+    return {"metrics": metrics, "runs": repeat}
+
+def compare(results, baseline, tolerance):
+    """Returns a list of regressions of the gated metrics; prints one line per metric."""
+    regressions = []
+    baseline_metrics = {}
+    for benchmark in baseline.get("benchmarks", {}).values():
+        baseline_metrics.update(benchmark.get("metrics", {}))
+    for outcome in results["benchmarks"].values():
+        for key, current in outcome.get("metrics", {}).items():
+            base = baseline_metrics.get(key)
+            if base is None:
+                print(f"  {key:55} {current['value']:>14,.3f} {current['unit']:10} (no baseline)")
+                continue
+            change = (current["value"] - base["value"]) / base["value"] if base["value"] else 0.0
+            worse = -change if current["better"] == "higher" else change
+            gate = current.get("gate", False)
+            status = ("REGRESSION" if worse > tolerance else "ok") if gate else "info"
+            print(f"  {key:55} {current['value']:>14,.3f} {current['unit']:10} "
+                  f"baseline {base['value']:>14,.3f} ({change:+.0%}) {status}")
+            if gate and worse > tolerance:
+                regressions.append(f"{key}: {current['value']:,.3f} {current['unit']} vs baseline "
+                                   f"{base['value']:,.3f} ({change:+.0%}, tolerance {tolerance:.0%})")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the Conmon benchmarks and compare them with a baseline")
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help="Benchmarks to run (default: all)")
+    parser.add_argument('--quick', action='store_true', help="Smaller sizes for a fast smoke run")
+    parser.add_argument('--flows', type=int, help="Number of synthetic flows")
+    parser.add_argument('--packets', type=int, help="Number of synthetic packets")
+    parser.add_argument('--packet-rate', type=int, help="Synthetic packets per second")
+    parser.add_argument('--distribution', choices=DISTRIBUTIONS, help="How packets spread over flows")
+    parser.add_argument('--output', default='benchmark_results.json', help="Where to write the results")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="Baseline results to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help="Allowed relative slowdown before a scaling ratio counts as a regression (default: 0.5)")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="Runs of each benchmark; the median of each metric is kept (default: 3)")
+    parser.add_argument('--update-baseline', action='store_true', help="Write the results as the new baseline")
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--config', help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        run_worker(args.worker, json.loads(args.config), args.result_file)
+        return 0
+
+    config = dict(QUICK_CONFIG if args.quick else DEFAULT_CONFIG)
+    for option in ("flows", "packets", "packet_rate", "distribution"):
+        if getattr(args, option) is not None:
+            config[option] = getattr(args, option)
+
+    results = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": config,
+        "benchmarks": {},
+    }
+    failed = False
+    for name in args.only or BENCHMARKS:
+        print(f"Running {name}...")
+        outcome = run_repeated(name, config, max(1, args.repeat))
+        results["benchmarks"][name] = outcome
+        if "skipped" in outcome:
+            print(f"  skipped: {outcome['skipped']}")
+        elif "error" in outcome:
+            print(f"  FAILED:\n{outcome['error']}")
+            failed = True
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline updated: {args.baseline}")
+        return 1 if failed else 0
+
+    regressions = []
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get("config") != config:
+            print("Note: the baseline was recorded with a different configuration; only matching metrics compare.")
+        print(f"Comparison with {args.baseline}:")
+        regressions = compare(results, baseline, args.tolerance)
+    else:
+        print(f"No baseline at {args.baseline}; run with --update-baseline to create one.")
+
+    if regressions:
+        print("\nPERFORMANCE REGRESSIONS:")
+        for regression in regressions:
+            print(f"  {regression}")
+    return 1 if failed or regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+# benchmarks/synthetic.py
+
+"""Deterministic synthetic traffic for the benchmarks: flows, packets, pcap files and flow batches."""
+
+import struct
+import numpy as np
+from flow_aggregator import FlowAggregator
+import ip_classify
+
+DISTRIBUTIONS = ('uniform', 'zipf')
+
+# 198.18.0.0/15 is reserved for benchmarking (RFC 2544), so generated traffic never names a real host
+BENCHMARK_NETWORK = 0xC6120000
+BENCHMARK_NETWORK_SIZE = 1 << 17
+
+class SyntheticTraffic:
+    """Generates outbound TCP traffic over a fixed set of flows.
+
+    flows: number of distinct (dst_ip, dst_port) flows.
+    destinations: number of distinct destination IPs the flows share.
+    packet_rate: packets per second, used for timestamps and batch sizes.
+    distribution: 'uniform' spreads packets evenly over flows; 'zipf' gives
+        a few heavy flows and a long tail of light ones, like real traffic.
+    address_space: 'benchmark' draws IPs from 198.18.0.0/15; 'public' from
+        the publicly routable unicast IPv4 space (useful for resolver cache behaviour).
+    """
+
+    def __init__(self, flows=1000, destinations=None, packet_rate=10000, distribution='zipf',
+                 zipf_exponent=1.1, address_space='benchmark', seed=1):
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError(f"Unknown distribution: {distribution}")
+        self.packet_rate = packet_rate
+        self.rng = np.random.default_rng(seed)
+        destinations = destinations or max(1, flows // 4)
+        addresses = random_ipv4(self.rng, destinations, address_space)
+        self.flows = [(addresses[i % destinations], 443 if i % 3 else 80 + i % 1000, 32768 + i % 28000)
+                      for i in range(flows)] # (dst_ip, dst_port, src_port)
+        if distribution == 'zipf':
+            weights = 1.0 / np.arange(1, flows + 1) ** zipf_exponent
+            self._weights = weights / weights.sum()
+        else:
+            self._weights = None
+
+    def packet_flows(self, count):
+        """Returns an array of flow indexes, one per packet."""
+        return self.rng.choice(len(self.flows), size=count, p=self._weights)
+
+    def packet_lengths(self, count):
+        """Mix of ACK-sized and full-sized packets."""
+        return np.where(self.rng.random(count) < 0.4, 66, self.rng.integers(200, 1514, count))
+
+    def frames(self, count):
+        """Yields (timestamp, Ethernet frame bytes truncated to the headers, wire length)."""
+        flow_indexes = self.packet_flows(count)
+        lengths = self.packet_lengths(count)
+        headers = [tcp_headers(dst_ip, src_port, dst_port) for dst_ip, dst_port, src_port in self.flows]
+        for i, (flow, length) in enumerate(zip(flow_indexes.tolist(), lengths.tolist())):
+            yield i / self.packet_rate, headers[flow], length
+
+    def write_pcap(self, path, count):
+        """Writes count header-only packets as a classic pcap file."""
+        with open(path, 'wb') as f:
+            f.write(struct.pack('<IHHiIII', 0xA1B2C3D4, 2, 4, 0, 0, 128, 1))
+            for timestamp, frame, length in self.frames(count):
+                seconds = int(timestamp)
+                f.write(struct.pack('<IIII', seconds, int((timestamp - seconds) * 1e6), len(frame), length))
+                f.write(frame)
+
+    def batches(self, count, flush_interval=0.2, interface='Ethernet'):
+        """Returns the flow batches a sniffer would emit for count packets, one per flush interval."""
+        aggregator = FlowAggregator()
+        per_batch = max(1, int(self.packet_rate * flush_interval))
+        flow_indexes = self.packet_flows(count)
+        lengths = self.packet_lengths(count)
+        batches = []
+        for i, (flow, length) in enumerate(zip(flow_indexes.tolist(), lengths.tolist())):
+            dst_ip, dst_port, _ = self.flows[flow]
+            aggregator.add(dst_ip, dst_port, interface, length, "bench.exe")
+            if (i + 1) % per_batch == 0:
+                batches.append(aggregator.flush())
+        last = aggregator.flush()
+        if last is not None:
+            batches.append(last)
+        return batches
+
+def random_ipv4(rng, count, address_space='benchmark'):
+    """Returns count distinct dotted IPv4 strings."""
+    if address_space == 'benchmark':
+        count = min(count, BENCHMARK_NETWORK_SIZE)
+        values = BENCHMARK_NETWORK + rng.choice(BENCHMARK_NETWORK_SIZE, size=count, replace=False)
+    else:
+        # 1.0.0.0 - 223.255.255.255 without the special-purpose ranges, which the resolver answers without
+        # a lookup. No such range fits between two candidates, so both ends being public covers the offsets.
+        candidates = np.arange(0x01000000, 0xE0000000, 251, dtype=np.int64)
+        public = ip_classify.KINDS.index(ip_classify.PUBLIC)
+        candidates = candidates[(ip_classify.classify_array(candidates) == public)
+                                & (ip_classify.classify_array(candidates + 250) == public)]
+        values = rng.choice(candidates, size=count, replace=False)
+        values += rng.integers(0, 251, count)
+    return [f"{v >> 24}.{v >> 16 & 255}.{v >> 8 & 255}.{v & 255}" for v in values.tolist()]
+
+def tcp_headers(dst_ip, src_port, dst_port):
+    """Ethernet + IPv4 + TCP headers of an outbound segment from 192.0.2.10."""
+    ethernet = b'\x00\x11\x22\x33\x44\x55\x66\x77\x88\x99\xaa\xbb\x08\x00'
+    ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 40, 0, 0x4000, 64, 6, 0,
+                     bytes([192, 0, 2, 10]), bytes(int(part) for part in dst_ip.split('.')))
+    tcp = struct.pack('!HHIIBBHHH', src_port, dst_port, 0, 0, 0x50, 0x18, 65535, 0, 0)
+    return ethernet + ip + tcp
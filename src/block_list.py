@@ -0,0 +1,76 @@
+# src/block_list.py
+
+import ipaddress
+from ip_classify import collapse_networks
+
+class BlockList:
+    """Destinations, ASNs, countries and processes the user chose to block.
+
+    An ASN or country is blocked through the address blocks the GeoIP
+    databases returned for destinations seen so far (the ASN network of each
+    resolved IP, or its city network). observe() is fed every resolver
+    result, so a blocked ASN or country keeps growing as new destinations in
+    it are resolved. Processes are blocked by name; the firewall blocks the
+    executables that run under those names (process_cache.executable_paths).
+    """
+
+    def __init__(self):
+        self.destinations = set() # IP strings
+        self.asns = set() # AS numbers
+        self.countries = set() # Country names, as the resolver reports them
+        self.processes = set() # Process names, as the process cache reports them
+        self._asn_prefixes = {} # AS number -> set of network strings seen for it
+        self._country_prefixes = {} # Country -> set of network strings seen for it
+
+    def __bool__(self):
+        return bool(self.destinations or self.asns or self.countries or self.processes)
+
+    def observe(self, results):
+        """Learns the address blocks of resolver results; returns True if a blocked ASN or country grew."""
+        grew = False
+        for result in results:
+            asn, prefix = result.get("asn"), result.get("asn_prefix")
+            if asn is not None and prefix is not None:
+                prefixes = self._asn_prefixes.setdefault(asn, set())
+                if prefix not in prefixes:
+                    prefixes.add(prefix)
+                    grew = grew or asn in self.asns
+            country, prefix = result.get("country"), result.get("geo_prefix")
+            if country not in (None, "N/A", "Unknown", "Error") and prefix is not None:
+                prefixes = self._country_prefixes.setdefault(country, set())
+                if prefix not in prefixes:
+                    prefixes.add(prefix)
+                    grew = grew or country in self.countries
+        return grew
+
+    def update(self, kind, values, block):
+        """Blocks or unblocks values of one kind (destination, asn, country or process); returns True if it changed."""
+        target = {"destination": self.destinations, "asn": self.asns, "country": self.countries,
+                  "process": self.processes}[kind]
+        before = len(target)
+        if block:
+            target.update(values)
+        else:
+            target.difference_update(values)
+        return len(target) != before
+
+    def clear(self):
+        changed = bool(self)
+        self.destinations.clear()
+        self.asns.clear()
+        self.countries.clear()
+        self.processes.clear()
+        return changed
+
+    def networks(self):
+        """Every blocked address block, collapsed: adjacent and overlapping networks are merged."""
+        networks = [ipaddress.ip_network(ip) for ip in self.destinations]
+        for asn in self.asns:
+            networks.extend(ipaddress.ip_network(prefix) for prefix in self._asn_prefixes.get(asn, ()))
+        for country in self.countries:
+            networks.extend(ipaddress.ip_network(prefix) for prefix in self._country_prefixes.get(country, ()))
+        return collapse_networks(networks)
+
+    def summary(self):
+        return (f"{len(self.destinations)} destinations, {len(self.asns)} ASNs, {len(self.countries)} countries, "
+                f"{len(self.processes)} processes")
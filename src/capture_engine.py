@@ -0,0 +1,440 @@
+# src/capture_engine.py
+
+import threading
+import asyncio
+import multiprocessing
+import os
+import socket
+import time
+import psutil
+from process_cache import ProcessCache
+from flow_aggregator import FlowAggregator
+from metrics import REGISTRY
+import capture_filter
+import ip_classify
+import raw_capture
+import capture_ring
+
+CAPTURE_BACKENDS = ('pyshark', 'raw')
+
+PACKETS_CAPTURED = REGISTRY.counter(
+    "conmon_packets_captured_total", "Frames read from the capture source", ("interface",))
+PACKETS_PARSED = REGISTRY.counter(
+    "conmon_packets_parsed_total", "Frames parsed as outbound TCP or UDP to a public destination", ("interface",))
+PACKETS_UNPARSED = REGISTRY.counter(
+    "conmon_packets_unparsed_total",
+    "Frames that could not be parsed or were filtered out (not TCP/UDP over IP, or a LAN destination)", ("interface",))
+CAPTURE_ERRORS = REGISTRY.counter(
+    "conmon_capture_errors_total", "Capture threads that stopped because of an error", ("interface",))
+BATCHES_EMITTED = REGISTRY.counter("conmon_flow_batches_emitted_total", "Flow batches delivered to the front end")
+AGGREGATOR_PENDING = REGISTRY.gauge(
+    "conmon_aggregator_pending_flows", "Flows with traffic waiting for the next flush")
+PROCESS_LOOKUPS = REGISTRY.counter(
+    "conmon_process_lookups_total", "Process attribution lookups by how they were answered", ("result",))
+RING_OVERFLOWS = REGISTRY.counter(
+    "conmon_capture_ring_overflows_total",
+    "Packets a capture worker dropped because its shared-memory ring was full", ("interface",))
+RING_DRAIN_RECORDS = REGISTRY.histogram(
+    "conmon_capture_ring_drain_records", "Records taken from one capture ring per drain",
+    buckets=(1, 10, 100, 1000, 10000, 100000))
+
+RING_DRAIN_INTERVAL = 0.01 # Seconds between drains, so each takes many records at once
+OVERFLOW_REPORT_INTERVAL = 5.0 # Seconds between ring overflow warnings
+
+class CaptureEngine:
+    """Captures outbound TCP and UDP on several interfaces (or replays a capture file) into flows.
+
+    Pure Python, so it runs the same under the Qt GUI and headless. Every
+    flush_interval_ms the flush thread calls on_batch(batch) with the deltas
+    of FlowAggregator.flush, and once a replayed file is exhausted it calls
+    on_replay_finished(stats). Both callbacks run on the flush thread.
+
+    Live captures filter in the kernel with capture_filter: only the headers
+    of packets to public destinations are copied, and the filter follows the
+    host's interface addresses as they change.
+
+    With processes set, each interface (or the replayed file) is captured in
+    a worker process writing to a capture_ring.CaptureRing, and one drain
+    thread moves the records into the aggregator in bulk. Packets a full ring
+    had to drop are counted per interface in ring_overflows.
+    """
+
+    def __init__(self, interfaces=None, backend='pyshark', flush_interval_ms=200,
+                 replay_path=None, replay_speed=0.0, on_batch=None, on_replay_finished=None,
+                 processes=False, ring_size=capture_ring.DEFAULT_RING_SIZE):
+        if backend not in CAPTURE_BACKENDS:
+            raise ValueError(f"Unknown capture backend: {backend}")
+        self.interfaces = interfaces if interfaces is not None else []
+        self.replay_path = replay_path # Read packets from a pcap/pcapng file instead of capturing
+        self.replay_speed = replay_speed # 0 = as fast as possible, 1 = original timing
+        if replay_path is not None:
+            self.interfaces = [os.path.basename(replay_path)]
+        self.backend = backend
+        self.on_batch = on_batch
+        self.on_replay_finished = on_replay_finished
+        self.captures = []
+        self.running = True
+        self.threads = []
+        self.flush_thread = None
+        self.process_cache = ProcessCache()
+        self.aggregator = FlowAggregator()
+        self.flush_interval_ms = flush_interval_ms
+        self.replay_stats = None
+        # interface -> [frames captured, frames parsed, errors]; each list is only written by its capture
+        # thread, so counting costs no lock per packet and collect_metrics() publishes the totals.
+        self.interface_stats = {iface: [0, 0, 0] for iface in self.interfaces}
+        self.batches_emitted = 0
+        self.processes = processes
+        self.ring_size = ring_size
+        self.workers = [] # (interface, CaptureRing, worker process) with processes set
+        self.ring_overflows = {iface: 0 for iface in self.interfaces}
+        self._stop_event = None
+
+    def start(self):
+        if self.processes:
+            self._start_workers()
+        elif self.replay_path is not None:
+            print(f"Replaying {self.replay_path} (speed: {self.replay_speed or 'max'})")
+            thread = threading.Thread(target=self._replay_blocking)
+            self.threads.append(thread)
+            thread.start()
+        else:
+            print(f"Starting {self.backend} sniffer on interfaces: {', '.join(self.interfaces)}")
+            self.process_cache.start()
+
+            target = self._sniff_raw_blocking if self.backend == 'raw' else self._sniff_single_interface_blocking
+            for iface in self.interfaces:
+                thread = threading.Thread(target=target, args=(iface,))
+                self.threads.append(thread)
+                thread.start()
+        self.flush_thread = threading.Thread(target=self._flush_loop, name="FlowFlush", daemon=True)
+        self.flush_thread.start()
+
+    def _start_workers(self):
+        if self.replay_path is not None:
+            print(f"Replaying {self.replay_path} in a worker process (speed: {self.replay_speed or 'max'})")
+            self.start_replay_workers()
+        else:
+            print(f"Starting {self.backend} capture processes on interfaces: {', '.join(self.interfaces)}")
+            self.process_cache.start()
+            for iface in self.interfaces:
+                self._start_worker(iface, capture_ring.capture_worker, (iface, self.backend))
+        thread = threading.Thread(target=self.drain, name="CaptureRingDrain")
+        self.threads.append(thread)
+        thread.start()
+
+    def start_replay_workers(self, count=1):
+        """Starts count worker processes that each replay replay_path into a ring of their own.
+
+        start() uses one; more replay the same file side by side, which is how
+        the benchmarks measure draining several rings. Their records reach the
+        aggregator through drain().
+        """
+        interface = self.interfaces[0]
+        for index in range(count):
+            iface = interface if index == 0 else f"{interface}#{index + 1}"
+            self.interface_stats.setdefault(iface, [0, 0, 0])
+            self.ring_overflows.setdefault(iface, 0)
+            self._start_worker(iface, capture_ring.replay_worker, (self.replay_path, self.replay_speed))
+
+    def _start_worker(self, iface, target, args):
+        # spawn rather than fork everywhere: the parent already runs threads (and Qt), which fork does not copy
+        context = multiprocessing.get_context("spawn")
+        if self._stop_event is None:
+            self._stop_event = context.Event()
+        ring = capture_ring.CaptureRing(self.ring_size)
+        worker = context.Process(target=target, name=f"Capture-{iface}", daemon=True,
+                                 args=(ring.name, self.ring_size) + args + (self._stop_event,))
+        worker.start()
+        self.workers.append((iface, ring, worker))
+
+    def drain(self):
+        """Moves records from the worker rings into the aggregator until the workers are gone or stop().
+
+        start() runs it on a thread of its own.
+        """
+        lookup = self.process_cache.lookup
+        add = self.aggregator.add
+        to_str = raw_capture.ip_to_str
+        replaying = self.replay_path is not None
+        next_report = 0.0
+        reported = 0
+        while True:
+            # Decided before draining, so records written just before a worker exited are still taken
+            finished = not self.running or not any(worker.is_alive() for _, _, worker in self.workers)
+            behind = False
+            for iface, ring, _ in self.workers:
+                records = ring.drain()
+                if records:
+                    behind = behind or len(records) > ring.capacity // 2
+                    RING_DRAIN_RECORDS.observe(len(records))
+                    # Packets of the same flow are summed first, so each flow costs one lookup and one add
+                    flows = {}
+                    for high, low, src_port, dst_port, length in records:
+                        flow = flows.get((low, high, src_port, dst_port))
+                        if flow is None:
+                            flows[(low, high, src_port, dst_port)] = [length, 1]
+                        else:
+                            flow[0] += length
+                            flow[1] += 1
+                    for (low, high, src_port, dst_port), (length, packets) in flows.items():
+                        dst_ip = to_str(high << 64 | low)
+                        # A replay's sending processes belong to the recording host, so none are looked up
+                        process_name = "Unknown" if replaying else lookup(src_port, (dst_ip, src_port, dst_port))
+                        add(dst_ip, dst_port, iface, length, process_name, packets)
+                counts = self.interface_stats[iface]
+                counts[0], counts[1], counts[2] = ring.captured, ring.parsed, ring.errors
+                self.ring_overflows[iface] = ring.overflows
+            overflows = sum(self.ring_overflows.values())
+            if overflows > reported and time.monotonic() >= next_report:
+                print(f"Capture rings full: {overflows - reported:,} packets dropped "
+                      f"({overflows:,} in total, see --capture-ring-size)")
+                reported = overflows
+                next_report = time.monotonic() + OVERFLOW_REPORT_INTERVAL
+            if finished:
+                break
+            if not behind: # Otherwise go again at once, before a ring fills up
+                time.sleep(RING_DRAIN_INTERVAL)
+        if replaying and self.workers:
+            ring = self.workers[0][1]
+            if ring.seconds > 0: # The worker got to the end of the file
+                self.replay_stats = {
+                    "packets": ring.captured,
+                    "parsed_packets": ring.parsed,
+                    "seconds": ring.seconds,
+                    "packets_per_second": ring.captured / ring.seconds,
+                }
+
+    def _flush_loop(self):
+        """Flushes aggregated flow deltas on a fixed interval while the capture threads are running."""
+        try:
+            while self.running:
+                time.sleep(self.flush_interval_ms / 1000)
+                self._emit_batch()
+                if self.replay_path is not None and not self.threads[0].is_alive():
+                    break # The file is exhausted
+        finally:
+            self._emit_batch() # Deliver whatever was captured after the last tick
+        if self.replay_path is not None and self.replay_stats is not None and self.on_replay_finished:
+            self.on_replay_finished(self.replay_stats)
+
+    def _emit_batch(self):
+        batch = self.aggregator.flush()
+        if batch is not None:
+            self.batches_emitted += 1
+            if self.on_batch is not None:
+                self.on_batch(batch)
+
+    def is_alive(self):
+        """True until the flush thread has delivered its last batch (a finished replay, or stop())."""
+        return self.flush_thread is not None and self.flush_thread.is_alive()
+
+    def forget(self, dst_ip, dst_port, interface):
+        """Called for each flow evicted downstream: it is announced as new again, with a fresh process lookup."""
+        self.aggregator.forget(dst_ip, dst_port, interface)
+        self.process_cache.forget(dst_ip, dst_port)
+
+    def collect_metrics(self):
+        """Publishes the capture counters; registered with the metrics registry by the application."""
+        for iface, (captured, parsed, errors) in list(self.interface_stats.items()):
+            PACKETS_CAPTURED.set_total(captured, interface=iface)
+            PACKETS_PARSED.set_total(parsed, interface=iface)
+            PACKETS_UNPARSED.set_total(captured - parsed, interface=iface)
+            CAPTURE_ERRORS.set_total(errors, interface=iface)
+            if self.processes:
+                RING_OVERFLOWS.set_total(self.ring_overflows[iface], interface=iface)
+        BATCHES_EMITTED.set_total(self.batches_emitted)
+        AGGREGATOR_PENDING.set(self.aggregator.pending())
+        stats = self.process_cache.stats()
+        for result in ("flow_hits", "port_hits", "misses"):
+            PROCESS_LOOKUPS.set_total(stats[result], result=result)
+
+    def _sniff_single_interface_blocking(self, iface_name):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        counts = self.interface_stats[iface_name]
+        try:
+            watcher = capture_filter.NetworkWatcher(iface_name)
+            restart = True
+            while restart:
+                restart = False
+                capture = capture_ring.pyshark_capture(iface_name, capture_filter.bpf_expression(watcher.networks))
+                try:
+                    for packet in capture.sniff_continuously(packet_count=None):
+                        if not self.running:
+                            break
+                        if watcher.refresh():
+                            restart = True # With the new filter
+                            break
+                        counts[0] += 1
+                        try:
+                            headers = capture_ring.pyshark_headers(packet)
+                            process_name = self.process_cache.lookup(headers[1], headers)
+                            self.aggregator.add(headers[0], headers[2], iface_name, int(packet.length), process_name)
+                            counts[1] += 1
+                        except AttributeError:
+                            pass # Ignore packets that are not TCP or UDP over IP
+                finally:
+                    capture.close()
+        except Exception as e:
+            counts[2] += 1
+            print(f"Error sniffing on interface {iface_name}: {e}")
+        finally:
+            loop.close()
+
+    def _sniff_raw_blocking(self, iface_name):
+        """Header-only capture: parses Ethernet/IP/TCP/UDP in place instead of dissecting with tshark."""
+        source = None
+        try:
+            source = capture_filter.FilteredInterface(iface_name)
+            self.captures.append(source)
+            lookup = self.process_cache.lookup
+            add = self.aggregator.add
+            is_running = lambda: self.running
+            counts = self.interface_stats[iface_name]
+            for view, length, linktype in source.frames(is_running):
+                counts[0] += 1
+                headers = raw_capture.parse_frame(view, linktype, skip_private=True)
+                if headers is None:
+                    continue # Ignore packets that are not TCP or UDP over IP, and LAN destinations
+                counts[1] += 1
+                dst_ip, src_port, dst_port = headers
+                add(dst_ip, dst_port, iface_name, length, lookup(src_port, headers))
+        except Exception as e:
+            self.interface_stats[iface_name][2] += 1
+            print(f"Error sniffing on interface {iface_name}: {e}")
+        finally:
+            if source:
+                source.close()
+
+    def _replay_blocking(self):
+        """Feeds a capture file through the aggregator, optionally paced by the packet timestamps."""
+        source = None
+        try:
+            source = raw_capture.open_capture_file(self.replay_path)
+            self.captures.append(source)
+            interface = self.interfaces[0]
+            add = self.aggregator.add
+            is_running = lambda: self.running
+            counts = self.interface_stats[interface]
+            packets = parsed_packets = 0
+            first_timestamp = None
+            started = time.perf_counter()
+            for timestamp, view, length, linktype in source.records(is_running):
+                packets += 1
+                counts[0] += 1
+                if self.replay_speed > 0:
+                    if first_timestamp is None:
+                        first_timestamp = timestamp
+                    due = started + (timestamp - first_timestamp) / self.replay_speed
+                    while self.running and time.perf_counter() < due:
+                        time.sleep(min(due - time.perf_counter(), 0.1))
+                headers = raw_capture.parse_frame(view, linktype, skip_private=True)
+                if headers is None:
+                    continue # Ignore packets that are not TCP or UDP over IP, and LAN destinations
+                parsed_packets += 1
+                counts[1] += 1
+                # The sending processes belong to the recording host, so none are looked up
+                add(headers[0], headers[2], interface, length, "Unknown")
+            elapsed = time.perf_counter() - started
+            self.replay_stats = {
+                "packets": packets,
+                "parsed_packets": parsed_packets,
+                "seconds": elapsed,
+                "packets_per_second": packets / elapsed if elapsed > 0 else 0.0,
+            }
+        except Exception as e:
+            self.interface_stats[self.interfaces[0]][2] += 1
+            print(f"Error replaying {self.replay_path}: {e}")
+        finally:
+            if source:
+                source.close()
+
+    def dropped(self):
+        """Packets the capture rings had to drop so far (always 0 without worker processes)."""
+        return sum(self.ring_overflows.values())
+
+    def stop(self):
+        print("Stopping sniffer...")
+        self.running = False
+        for capture in self.captures:
+            capture.close()
+        if self._stop_event is not None:
+            self._stop_event.set()
+        for _, _, worker in self.workers:
+            worker.join(timeout=2) # Capture sources time out within a second
+            if worker.is_alive():
+                worker.terminate() # E.g. pyshark waiting for a packet
+        for thread in self.threads:
+            thread.join(timeout=1) # Give threads a chance to finish
+        if self.flush_thread is not None:
+            self.flush_thread.join()
+        for iface, ring, _ in self.workers:
+            if self.ring_overflows[iface]:
+                print(f"Capture ring for {iface} dropped {self.ring_overflows[iface]:,} packets")
+            ring.close()
+        self.process_cache.stop()
+        print(f"Process cache stats: {self.process_cache.stats()}")
+
+def get_lan_interface():
+    """Attempts to find the primary non-loopback, non-VPN LAN interface, prioritizing 'Ethernet'."""
+    addresses = psutil.net_if_addrs()
+    stats = psutil.net_if_stats()
+    
+    potential_interfaces = []
+    ethernet_interface = None
+
+    for iface_name, iface_addrs in addresses.items():
+        print(f"Considering interface: {iface_name}")
+        if iface_name == 'NordLynx':  # Skip the VPN interface
+            print(f"  Skipping {iface_name}: VPN interface.")
+            continue
+
+        if iface_name not in stats or not stats[iface_name].isup:
+            print(f"  Skipping {iface_name}: Not up or no stats.")
+            continue  # Skip inactive interfaces
+
+        has_ipv4 = False
+        for snicaddr in iface_addrs:
+            if snicaddr.family == socket.AF_INET:  # Look for IPv4 addresses
+                has_ipv4 = True
+                # Exclude loopback and APIPA addresses
+                if ip_classify.classify_ip(snicaddr.address) not in (ip_classify.LOOPBACK, ip_classify.LINK_LOCAL):
+                    print(f"  Found potential LAN IPv4 for {iface_name}: {snicaddr.address}")
+                    if iface_name == 'Ethernet':
+                        ethernet_interface = iface_name
+                    else:
+                        potential_interfaces.append(iface_name)
+                    break # Found a valid IPv4, move to next interface
+        
+        if not has_ipv4:
+            print(f"  Skipping {iface_name}: No IPv4 address.")
+
+    if ethernet_interface:
+        print(f"Selected LAN interface: {ethernet_interface} (Prioritized Ethernet)")
+        return ethernet_interface
+    elif potential_interfaces:
+        print(f"Selected LAN interface: {potential_interfaces[0]} (First available)")
+        return potential_interfaces[0]
+    
+    print("No suitable LAN interface found.")
+    return None
+
+def default_interfaces():
+    """The VPN interface plus the primary LAN interface, when one is found."""
+    interfaces = ['NordLynx']
+    lan_iface = get_lan_interface()
+    if lan_iface and lan_iface not in interfaces:
+        interfaces.append(lan_iface)
+    return interfaces
+
+def replay_report(stats, batch_latencies):
+    """Lines summarizing replay throughput and the capture-to-consumer latency of its batches."""
+    lines = [f"Replayed {stats['packets']} packets ({stats['parsed_packets']} TCP/UDP) in {stats['seconds']:.2f} s: "
+             f"{stats['packets_per_second']:,.0f} packets/s"]
+    if batch_latencies:
+        latencies = sorted(batch_latencies)
+        percentile = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+        lines.append(f"End-to-end batch latency over {len(latencies)} batches: p50 {percentile(0.5):.1f} ms, "
+                     f"p95 {percentile(0.95):.1f} ms, max {latencies[-1] * 1000:.1f} ms")
+    return lines
@@ -0,0 +1,229 @@
+# src/capture_filter.py
+
+"""Capture filters built from the host's own networks, so the kernel drops LAN traffic before copying it.
+
+The filter keeps outgoing TCP and UDP over IPv4 and IPv6 and drops every
+destination that ip_classify counts as staying on the host or its link
+(private, loopback, link-local, multicast and reserved ranges, and the
+subnets of the host's interfaces). It comes in two forms:
+
+  bpf_expression()  a libpcap expression for dumpcap and pyshark
+  bpf_program()     classic BPF instructions for an AF_PACKET socket (Linux),
+                    whose accept value is the snaplen: the kernel copies only
+                    the headers of the packets it keeps
+
+A NetworkWatcher re-reads the interface addresses every few seconds, and
+the capture swaps in a new filter when they change (a VPN connecting, a new
+DHCP lease) without being restarted.
+"""
+
+import time
+import ip_classify
+import raw_capture
+
+REFRESH_INTERVAL = 5.0 # Seconds between checks of the interface addresses
+
+# Classic BPF opcodes (linux/filter.h)
+BPF_LD_W_ABS = 0x20
+BPF_LD_H_ABS = 0x28
+BPF_LD_B_ABS = 0x30
+BPF_ALU_AND_K = 0x54
+BPF_ALU_RSH_K = 0x74
+BPF_JMP_JA = 0x05
+BPF_JMP_JEQ_K = 0x15
+BPF_JMP_JSET_K = 0x45
+BPF_RET_K = 0x06
+SKF_AD_PKTTYPE = 0xFFFFF000 + 4 # SKF_AD_OFF + SKF_AD_PKTTYPE, as an unsigned offset
+
+def excluded_networks(local=None):
+    """The networks the capture drops: the UNCAPTURED kinds of ip_classify, local subnets included.
+
+    local defaults to the local subnets of the shared classification table,
+    which NetworkWatcher keeps up to date.
+    """
+    table = ip_classify.table() if local is None else ip_classify.AddressTable(ip_classify.collapse_networks(local))
+    return table.networks(ip_classify.UNCAPTURED)
+
+def bpf_expression(networks):
+    """The libpcap form of the filter: outgoing TCP and UDP to anything outside networks."""
+    if not networks:
+        return "tcp or udp"
+    return f"(tcp or udp) and not ({' or '.join(f'dst net {network}' for network in networks)})"
+
+def bpf_program(networks, linktype, snaplen=raw_capture.SNAPLEN):
+    """Classic BPF instructions, (code, jt, jf, k) tuples, for an AF_PACKET socket of the given link type.
+
+    Accepts outgoing IPv4 and IPv6 TCP and UDP (and IPv6 packets whose
+    extension headers hide the transport, and VLAN-tagged frames, which
+    parse_headers() sorts out) to destinations outside networks, returning
+    snaplen so only the headers are copied. Returns None for a link type it
+    does not know. Conditional jumps only ever skip a few instructions, so no
+    offset overflows the 8-bit jump fields however many networks there are.
+    """
+    if linktype == raw_capture.LINKTYPE_ETHERNET:
+        base = 14
+    elif linktype == raw_capture.LINKTYPE_RAW:
+        base = 0
+    else:
+        return None
+    program = _Assembler()
+    program.add(BPF_LD_W_ABS, 0, 0, SKF_AD_PKTTYPE)
+    program.add(BPF_JMP_JEQ_K, 1, 0, raw_capture.PACKET_OUTGOING)
+    program.add(BPF_RET_K, 0, 0, 0)
+    if base:
+        program.add(BPF_LD_H_ABS, 0, 0, 12)
+        program.branch(raw_capture.ETHERTYPE_IPV4, "ipv4")
+        program.branch(raw_capture.ETHERTYPE_IPV6, "ipv6")
+        program.add(BPF_JMP_JEQ_K, 0, 1, raw_capture.ETHERTYPE_VLAN)
+        program.add(BPF_RET_K, 0, 0, snaplen)
+    else:
+        program.add(BPF_LD_B_ABS, 0, 0, 0)
+        program.add(BPF_ALU_RSH_K, 0, 0, 4)
+        program.branch(4, "ipv4")
+        program.branch(6, "ipv6")
+    program.add(BPF_RET_K, 0, 0, 0)
+
+    program.label("ipv4")
+    program.add(BPF_LD_B_ABS, 0, 0, base + 9) # Protocol
+    program.add(BPF_JMP_JEQ_K, 2, 0, raw_capture.IPPROTO_TCP)
+    program.add(BPF_JMP_JEQ_K, 1, 0, raw_capture.IPPROTO_UDP)
+    program.add(BPF_RET_K, 0, 0, 0)
+    program.add(BPF_LD_H_ABS, 0, 0, base + 6) # Only the first fragment carries the ports
+    program.add(BPF_JMP_JSET_K, 0, 1, 0x1FFF)
+    program.add(BPF_RET_K, 0, 0, 0)
+    for network in networks:
+        if network.version == 4:
+            program.reject_network(base + 16, network)
+    program.add(BPF_RET_K, 0, 0, snaplen)
+
+    program.label("ipv6")
+    program.add(BPF_LD_B_ABS, 0, 0, base + 6) # Next header
+    next_headers = raw_capture.TRANSPORT_PROTOCOLS + raw_capture.IPV6_EXTENSION_HEADERS
+    for index, next_header in enumerate(next_headers):
+        program.add(BPF_JMP_JEQ_K, len(next_headers) - index, 0, next_header)
+    program.add(BPF_RET_K, 0, 0, 0)
+    for network in networks:
+        if network.version == 6:
+            program.reject_network(base + 24, network)
+    program.add(BPF_RET_K, 0, 0, snaplen)
+    return program.resolve()
+
+def _read_networks():
+    """Re-reads the interface addresses into the shared classification table; its excluded networks."""
+    ip_classify.set_local_networks(ip_classify.local_networks())
+    return excluded_networks()
+
+class NetworkWatcher:
+    """The excluded networks of a capture, re-read from the interfaces at most every interval seconds."""
+
+    def __init__(self, name, interval=REFRESH_INTERVAL):
+        self.name = name
+        self.interval = interval
+        self.networks = _read_networks()
+        self.updates = 0
+        self._next_check = time.monotonic() + interval
+
+    def refresh(self):
+        """Cheap enough to call per packet; returns True when the networks changed since the last call."""
+        now = time.monotonic()
+        if now < self._next_check:
+            return False
+        self._next_check = now + self.interval
+        networks = _read_networks()
+        if networks == self.networks:
+            return False
+        self.networks = networks
+        self.updates += 1
+        print(f"Local networks changed, updating the capture filter on {self.name}: {bpf_expression(networks)}")
+        return True
+
+class FilteredInterface:
+    """A live capture of one interface whose filter follows the host's networks.
+
+    Has the frames()/close() interface of the raw_capture sources. When the
+    interface addresses change, an AF_PACKET socket gets a new program in
+    place; a dumpcap pipe is restarted with the new expression.
+    """
+
+    def __init__(self, iface_name, snaplen=raw_capture.SNAPLEN, interval=REFRESH_INTERVAL):
+        self.iface_name = iface_name
+        self.snaplen = snaplen
+        self.watcher = NetworkWatcher(iface_name, interval)
+        self.closed = False
+        self.source = self._open()
+
+    def _open(self):
+        source = raw_capture.open_interface(self.iface_name, bpf_expression(self.watcher.networks), self.snaplen)
+        if hasattr(source, 'attach_filter'):
+            self._attach(source)
+        return source
+
+    def _attach(self, source):
+        program = bpf_program(self.watcher.networks, source.linktype, self.snaplen)
+        if program is not None:
+            source.attach_filter(program)
+
+    def frames(self, is_running):
+        """Yields (view, wire_length, linktype) like the source's frames(), across filter changes."""
+        restart = False
+        def running():
+            nonlocal restart
+            if self.watcher.refresh():
+                if not hasattr(self.source, 'attach_filter'):
+                    restart = True
+                    return False
+                self._attach(self.source)
+            return is_running()
+        while True:
+            yield from self.source.frames(running)
+            if not restart or self.closed or not is_running():
+                return
+            restart = False
+            self.source.close()
+            self.source = self._open()
+
+    def close(self):
+        self.closed = True
+        self.source.close()
+
+class _Assembler:
+    """Collects instructions and resolves the labels of unconditional (32-bit offset) jumps."""
+
+    def __init__(self):
+        self.instructions = []
+        self.labels = {}
+        self.jumps = [] # (index of a ja instruction, label)
+
+    def add(self, code, jt, jf, k):
+        self.instructions.append([code, jt, jf, k])
+
+    def label(self, name):
+        self.labels[name] = len(self.instructions)
+
+    def branch(self, value, label):
+        """If the accumulator equals value, jump to label."""
+        self.add(BPF_JMP_JEQ_K, 0, 1, value)
+        self.jumps.append((len(self.instructions), label))
+        self.add(BPF_JMP_JA, 0, 0, 0)
+
+    def reject_network(self, offset, network):
+        """Drops the packet if the address at offset lies in network, comparing it a 32-bit word at a time."""
+        packed = network.network_address.packed
+        block = []
+        for word in range((network.prefixlen + 31) // 32):
+            bits = min(32, network.prefixlen - word * 32)
+            mask = (0xFFFFFFFF << (32 - bits)) & 0xFFFFFFFF
+            block.append([BPF_LD_W_ABS, 0, 0, offset + word * 4])
+            if mask != 0xFFFFFFFF:
+                block.append([BPF_ALU_AND_K, 0, 0, mask])
+            block.append([BPF_JMP_JEQ_K, 0, 0, int.from_bytes(packed[word * 4:word * 4 + 4], 'big')])
+        block.append([BPF_RET_K, 0, 0, 0])
+        for index, instruction in enumerate(block):
+            if instruction[0] == BPF_JMP_JEQ_K:
+                instruction[2] = len(block) - index - 1 # A mismatch skips the rest of the block
+        self.instructions.extend(block)
+
+    def resolve(self):
+        for index, label in self.jumps:
+            self.instructions[index][3] = self.labels[label] - index - 1
+        return [tuple(instruction) for instruction in self.instructions]
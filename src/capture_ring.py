@@ -0,0 +1,264 @@
+# src/capture_ring.py
+
+"""Capture worker processes and the shared-memory ring buffers they write to.
+
+Each worker captures one interface (or replays the file) in its own process,
+so parsing runs outside the GIL of the front end. It writes one fixed-size
+record per parsed packet into a single-producer, single-consumer ring in
+shared memory, and CaptureEngine drains every ring in bulk.
+
+Layout of a ring:
+  0    producer header: write index, overflows, captured, parsed, errors, replay seconds
+  64   consumer header: read index
+  128  capacity records of RECORD: destination (high and low 64 bits of the
+       number parse_headers returns), source port, destination port, wire length
+
+Indexes only grow; a record lives in slot index % capacity. The producer
+writes a record before publishing the new write index, so the consumer never
+sees a half-written one. A full ring drops the packet and counts it as an
+overflow (a replay waits for room instead, so its results stay exact).
+
+Workers do not publish per packet: a background thread in each worker
+publishes every PUBLISH_INTERVAL, and polls the stop event at the same
+time, so the capture loop itself only writes records.
+"""
+
+import signal
+import socket
+import struct
+import sys
+import threading
+import time
+from multiprocessing import shared_memory
+import capture_filter
+import raw_capture
+
+DEFAULT_RING_SIZE = 65536 # Records per interface: a third of a second of a 200k packets/s burst
+RECORD = struct.Struct('<QQHHI')
+PRODUCER_HEADER = struct.Struct('<QQQQQd')
+READ_INDEX = struct.Struct('<Q')
+READ_OFFSET = 64
+DATA_OFFSET = 128
+PUBLISH_INTERVAL = 0.005 # Seconds between publishes of a worker's ring, which bounds the latency it adds
+
+class CaptureRing:
+    """A ring of packet records in shared memory; created by the engine, attached to by name in the worker."""
+
+    def __init__(self, capacity=DEFAULT_RING_SIZE, name=None):
+        self.capacity = capacity
+        self.creator = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.creator,
+                                              size=DATA_OFFSET + capacity * RECORD.size)
+        self.buffer = self.shm.buf
+        # Producer side
+        self.write_index = 0
+        self.overflows = 0
+        self.captured = 0
+        self.parsed = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self._read_seen = 0 # Read index last loaded from shared memory
+        # Consumer side
+        self.read_index = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    # --- Producer (worker process) ---
+
+    def put(self, dst_ip, src_port, dst_port, length, wait=None):
+        """Appends a record; returns False (and counts an overflow) if the ring is full.
+
+        dst_ip is a number, as parse_headers() returns it. With wait, a
+        callable, it instead waits for room for as long as wait() is true.
+        """
+        if self.write_index - self._read_seen >= self.capacity:
+            while True:
+                self._read_seen = READ_INDEX.unpack_from(self.buffer, READ_OFFSET)[0]
+                if self.write_index - self._read_seen < self.capacity:
+                    break
+                if wait is None or not wait():
+                    self.overflows += 1
+                    return False
+                time.sleep(0.001)
+        RECORD.pack_into(self.buffer, DATA_OFFSET + self.write_index % self.capacity * RECORD.size,
+                         dst_ip >> 64, dst_ip & 0xFFFFFFFFFFFFFFFF, src_port, dst_port, length)
+        self.write_index += 1
+        return True
+
+    def publish(self):
+        """Makes the records and counters written so far visible to the consumer."""
+        PRODUCER_HEADER.pack_into(self.buffer, 0, self.write_index, self.overflows, self.captured,
+                                  self.parsed, self.errors, self.seconds)
+
+    # --- Consumer (engine) ---
+
+    def drain(self):
+        """Returns the records published since the last drain as tuples.
+
+        Each is (high and low 64 bits of dst_ip, src_port, dst_port, length).
+        Also loads the producer's counters into this object's attributes.
+        """
+        (write_index, self.overflows, self.captured, self.parsed,
+         self.errors, self.seconds) = PRODUCER_HEADER.unpack_from(self.buffer, 0)
+        count = write_index - self.read_index
+        if not count:
+            return []
+        # At most two contiguous runs: up to the end of the buffer, then from its start
+        start = self.read_index % self.capacity
+        first = min(count, self.capacity - start)
+        data = bytes(self.buffer[DATA_OFFSET + start * RECORD.size:DATA_OFFSET + (start + first) * RECORD.size])
+        if first < count:
+            data += bytes(self.buffer[DATA_OFFSET:DATA_OFFSET + (count - first) * RECORD.size])
+        self.read_index = write_index
+        READ_INDEX.pack_into(self.buffer, READ_OFFSET, write_index)
+        return list(RECORD.iter_unpack(data))
+
+    def close(self):
+        self.buffer = None
+        self.shm.close()
+        if self.creator:
+            self.shm.unlink()
+
+class _RingPublisher:
+    """Publishes a worker's ring and polls its stop event every PUBLISH_INTERVAL from a background thread.
+
+    It is the ring's only publisher until stop(), which publishes one last
+    time. is_running() reads a flag instead of the cross-process event, so
+    the capture loop can call it for every packet.
+    """
+
+    def __init__(self, ring, stop_event):
+        self.ring = ring
+        self.stop_event = stop_event
+        self.running = not stop_event.is_set()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="RingPublisher", daemon=True)
+        self._thread.start()
+
+    def is_running(self):
+        return self.running
+
+    def _run(self):
+        while not self._stopped.wait(PUBLISH_INTERVAL):
+            self.ring.publish()
+            if self.running and self.stop_event.is_set():
+                self.running = False
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        self.ring.publish()
+
+def _start_worker(ring_name, capacity):
+    # Diagnostics go to stderr: in headless mode stdout carries the snapshot stream.
+    # Ctrl+C is handled by the parent, which stops the workers through the stop event.
+    sys.stdout = sys.stderr
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    return CaptureRing(capacity, name=ring_name)
+
+def capture_worker(ring_name, capacity, iface_name, backend, stop_event):
+    """Worker process entry point: captures one interface into the ring until stop_event is set."""
+    ring = _start_worker(ring_name, capacity)
+    publisher = _RingPublisher(ring, stop_event)
+    try:
+        if backend == 'raw':
+            _capture_raw(ring, iface_name, publisher.is_running)
+        else:
+            _capture_pyshark(ring, iface_name, publisher.is_running)
+    except Exception as e:
+        ring.errors += 1
+        print(f"Error sniffing on interface {iface_name}: {e}")
+    finally:
+        publisher.stop()
+        ring.close()
+
+def _capture_raw(ring, iface_name, is_running):
+    source = capture_filter.FilteredInterface(iface_name)
+    try:
+        parse = raw_capture.parse_headers
+        for view, length, linktype in source.frames(is_running):
+            ring.captured += 1
+            headers = parse(view, linktype, skip_private=True)
+            if headers is not None:
+                ring.parsed += 1
+                ring.put(headers[0], headers[1], headers[2], length)
+    finally:
+        source.close()
+
+def _capture_pyshark(ring, iface_name, is_running):
+    watcher = capture_filter.NetworkWatcher(iface_name)
+    restart = True
+    while restart:
+        restart = False
+        capture = pyshark_capture(iface_name, capture_filter.bpf_expression(watcher.networks))
+        try:
+            for packet in capture.sniff_continuously(packet_count=None):
+                if not is_running():
+                    break
+                if watcher.refresh():
+                    restart = True # With the new filter
+                    break
+                ring.captured += 1
+                try:
+                    dst_ip, src_port, dst_port = pyshark_headers(packet)
+                    if ':' in dst_ip:
+                        dst_ip = int.from_bytes(socket.inet_pton(socket.AF_INET6, dst_ip), 'big')
+                    else:
+                        dst_ip = raw_capture.IPV4_MAPPED | struct.unpack('!I', socket.inet_aton(dst_ip))[0]
+                    ring.put(dst_ip, src_port, dst_port, int(packet.length))
+                    ring.parsed += 1
+                except AttributeError:
+                    pass # Ignore packets that are not TCP or UDP over IP
+        finally:
+            capture.close()
+
+def pyshark_capture(iface_name, bpf_filter, snaplen=raw_capture.SNAPLEN):
+    """A pyshark LiveCapture whose dumpcap keeps only the first snaplen bytes of each packet."""
+    import pyshark # Only the pyshark backend needs it (and its tshark lookup)
+
+    class HeaderOnlyCapture(pyshark.LiveCapture):
+        def _get_dumpcap_parameters(self):
+            return ['-s', str(snaplen)] + super()._get_dumpcap_parameters()
+
+    return HeaderOnlyCapture(interface=iface_name, bpf_filter=bpf_filter)
+
+def pyshark_headers(packet):
+    """(dst_ip, src_port, dst_port) of a pyshark packet; AttributeError unless it is TCP or UDP over IP."""
+    transport = packet.tcp if 'tcp' in packet else packet.udp
+    network = packet.ip if 'ip' in packet else packet.ipv6
+    return network.dst, int(transport.srcport), int(transport.dstport)
+
+def replay_worker(ring_name, capacity, path, speed, stop_event):
+    """Worker process entry point: feeds a capture file into the ring, paced like CaptureEngine's replay."""
+    ring = _start_worker(ring_name, capacity)
+    publisher = _RingPublisher(ring, stop_event)
+    is_running = publisher.is_running
+    source = None
+    try:
+        source = raw_capture.open_capture_file(path)
+        parse = raw_capture.parse_headers
+        first_timestamp = None
+        started = time.perf_counter()
+        for timestamp, view, length, linktype in source.records(is_running):
+            ring.captured += 1
+            if speed > 0:
+                if first_timestamp is None:
+                    first_timestamp = timestamp
+                due = started + (timestamp - first_timestamp) / speed
+                while is_running() and time.perf_counter() < due:
+                    time.sleep(min(due - time.perf_counter(), 0.1))
+            headers = parse(view, linktype, skip_private=True)
+            if headers is not None:
+                ring.parsed += 1
+                ring.put(headers[0], headers[1], headers[2], length, wait=is_running)
+        ring.seconds = time.perf_counter() - started
+    except Exception as e:
+        ring.errors += 1
+        print(f"Error replaying {path}: {e}")
+    finally:
+        if source:
+            source.close()
+        publisher.stop()
+        ring.close()
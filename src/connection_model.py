@@ -0,0 +1,410 @@
+# src/connection_model.py
+
+from bisect import bisect_left
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, QSortFilterProxyModel, QTimer, QVariant
+from PyQt5.QtGui import QColor
+from rate_tracker import format_bps
+from flow_rollups import VPN_INTERFACE
+
+# (header, field) for each column, in display order
+COLUMNS = [
+    ("Destination IP", "dst_ip"),
+    ("Domain Name", "domain"),
+    ("Port", "dst_port"),
+    ("Process Name", "process_name"),
+    ("Interface", "interface"),
+    ("Data Volume (Bytes)", "volume"),
+    ("Rate", "rate_bps"),
+    ("Location", "location"),
+    ("Network Provider", "network"),
+]
+(COL_IP, COL_DOMAIN, COL_PORT, COL_PROCESS, COL_INTERFACE, COL_VOLUME, COL_RATE,
+ COL_LOCATION, COL_NETWORK) = range(len(COLUMNS))
+
+LAT_LON_ROLE = Qt.UserRole + 1 # (lat, lon) of the row's destination, or None
+
+RESORT_INTERVAL_MS = 1000 # New and changed rows are moved to their sorted places at most this often
+MOVES_PER_SORT = 64 # Above one moved row per this many rows, apply_moves() re-sorts instead of bisecting
+DIRTY_SCAN_FRACTION = 8 # Above one changed row per this many rows, changed rows are found by a scan
+
+NON_VPN_COLOR = QColor(255, 255, 0) # Yellow text for traffic that bypasses the VPN
+DEFAULT_COLOR = QColor(77, 255, 77) # The text color (#4dff4d) of gui.DARK_STYLESHEET
+
+class ConnectionTableModel(QAbstractTableModel):
+    """Table model backed by a list of flow records kept in display order.
+
+    Each row has a position key, (group, sort value, sequence number), and
+    the keys are kept sorted alongside the rows, so the row of a flow is found
+    by bisection and no index has to be rebuilt when rows move. Between
+    begin_batch() and end_batch(), inserts are coalesced into one insertion
+    at the bottom of the table and dataChanged into one signal per run of
+    adjacent changed rows. New rows and rows whose sort value changed are
+    moved into place together by apply_moves(), at most every
+    RESORT_INTERVAL_MS, so the view and proxy see one layout change per
+    interval instead of one per batch.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._rows = [] # Flow records (dicts), in display order
+        self._positions = [] # Position key of each row; ascending
+        self._records = {} # connection key -> record, including pending ones
+        self._position_of = {} # connection key -> position key, for rows in the table
+        self._ip_keys = {} # dst_ip -> set of connection keys
+        self._pending = [] # Records added during a batch, inserted at end_batch()
+        self._batch_depth = 0
+        self._dirty = {} # connection key -> [first_col, last_col] changed during a batch
+        self._misplaced = {} # connection key -> record not yet moved to its sorted row
+        self._sequence = 0
+        self._sort_column = -1
+        self._sort_order = Qt.AscendingOrder
+        self._resort_timer = QTimer(self)
+        self._resort_timer.setSingleShot(True)
+        self._resort_timer.setInterval(RESORT_INTERVAL_MS)
+        self._resort_timer.timeout.connect(self.apply_moves)
+
+    # --- Qt model interface ---
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return COLUMNS[section][0]
+        return QVariant()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return QVariant()
+        record = self._rows[index.row()]
+        if role == Qt.DisplayRole:
+            value = record[COLUMNS[index.column()][1]]
+            if index.column() == COL_VOLUME:
+                return value
+            return format_bps(value) if index.column() == COL_RATE else str(value)
+        if role == Qt.ForegroundRole:
+            return DEFAULT_COLOR if record["interface"] == VPN_INTERFACE else NON_VPN_COLOR
+        if role == LAT_LON_ROLE:
+            return record["lat_lon"]
+        return QVariant()
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self._sort_column = column
+        self._sort_order = order
+        self._misplaced = dict(zip((record["key"] for record in self._rows), self._rows))
+        self.apply_moves()
+
+    # --- Flow store ---
+
+    def record(self, row):
+        return self._rows[row]
+
+    def row_for_key(self, key):
+        position = self._position_of.get(key)
+        return -1 if position is None else bisect_left(self._positions, position)
+
+    def rows_for_ip(self, ip):
+        return sorted(row for row in map(self.row_for_key, self._ip_keys.get(ip, ())) if row >= 0)
+
+    def begin_batch(self):
+        self._batch_depth += 1
+
+    def end_batch(self):
+        self._batch_depth -= 1
+        if self._batch_depth == 0:
+            self._flush()
+
+    def add_or_update(self, key, flow):
+        """Adds a flow or refreshes its volume, process and interface from a FlowRecord."""
+        record = self._records.get(key)
+        if record is None:
+            self._insert(key, flow)
+            return
+
+        record["volume"] = flow.volume
+        first_col = last_col = COL_VOLUME
+        moved = self._sort_column == COL_VOLUME
+        if record["interface"] != flow.interface:
+            record["interface"] = flow.interface
+            first_col, last_col = 0, len(COLUMNS) - 1 # Foreground color of the whole row changes
+            moved = moved or self._sort_column == COL_INTERFACE
+        if flow.process_name != "Unknown" and record["process_name"] == "Unknown":
+            record["process_name"] = flow.process_name
+            first_col = min(first_col, COL_PROCESS)
+            moved = moved or self._sort_column == COL_PROCESS
+        self._mark_dirty(key, record, first_col, last_col, moved)
+
+    def remove_keys(self, keys):
+        """Removes evicted flows, one beginRemoveRows per contiguous run of rows."""
+        self._flush() # Pending rows and changes must be applied before row numbers shift
+        rows = sorted({self.row_for_key(key) for key in keys if key in self._position_of}, reverse=True)
+        # Walk from the bottom so earlier row numbers stay valid while removing
+        index = 0
+        while index < len(rows):
+            last = first = rows[index]
+            index += 1
+            while index < len(rows) and rows[index] == first - 1:
+                first = rows[index]
+                index += 1
+            self.beginRemoveRows(QModelIndex(), first, last)
+            del self._rows[first:last + 1]
+            del self._positions[first:last + 1]
+            self.endRemoveRows()
+        for key in keys:
+            record = self._records.pop(key, None)
+            if record is None:
+                continue
+            del self._position_of[key]
+            self._misplaced.pop(key, None)
+            ip_keys = self._ip_keys[record["dst_ip"]]
+            ip_keys.discard(key)
+            if not ip_keys:
+                del self._ip_keys[record["dst_ip"]]
+
+    def update_resolved(self, ip, location, network, lat, lon):
+        """Updates location and network for every flow to the given IP."""
+        moved = self._sort_column in (COL_LOCATION, COL_NETWORK)
+        for key in self._ip_keys.get(ip, ()):
+            record = self._records[key]
+            record["location"] = location
+            record["network"] = network
+            record["lat_lon"] = (lat, lon)
+            self._mark_dirty(key, record, COL_LOCATION, COL_NETWORK, moved)
+
+    def update_rates(self, rates):
+        """Sets the latest bits per second for (key, bps) pairs; unknown keys are ignored."""
+        # _mark_dirty() inlined: this runs for every row once per second
+        moved = self._sort_column == COL_RATE
+        records, placed, dirty = self._records, self._position_of, self._dirty
+        for key, bps in rates:
+            record = records.get(key)
+            if record is None:
+                continue
+            record["rate_bps"] = bps
+            if key in placed:
+                columns = dirty.get(key)
+                if columns is None:
+                    dirty[key] = [COL_RATE, COL_RATE]
+                else:
+                    columns[0], columns[1] = min(columns[0], COL_RATE), max(columns[1], COL_RATE)
+                if moved:
+                    self._misplaced[key] = record
+        if self._batch_depth == 0:
+            self._flush()
+
+    def update_domain(self, ip, domain):
+        """Sets the reverse DNS name for every flow to the given IP."""
+        moved = self._sort_column == COL_DOMAIN
+        for key in self._ip_keys.get(ip, ()):
+            record = self._records[key]
+            record["domain"] = domain
+            self._mark_dirty(key, record, COL_DOMAIN, COL_DOMAIN, moved)
+
+    def apply_moves(self):
+        """Moves new and changed rows to their sorted places in one layout change.
+
+        Runs on a timer after changes; tests and benchmarks may call it directly.
+        """
+        self._resort_timer.stop()
+        misplaced, self._misplaced = self._misplaced, {}
+        if not misplaced:
+            return
+        self.layoutAboutToBeChanged.emit()
+        persistent = self.persistentIndexList()
+        persistent_keys = [(self._rows[index.row()]["key"], index.column()) for index in persistent]
+
+        rows, positions = self._rows, self._positions
+        if len(misplaced) * MOVES_PER_SORT < len(rows):
+            # A few rows: take each out and bisect it back in
+            for key, record in misplaced.items():
+                row = bisect_left(positions, self._position_of[key])
+                del rows[row], positions[row]
+                position = self._position_of[key] = self._placed_position(record, self._position_of[key][2])
+                row = bisect_left(positions, position)
+                rows.insert(row, record)
+                positions.insert(row, position)
+        else:
+            # Many rows: new keys in place, then one sort, which is close to linear on nearly sorted keys
+            for row, record in enumerate(rows):
+                if record["key"] in misplaced:
+                    position = self._placed_position(record, positions[row][2])
+                    positions[row] = self._position_of[record["key"]] = position
+            order = sorted(range(len(rows)), key=positions.__getitem__)
+            self._rows = [rows[row] for row in order]
+            self._positions = [positions[row] for row in order]
+
+        self.changePersistentIndexList(
+            persistent, [self.index(self.row_for_key(key), column) for key, column in persistent_keys])
+        self.layoutChanged.emit()
+
+    # --- Internals ---
+
+    def _placed_position(self, record, sequence):
+        """The position key of a record in sorted order; sequence breaks ties in insertion order."""
+        if self._sort_column < 0:
+            return (0, 0, sequence)
+        value = record[COLUMNS[self._sort_column][1]]
+        if self._sort_order == Qt.DescendingOrder:
+            # Negated, so position keys sort ascending whatever the column type
+            value = tuple(-ord(char) for char in value) + (1,) if isinstance(value, str) else -value
+        return (0, value, sequence)
+
+    def _insert(self, key, flow):
+        record = {
+            "key": key,
+            "dst_ip": flow.dst_ip,
+            "domain": "Resolving...",
+            "dst_port": flow.dst_port,
+            "process_name": flow.process_name,
+            "interface": flow.interface,
+            "volume": flow.volume,
+            "rate_bps": 0.0,
+            "location": "Resolving...",
+            "network": "Resolving...",
+            "lat_lon": None,
+        }
+        self._records[key] = record
+        self._ip_keys.setdefault(record["dst_ip"], set()).add(key)
+        self._pending.append(record)
+        if self._batch_depth == 0:
+            self._flush()
+
+    def _mark_dirty(self, key, record, first_col, last_col, moved):
+        if key not in self._position_of:
+            return # Still pending: announced by the insert itself
+        dirty = self._dirty.get(key)
+        if dirty is None:
+            self._dirty[key] = [first_col, last_col]
+        else:
+            dirty[0] = min(dirty[0], first_col)
+            dirty[1] = max(dirty[1], last_col)
+        if moved:
+            self._misplaced[key] = record
+        if self._batch_depth == 0:
+            self._flush()
+
+    def _emit_data_changed(self, dirty):
+        """Emits one dataChanged per run of adjacent changed rows, spanning the run's changed columns."""
+        if len(dirty) == len(self._rows):
+            # Every row changed (the rate refresh of a busy table): one range, no row lookups
+            first_col = min(columns[0] for columns in dirty.values())
+            last_col = max(columns[1] for columns in dirty.values())
+            self.dataChanged.emit(self.index(0, first_col), self.index(len(self._rows) - 1, last_col))
+            return
+        if len(dirty) * DIRTY_SCAN_FRACTION > len(self._rows):
+            # Most rows changed: one pass over the table beats a bisection per row
+            changes = [(row, dirty[record["key"]]) for row, record in enumerate(self._rows)
+                       if record["key"] in dirty]
+        else:
+            changes = sorted((self.row_for_key(key), columns) for key, columns in dirty.items())
+        first_row, (first_col, last_col) = changes[0]
+        last_row = first_row
+        for row, (row_first_col, row_last_col) in changes[1:]:
+            if row != last_row + 1:
+                self.dataChanged.emit(self.index(first_row, first_col), self.index(last_row, last_col))
+                first_row, first_col, last_col = row, row_first_col, row_last_col
+            else:
+                first_col, last_col = min(first_col, row_first_col), max(last_col, row_last_col)
+            last_row = row
+        self.dataChanged.emit(self.index(first_row, first_col), self.index(last_row, last_col))
+
+    def _flush(self):
+        if self._dirty:
+            dirty, self._dirty = self._dirty, {}
+            self._emit_data_changed(dirty)
+        if self._pending:
+            # Appended below every placed row (group 1) in arrival order, and placed by apply_moves()
+            group = 0 if self._sort_column < 0 else 1
+            first = len(self._rows)
+            self.beginInsertRows(QModelIndex(), first, first + len(self._pending) - 1)
+            for record in self._pending:
+                self._sequence += 1
+                position = self._position_of[record["key"]] = (group, 0, self._sequence)
+                self._rows.append(record)
+                self._positions.append(position)
+                if group:
+                    self._misplaced[record["key"]] = record
+            self._pending = []
+            self.endInsertRows()
+        if self._misplaced and not self._resort_timer.isActive():
+            self._resort_timer.start()
+
+class ConnectionFilterProxyModel(QSortFilterProxyModel):
+    """Filters with a compiled FlowFilter on the flow records rather than cell text; sorting is delegated to the source model.
+
+    Results are cached per flow key. Qt's dynamic filtering is off, so a
+    dataChanged from the model costs the proxy nothing per row in Python;
+    only a change to a column the filter reads (never rates and volumes)
+    re-tests the changed rows, and the filter is re-applied once, after the
+    batch, if any of them flipped. New rows are tested as they are inserted.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setDynamicSortFilter(False)
+        self._flow_filter = None
+        self._filter_columns = set()
+        self._accepted = {} # connection key -> result of the current filter
+        self._refilter_pending = False
+
+    def setSourceModel(self, model):
+        # Connected ahead of the proxy's own handlers, so these run before it re-filters
+        model.dataChanged.connect(self._on_source_data_changed)
+        model.rowsAboutToBeRemoved.connect(self._on_source_rows_removed)
+        super().setSourceModel(model)
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        # Keep the proxy in source order and let the model sort its own store
+        self.sourceModel().sort(column, order)
+
+    def set_flow_filter(self, flow_filter):
+        """Shows only the rows flow_filter matches, including rows added or changed later; None shows all."""
+        self._flow_filter = flow_filter
+        self._filter_columns = set() if flow_filter is None else {
+            column for column, (_, field) in enumerate(COLUMNS) if field in flow_filter.fields}
+        self._accepted = {}
+        # invalidate() rebuilds the mapping in one pass; invalidateFilter() removes the rejected
+        # rows range by range, which grows quadratically with interleaved matches
+        self.invalidate()
+
+    def clear_filter(self):
+        self.set_flow_filter(None)
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        if self._flow_filter is None:
+            return True
+        record = self.sourceModel().record(source_row)
+        accepted = self._accepted.get(record["key"])
+        if accepted is None:
+            accepted = self._accepted[record["key"]] = self._flow_filter.matches(record)
+        return accepted
+
+    def _on_source_data_changed(self, top_left, bottom_right, roles=()):
+        if self._flow_filter is None or not any(
+                top_left.column() <= column <= bottom_right.column() for column in self._filter_columns):
+            return
+        model = self.sourceModel()
+        flipped = False
+        for row in range(top_left.row(), bottom_right.row() + 1):
+            record = model.record(row)
+            accepted = self._flow_filter.matches(record)
+            previous = self._accepted.get(record["key"])
+            self._accepted[record["key"]] = accepted
+            flipped = flipped or (previous is not None and previous != accepted)
+        if flipped and not self._refilter_pending:
+            # One pass over the cached results for all the ranges of a batch
+            self._refilter_pending = True
+            QTimer.singleShot(0, self._refilter)
+
+    def _refilter(self):
+        self._refilter_pending = False
+        self.invalidateFilter()
+
+    def _on_source_rows_removed(self, parent, first, last):
+        # The key may come back as a new flow with different fields
+        model = self.sourceModel()
+        for row in range(first, last + 1):
+            self._accepted.pop(model.record(row)["key"], None)
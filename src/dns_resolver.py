@@ -0,0 +1,184 @@
+# src/dns_resolver.py
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+import dns.asyncresolver
+import dns.exception
+import dns.resolver
+from metrics import REGISTRY
+
+DNS_QUERIES = REGISTRY.counter("conmon_dns_queries_total", "Reverse DNS queries sent")
+DNS_CACHE_HITS = REGISTRY.counter("conmon_dns_cache_hits_total", "Reverse DNS answers served from cache", ("kind",))
+DNS_ERRORS = REGISTRY.counter("conmon_dns_errors_total", "Reverse DNS queries that timed out or failed", ("kind",))
+DNS_IN_FLIGHT = REGISTRY.gauge("conmon_dns_in_flight", "Reverse DNS queries waiting for an answer")
+DNS_LOOKUP = REGISTRY.histogram("conmon_dns_lookup_seconds", "Duration of one reverse DNS query")
+
+class ReverseDnsResolver:
+    """Asynchronous PTR lookups on a dedicated asyncio loop.
+
+    Runs beside the GeoIP resolver and never blocks it: resolve() only hands
+    the IP to the loop. At most max_concurrency queries are in flight, each
+    bounded by timeout. Answers are cached for their TTL; NXDOMAIN/no-answer
+    and timeouts are cached negatively. Results are delivered in batches to
+    callback(list of (ip, domain or None)) every flush_interval seconds.
+    """
+
+    def __init__(self, callback, nameservers=None, port=53, max_concurrency=64, timeout=2.0,
+                 negative_ttl=3600, timeout_ttl=120, min_ttl=60, cache_size=16384, flush_interval=0.1):
+        self.callback = callback
+        self.nameservers = nameservers # None uses the system configuration
+        self.port = port # Lets tests point at a local stub DNS server
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.negative_ttl = negative_ttl
+        self.timeout_ttl = timeout_ttl
+        self.min_ttl = min_ttl
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self._cache = OrderedDict() # ip -> (domain or None, expiry on the monotonic clock)
+        self._in_flight = set()
+        self._results = [] # (ip, domain) waiting for the next flush
+        self._loop = None # Set once the resolver is set up; resolve() is a no-op until then
+        self._resolver = None
+        self._semaphore = None
+        self._thread = None
+        self._ready = threading.Event() # Set once setup succeeded or failed
+        self.error = None # Why the resolver could not be set up, if it could not
+
+        self.queries = 0
+        self.cache_hits = 0
+        self.negative_hits = 0
+        self.timeouts = 0
+        self.failures = 0
+
+    def start(self):
+        """Starts the loop thread; returns False, leaving reverse DNS disabled, if no resolver could be set up."""
+        self._thread = threading.Thread(target=self._run_loop, name="ReverseDns", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self.error is not None:
+            print(f"Reverse DNS disabled, the resolver could not be set up: {self.error}")
+            return False
+        return True
+
+    def stop(self):
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def resolve(self, ip):
+        """Thread-safe: schedules a PTR lookup for ip unless it is cached or already in flight."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._schedule, ip)
+
+    def collect_metrics(self):
+        """Publishes the query counters; registered with the metrics registry by the application."""
+        DNS_QUERIES.set_total(self.queries)
+        DNS_CACHE_HITS.set_total(self.cache_hits, kind="positive")
+        DNS_CACHE_HITS.set_total(self.negative_hits, kind="negative")
+        DNS_ERRORS.set_total(self.timeouts, kind="timeout")
+        DNS_ERRORS.set_total(self.failures, kind="failure")
+        DNS_IN_FLIGHT.set(len(self._in_flight))
+
+    def stats(self):
+        return {
+            "queries": self.queries,
+            "cache_hits": self.cache_hits,
+            "negative_hits": self.negative_hits,
+            "timeouts": self.timeouts,
+            "failures": self.failures,
+            "cached": len(self._cache),
+            "in_flight": len(self._in_flight),
+        }
+
+    # --- Everything below runs on the resolver's own loop ---
+
+    def _run_loop(self):
+        loop = asyncio.new_event_loop()
+        try:
+            asyncio.set_event_loop(loop)
+            self._resolver = self._make_resolver()
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        except Exception as e: # e.g. dns.resolver.NoResolverConfiguration on a host without resolv.conf
+            self.error = e
+            loop.close()
+            return
+        finally:
+            # start() waits for this either way; stop() can queue loop.stop before run_forever() starts
+            self._loop = loop if self.error is None else None
+            self._ready.set()
+        loop.call_later(self.flush_interval, self._flush)
+        try:
+            loop.run_forever()
+        finally:
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            # Cancelled lookups may need several iterations to unwind
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.close()
+
+    def _make_resolver(self):
+        if self.nameservers:
+            resolver = dns.asyncresolver.Resolver(configure=False)
+            resolver.nameservers = list(self.nameservers)
+        else:
+            resolver = dns.asyncresolver.Resolver()
+        resolver.port = self.port
+        resolver.timeout = self.timeout
+        resolver.lifetime = self.timeout
+        return resolver
+
+    def _schedule(self, ip):
+        entry = self._cache.get(ip)
+        if entry is not None:
+            if entry[1] > time.monotonic():
+                self._cache.move_to_end(ip)
+                if entry[0] is None:
+                    self.negative_hits += 1
+                else:
+                    self.cache_hits += 1
+                self._results.append((ip, entry[0]))
+                return
+            del self._cache[ip]
+        if ip in self._in_flight:
+            return
+        self._in_flight.add(ip)
+        self._loop.create_task(self._lookup(ip))
+
+    async def _lookup(self, ip):
+        async with self._semaphore:
+            self.queries += 1
+            started = time.perf_counter()
+            try:
+                answer = await asyncio.wait_for(
+                    self._resolver.resolve_address(ip, lifetime=self.timeout), self.timeout)
+                domain = str(answer[0].target).rstrip('.')
+                ttl = max(answer.rrset.ttl, self.min_ttl)
+            except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+                domain, ttl = None, self.negative_ttl
+            except (asyncio.TimeoutError, dns.exception.Timeout):
+                self.timeouts += 1
+                domain, ttl = None, self.timeout_ttl
+            except (dns.exception.DNSException, OSError, ValueError):
+                self.failures += 1
+                domain, ttl = None, self.timeout_ttl
+            DNS_LOOKUP.observe(time.perf_counter() - started)
+        self._in_flight.discard(ip)
+        self._cache[ip] = (domain, time.monotonic() + ttl)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        self._results.append((ip, domain))
+
+    def _flush(self):
+        if self._results:
+            results, self._results = self._results, []
+            try:
+                self.callback(results)
+            except Exception as e:
+                print(f"Reverse DNS callback failed: {e}")
+        self._loop.call_later(self.flush_interval, self._flush)
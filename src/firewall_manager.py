@@ -1,80 +1,471 @@
-
+import ipaddress
+import os
+import platform
+import re
 import subprocess
-import psutil
-import socket
+import tempfile
+import threading
+import time
+import ip_classify
+from ip_classify import collapse_networks
+from metrics import REGISTRY
+
+FIREWALL_BACKENDS = ('netsh', 'nftables', 'fake')
+
+FIREWALL_APPLY = REGISTRY.histogram(
+    "conmon_firewall_apply_seconds", "Duration of one firewall backend invocation", ("backend",))
+FIREWALL_COALESCED = REGISTRY.counter(
+    "conmon_firewall_requests_coalesced_total", "Firewall requests superseded by a later one before being applied")
+FIREWALL_BLOCKED_NETWORKS = REGISTRY.gauge(
+    "conmon_firewall_blocked_networks", "Collapsed destination networks currently blocked")
+FIREWALL_RULE_CHANGES = REGISTRY.counter(
+    "conmon_firewall_network_changes_total", "Blocked networks added or removed by rule-set diffs", ("change",))
+
+# Multicast and broadcast used on the LAN: DHCP, mDNS, SSDP and IPv6 neighbour discovery (link scope, ff02::/16)
+LAN_GROUPS = [ipaddress.ip_network(network) for network in ("224.0.0.0/4", "255.255.255.255/32", "ff02::/16")]
+
+def get_lan_subnets():
+    """Identifies local subnets to allow: private, link-local and connected subnets plus LAN_GROUPS, merged."""
+    # A connected /24 usually lies inside one of the private ranges and adds nothing
+    table = ip_classify.AddressTable(ip_classify.local_networks())
+    networks = table.networks((ip_classify.PRIVATE, ip_classify.LINK_LOCAL, ip_classify.LOCAL))
+    return [str(network) for network in collapse_networks(networks + LAN_GROUPS)]
+
+class FirewallBackend:
+    """Applies a list of rule operations with as few tool invocations as possible.
+
+    Operations are tuples:
+      ("setup", lan_subnets)  replace any stale rules with ours, block disabled
+      ("block", enabled)      enable or disable the internet block
+      ("destinations", added, removed)
+                              block and unblock destination networks (collapsed
+                              ip_network lists); only the difference is sent
+      ("programs", added, removed)
+                              block and unblock all outbound traffic of
+                              executables (full paths); only sent to backends
+                              with supports_programs
+      ("teardown",)           disable the block and remove our rules
+    """
+
+    name = None
+    supports_programs = False
+
+    def apply(self, operations):
+        """Returns True if every operation was applied."""
+        raise NotImplementedError
+
+    def _run(self, argv, stdin=None):
+        """Runs one command without a shell; returns True on success."""
+        print(f"Executing command: {' '.join(argv)}")
+        try:
+            result = subprocess.run(argv, input=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                    text=True, check=False)
+        except OSError as e:
+            print(f"Command failed to start: {e}")
+            return False
+        if result.returncode != 0:
+            print(f"Command returned non-zero exit code: {result.returncode}")
+            print(f"Error stdout: {result.stdout}")
+            print(f"Error stderr: {result.stderr}")
+            return False
+        return True
+
+    def _output(self, argv):
+        """Runs one command without a shell; returns its stdout, or None if it failed."""
+        try:
+            result = subprocess.run(argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                    text=True, errors='replace', check=False)
+        except OSError as e:
+            print(f"Command failed to start: {e}")
+            return None
+        return result.stdout if result.returncode == 0 else None
 
-class FirewallManager:
+class NetshBackend(FirewallBackend):
+    """Windows Defender Firewall rules through netsh, batched into one `netsh -f` script per call.
+
+    Deleting a rule that does not exist is an error, so the deletes that
+    clear stale rules before setup run as a script of their own whose
+    result is ignored. Destination rules left by a run that did not exit
+    cleanly are found with one `show rule` and deleted in that script.
+    """
+
+    name = 'netsh'
+    supports_programs = True
     RULE_NAME_BLOCK = "ConmonBlockInternet"
     RULE_NAME_ALLOW_LAN = "ConmonAllowLAN"
+    RULE_NAME_DESTINATIONS = "ConmonBlockDestinations" # Followed by the bucket number
+    RULE_NAME_PROGRAMS = "ConmonBlockProgram" # Followed by the rule number
+    BUCKET_SIZE = 500 # Networks per destination rule; keeps each remoteip list well within netsh limits
 
     def __init__(self):
-        self._cleanup_rules() # Clean up any old rules on startup
-        self._create_rules()
+        self._buckets = [] # Destination rule number -> set of network strings (empty: no rule)
+        self._bucket_of = {} # Network string -> rule number
+        self._program_rules = {} # Executable path -> rule number
+
+    def apply(self, operations):
+        cleanup = []
+        script = []
+        for operation in operations:
+            if operation[0] == "setup":
+                cleanup += self._delete_rules()
+                cleanup += [f'advfirewall firewall delete rule name="{name}"' for name in self._stale_numbered_rules()]
+                # Block all outbound traffic (initially disabled, lower precedence), and
+                # allow outbound traffic to local subnets (always enabled, higher precedence)
+                script.append(f'advfirewall firewall add rule name="{self.RULE_NAME_BLOCK}" '
+                              f'dir=out action=block enable=no')
+                script.append(f'advfirewall firewall add rule name="{self.RULE_NAME_ALLOW_LAN}" '
+                              f'dir=out action=allow remoteip={",".join(operation[1])} enable=yes')
+            elif operation[0] == "block":
+                enable = "yes" if operation[1] else "no"
+                script.append(f'advfirewall firewall set rule name="{self.RULE_NAME_BLOCK}" new enable={enable}')
+            elif operation[0] == "destinations":
+                script += self._update_destinations(operation[1], operation[2])
+            elif operation[0] == "programs":
+                script += self._update_programs(operation[1], operation[2])
+            elif operation[0] == "teardown":
+                script.append(f'advfirewall firewall set rule name="{self.RULE_NAME_BLOCK}" new enable=no')
+                script += self._delete_rules()
+                script += [self._delete_destination_rule(number)
+                           for number, bucket in enumerate(self._buckets) if bucket]
+                script += [self._delete_program_rule(number) for number in sorted(self._program_rules.values())]
+                self._buckets = []
+                self._bucket_of = {}
+                self._program_rules = {}
+        if cleanup:
+            self._run_script(cleanup) # Fails harmlessly when there is nothing to clean up
+        return self._run_script(script) if script else True
+
+    def _update_destinations(self, added, removed):
+        """Moves networks in and out of fixed-size rule buckets; returns commands for the buckets that changed."""
+        before = {number: bool(bucket) for number, bucket in enumerate(self._buckets)}
+        changed = set()
+        for network in map(str, removed):
+            number = self._bucket_of.pop(network, None)
+            if number is not None:
+                self._buckets[number].discard(network)
+                changed.add(number)
+        free = (number for number, bucket in enumerate(self._buckets) if len(bucket) < self.BUCKET_SIZE)
+        number = next(free, None)
+        for network in map(str, added):
+            while number is not None and len(self._buckets[number]) >= self.BUCKET_SIZE:
+                number = next(free, None)
+            if number is None:
+                self._buckets.append(set())
+                number = len(self._buckets) - 1
+            self._buckets[number].add(network)
+            self._bucket_of[network] = number
+            changed.add(number)
+        commands = []
+        for number in sorted(changed):
+            bucket = self._buckets[number]
+            name = f"{self.RULE_NAME_DESTINATIONS}-{number}"
+            remote = ",".join(sorted(bucket))
+            if not bucket:
+                if before.get(number):
+                    commands.append(self._delete_destination_rule(number))
+            elif before.get(number):
+                commands.append(f'advfirewall firewall set rule name="{name}" new remoteip={remote}')
+            else:
+                commands.append(f'advfirewall firewall add rule name="{name}" dir=out action=block '
+                                f'remoteip={remote} enable=yes')
+        return commands
+
+    def _update_programs(self, added, removed):
+        """One block rule per executable; returns the commands, deletes first so their numbers can be reused."""
+        commands = []
+        for path in removed:
+            number = self._program_rules.pop(path, None)
+            if number is not None:
+                commands.append(self._delete_program_rule(number))
+        used = set(self._program_rules.values())
+        number = 0
+        for path in added:
+            if path in self._program_rules:
+                continue
+            while number in used:
+                number += 1
+            used.add(number)
+            self._program_rules[path] = number
+            commands.append(f'advfirewall firewall add rule name="{self.RULE_NAME_PROGRAMS}-{number}" dir=out '
+                            f'action=block program="{path}" enable=yes')
+        return commands
+
+    def _delete_destination_rule(self, number):
+        return f'advfirewall firewall delete rule name="{self.RULE_NAME_DESTINATIONS}-{number}"'
+
+    def _delete_program_rule(self, number):
+        return f'advfirewall firewall delete rule name="{self.RULE_NAME_PROGRAMS}-{number}"'
+
+    def _stale_numbered_rules(self):
+        """Names of the existing destination and program rules, from one listing of the outbound rules."""
+        listing = self._output(['netsh', 'advfirewall', 'firewall', 'show', 'rule', 'name=all', 'dir=out'])
+        if listing is None:
+            return []
+        # Only the rule names are matched: the labels around them are translated on localized Windows
+        names = []
+        for prefix in (self.RULE_NAME_DESTINATIONS, self.RULE_NAME_PROGRAMS):
+            pattern = re.compile(re.escape(prefix) + r'-(\d+)\b')
+            names += [f"{prefix}-{number}" for number in sorted({int(number) for number in pattern.findall(listing)})]
+        return names
+
+    def _delete_rules(self):
+        return [f'advfirewall firewall delete rule name="{self.RULE_NAME_BLOCK}"',
+                f'advfirewall firewall delete rule name="{self.RULE_NAME_ALLOW_LAN}"']
 
-    def _run_command(self, command):
-        """Helper to run shell commands with admin rights, suppressing output."""
+    def _run_script(self, lines):
+        fd, path = tempfile.mkstemp(prefix='conmon-netsh-', suffix='.txt')
         try:
-            print(f"Executing command: {command}")
-            result = subprocess.run(command, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            print(f"Command stdout: {result.stdout}")
-            print(f"Command stderr: {result.stderr}")
-            if result.returncode != 0:
-                print(f"Command returned non-zero exit code: {result.returncode}")
-                return False
-            if result.stderr:
-                print(f"Command reported errors to stderr: {result.stderr}")
-                # Depending on the error, you might want to return False here as well
-            return True
-        except subprocess.CalledProcessError as e:
-            print(f"Command failed: {command}")
-            print(f"Error stdout: {e.stdout}")
-            print(f"Error stderr: {e.stderr}")
+            with os.fdopen(fd, 'w') as f:
+                f.write("\n".join(lines) + "\n")
+            return self._run(['netsh', '-f', path])
+        finally:
+            os.unlink(path)
+
+class NftablesBackend(FirewallBackend):
+    """Linux nftables rules in a table of their own, each call applied atomically with one `nft -f -`.
+
+    Blocked destinations live in two interval sets, so changing them only
+    adds and deletes set elements; the internet block is a chain that is
+    flushed and refilled. Nothing is rebuilt after setup.
+
+    Programs cannot be blocked: nftables matches packets, and the sending
+    process is not part of a packet (at most its cgroup or user is).
+    """
+
+    name = 'nftables'
+    TABLE = "inet conmon"
+
+    def __init__(self):
+        self.lan_subnets = []
+
+    def apply(self, operations):
+        lines = []
+        for operation in operations:
+            if operation[0] == "setup":
+                self.lan_subnets = list(operation[1])
+                lines += [
+                    f"add table {self.TABLE}",
+                    f"delete table {self.TABLE}", # Clears rules left by an earlier run
+                    f"add table {self.TABLE}",
+                    f"add set {self.TABLE} blocked4 {{ type ipv4_addr; flags interval; }}",
+                    f"add set {self.TABLE} blocked6 {{ type ipv6_addr; flags interval; }}",
+                    f"add chain {self.TABLE} internet",
+                    f"add chain {self.TABLE} output {{ type filter hook output priority 0; policy accept; }}",
+                    f"add rule {self.TABLE} output ip daddr @blocked4 drop",
+                    f"add rule {self.TABLE} output ip6 daddr @blocked6 drop",
+                    f"add rule {self.TABLE} output jump internet",
+                ]
+            elif operation[0] == "block":
+                lines.append(f"flush chain {self.TABLE} internet")
+                if operation[1]:
+                    lines.append(f'add rule {self.TABLE} internet oifname "lo" accept')
+                    for family, version in (("ip", 4), ("ip6", 6)):
+                        members = [network for network in self.lan_subnets
+                                   if ipaddress.ip_network(network).version == version]
+                        if members:
+                            lines.append(
+                                f"add rule {self.TABLE} internet {family} daddr {{ {', '.join(members)} }} accept")
+                    lines.append(f"add rule {self.TABLE} internet drop")
+            elif operation[0] == "destinations":
+                # Deletes first: a network may be replaced by the larger one it was collapsed into
+                lines += self._elements("delete", operation[2])
+                lines += self._elements("add", operation[1])
+            elif operation[0] == "teardown":
+                lines += [f"add table {self.TABLE}", f"delete table {self.TABLE}"] # Add first, so delete never fails
+        return self._run(['nft', '-f', '-'], stdin="\n".join(lines) + "\n") if lines else True
+
+    def _elements(self, verb, networks):
+        lines = []
+        for version, set_name in ((4, "blocked4"), (6, "blocked6")):
+            members = [str(network) for network in networks if network.version == version]
+            if members:
+                lines.append(f"{verb} element {self.TABLE} {set_name} {{ {', '.join(members)} }}")
+        return lines
+
+class FakeBackend(FirewallBackend):
+    """Records operations instead of touching the host firewall; for tests and replays."""
+
+    name = 'fake'
+    supports_programs = True
+
+    def __init__(self, delay=0.0, fail=False):
+        self.delay = delay # Seconds per invocation, to simulate a slow netsh
+        self.fail = fail
+        self.invocations = [] # One list of operations per apply()
+        self.blocked = False
+        self.installed = False
+        self.networks = set() # Blocked destination networks
+        self.programs = set() # Blocked executable paths
+
+    def apply(self, operations):
+        self.invocations.append(list(operations))
+        if self.delay:
+            time.sleep(self.delay)
+        if self.fail:
             return False
+        for operation in operations:
+            if operation[0] == "setup":
+                self.installed, self.blocked = True, False
+            elif operation[0] == "block":
+                self.blocked = operation[1]
+            elif operation[0] == "destinations":
+                self.networks.difference_update(operation[2])
+                self.networks.update(operation[1])
+            elif operation[0] == "programs":
+                self.programs.difference_update(operation[2])
+                self.programs.update(operation[1])
+            elif operation[0] == "teardown":
+                self.installed, self.blocked = False, False
+                self.networks.clear()
+                self.programs.clear()
+        return True
+
+def default_backend():
+    return 'netsh' if platform.system() == 'Windows' else 'nftables'
+
+def create_backend(name):
+    if name == 'netsh':
+        return NetshBackend()
+    if name == 'nftables':
+        return NftablesBackend()
+    if name == 'fake':
+        return FakeBackend()
+    raise ValueError(f"Unknown firewall backend: {name}")
+
+class FirewallExecutor:
+    """Applies firewall changes on a worker thread, so the GUI never waits for netsh.
+
+    set_block(), set_blocked_networks() and set_blocked_programs() only
+    record the wanted state.
+    Requests made while the worker is busy collapse into the last one, and
+    everything pending when it wakes (rule setup, the block state, the diff
+    of the blocked networks, teardown) goes to the backend in one call.
+    on_complete(blocked, ok) reports the state the firewall is actually in
+    after each call; it runs on the worker thread.
+    """
+
+    def __init__(self, backend, lan_subnets=None, on_complete=None):
+        self.backend = backend
+        self.lan_subnets = lan_subnets
+        self.on_complete = on_complete
+        self._condition = threading.Condition()
+        self.installed = False # Our rules exist; False again if setup failed
+        self._applied_block = False # What the firewall currently enforces
+        self._wanted_block = False
+        self._applied_networks = frozenset() # Blocked destination networks, collapsed
+        self._wanted_networks = frozenset()
+        self._applied_programs = frozenset() # Blocked executable paths
+        self._wanted_programs = frozenset()
+        self._requests = 0 # Requests since the last backend call
+        self._stopping = False
+        self._thread = None
+        self.invocations = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="FirewallExecutor", daemon=True)
+        self._thread.start()
+
+    def set_block(self, enabled):
+        with self._condition:
+            self._wanted_block = enabled
+            self._requests += 1
+            self._condition.notify()
+
+    def set_blocked_networks(self, networks):
+        """Replaces the set of blocked destination networks; only the difference reaches the backend."""
+        networks = frozenset(collapse_networks(networks))
+        with self._condition:
+            self._wanted_networks = networks
+            self._requests += 1
+            self._condition.notify()
+
+    def set_blocked_programs(self, paths):
+        """Replaces the set of blocked executables (full paths); the backend must support programs."""
+        if not self.backend.supports_programs:
+            raise ValueError(f"The {self.backend.name} firewall backend cannot block programs")
+        paths = frozenset(paths)
+        with self._condition:
+            self._wanted_programs = paths
+            self._requests += 1
+            self._condition.notify()
+
+    def stop(self):
+        """Disables the block, removes the rules and waits for the worker to finish."""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _pending(self):
+        if self._stopping:
+            return self.installed
+        return (not self.installed or self._wanted_block != self._applied_block
+                or self._wanted_networks != self._applied_networks
+                or self._wanted_programs != self._applied_programs)
+
+    def _run(self):
+        if self.lan_subnets is None:
+            self.lan_subnets = get_lan_subnets()
+        while True:
+            with self._condition:
+                while not self._pending() and not self._stopping:
+                    self._condition.wait()
+                if not self._pending():
+                    return # Stopping, and nothing was ever installed
+                stopping = self._stopping
+                wanted = self._wanted_block
+                wanted_networks = self._wanted_networks
+                wanted_programs = self._wanted_programs
+                if self._requests > 1:
+                    FIREWALL_COALESCED.inc(self._requests - 1)
+                self._requests = 0
+            operations = []
+            if stopping:
+                operations.append(("teardown",))
+            else:
+                current = self._applied_block
+                if not self.installed:
+                    operations.append(("setup", self.lan_subnets))
+                    current = False # New rules start with the block disabled
+                if wanted != current:
+                    operations.append(("block", wanted))
+                applied_networks = self._applied_networks if self.installed else frozenset()
+                if wanted_networks != applied_networks:
+                    added = sorted(wanted_networks - applied_networks, key=_network_order)
+                    removed = sorted(applied_networks - wanted_networks, key=_network_order)
+                    operations.append(("destinations", added, removed))
+                    FIREWALL_RULE_CHANGES.inc(len(added), change="added")
+                    FIREWALL_RULE_CHANGES.inc(len(removed), change="removed")
+                applied_programs = self._applied_programs if self.installed else frozenset()
+                if wanted_programs != applied_programs:
+                    operations.append(("programs", sorted(wanted_programs - applied_programs),
+                                       sorted(applied_programs - wanted_programs)))
+            with FIREWALL_APPLY.time(backend=self.backend.name):
+                ok = self.backend.apply(operations)
+            self.invocations += 1
+            with self._condition:
+                if ok:
+                    self.installed = not stopping
+                    self._applied_block = wanted and not stopping
+                    self._applied_networks = frozenset() if stopping else wanted_networks
+                    self._applied_programs = frozenset() if stopping else wanted_programs
+                elif not self.installed or stopping:
+                    # Setup failed: nothing more can be applied; teardown failed: give up
+                    self.installed = False
+                    self._stopping = True
+                else:
+                    # Do not retry in a loop
+                    self._wanted_block = self._applied_block
+                    self._wanted_networks = self._applied_networks
+                    self._wanted_programs = self._applied_programs
+                blocked = self._applied_block
+                FIREWALL_BLOCKED_NETWORKS.set(len(self._applied_networks))
+            if self.on_complete is not None:
+                self.on_complete(blocked, ok)
+            if stopping:
+                return
 
-    def _get_lan_subnets(self):
-        """Identifies local IPv4 subnets to allow."""
-        subnets = ['192.168.0.0/16', '10.0.0.0/8', '172.16.0.0/12'] # Standard private ranges
-        # Add currently connected subnets for more specific rules
-        for iface, addrs in psutil.net_if_addrs().items():
-            for addr in addrs:
-                if addr.family == socket.AF_INET and hasattr(addr, 'netmask') and addr.netmask:
-                    # Create a network object and add its string representation
-                    import ipaddress
-                    network = ipaddress.ip_network(f'{addr.address}/{addr.netmask}', strict=False)
-                    subnets.append(str(network))
-        return ",".join(sorted(list(set(subnets)))) # Return unique, sorted list
-
-    def _create_rules(self):
-        lan_subnets = self._get_lan_subnets()
-        # Rule 1: Block all outbound traffic (initially disabled, lower precedence)
-        block_command = (
-            f'netsh advfirewall firewall add rule name="{self.RULE_NAME_BLOCK}" dir=out action=block enable=no'
-        )
-        # Rule 2: Allow outbound traffic to local subnets (always enabled, higher precedence)
-        allow_command = (
-            f'netsh advfirewall firewall add rule name="{self.RULE_NAME_ALLOW_LAN}" dir=out action=allow remoteip={lan_subnets} enable=yes'
-        )
-        self._run_command(block_command)
-        self._run_command(allow_command)
-
-    def enable_block(self):
-        """Enables the internet block."""
-        print("Attempting to enable internet block...")
-        command = f'netsh advfirewall firewall set rule name="{self.RULE_NAME_BLOCK}" new enable=yes'
-        return self._run_command(command)
-
-    def disable_block(self):
-        """Disables the internet block."""
-        print("Attempting to disable internet block...")
-        command = f'netsh advfirewall firewall set rule name="{self.RULE_NAME_BLOCK}" new enable=no'
-        return self._run_command(command)
-
-    def _cleanup_rules(self):
-        """Removes the firewall rules."""
-        self._run_command(f'netsh advfirewall firewall delete rule name="{self.RULE_NAME_BLOCK}"')
-        self._run_command(f'netsh advfirewall firewall delete rule name="{self.RULE_NAME_ALLOW_LAN}"')
-
-    def cleanup(self):
-        """Public method to be called on application exit."""
-        self.disable_block() # Ensure block is off before deleting
-        self._cleanup_rules()
+def _network_order(network):
+    return (network.version, network.network_address, network.prefixlen)
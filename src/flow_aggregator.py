@@ -0,0 +1,83 @@
+# src/flow_aggregator.py
+
+import threading
+import time
+
+class FlowAggregator:
+    """Accumulates per-flow byte/packet deltas between flushes.
+
+    Capture threads call add() for every packet; the owner calls flush() on a
+    timer and forwards one batch, so downstream work scales with the flush
+    interval instead of the packet rate.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._deltas = {} # (dst_ip, dst_port, interface) -> [bytes, packets, process_name]
+        self._new_flows = []
+        self._known_flows = set() # Flows already announced in an earlier batch
+        self._first_added = 0.0 # Monotonic time of the oldest packet in the current interval
+
+    def add(self, dst_ip, dst_port, interface, length, process_name, packets=1):
+        """Counts packets (one by default) totalling length bytes for a flow."""
+        flow = (dst_ip, dst_port, interface)
+        with self._lock:
+            delta = self._deltas.get(flow)
+            if delta is None:
+                if not self._deltas:
+                    self._first_added = time.monotonic()
+                self._deltas[flow] = [length, packets, process_name]
+                if flow not in self._known_flows:
+                    self._known_flows.add(flow)
+                    self._new_flows.append(flow)
+            else:
+                delta[0] += length
+                delta[1] += packets
+                if delta[2] == "Unknown":
+                    delta[2] = process_name
+
+    def pending(self):
+        """Number of flows with deltas waiting for the next flush."""
+        return len(self._deltas)
+
+    def forget(self, dst_ip, dst_port, interface):
+        """Lets a flow be announced again as new, e.g. after it was evicted downstream."""
+        with self._lock:
+            self._known_flows.discard((dst_ip, dst_port, interface))
+
+    def flush(self):
+        """Returns the batch accumulated since the last flush, or None if nothing was captured.
+
+        The batch is a dict with:
+          "new_flows": list of flow dicts (dst_ip, dst_port, interface, process_name, key)
+          "deltas": {connection_key: {"dst_ip", "dst_port", "interface", "bytes", "packets", "process_name"}}
+          "captured_at": time.monotonic() when the oldest packet of the batch was added
+        """
+        with self._lock:
+            if not self._deltas:
+                return None
+            deltas, self._deltas = self._deltas, {}
+            new_flows, self._new_flows = self._new_flows, []
+            captured_at = self._first_added
+
+        batch_deltas = {}
+        for (dst_ip, dst_port, interface), (length, packets, process_name) in deltas.items():
+            batch_deltas[f"{dst_ip}:{dst_port}:{interface}"] = {
+                "dst_ip": dst_ip,
+                "dst_port": dst_port,
+                "interface": interface,
+                "bytes": length,
+                "packets": packets,
+                "process_name": process_name,
+            }
+        batch_new_flows = []
+        for dst_ip, dst_port, interface in new_flows:
+            key = f"{dst_ip}:{dst_port}:{interface}"
+            batch_new_flows.append({
+                "key": key,
+                "dst_ip": dst_ip,
+                "dst_port": dst_port,
+                "interface": interface,
+                "process_name": batch_deltas[key]["process_name"],
+            })
+        return {"new_flows": batch_new_flows, "deltas": batch_deltas, "captured_at": captured_at}
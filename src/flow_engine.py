@@ -0,0 +1,102 @@
+# src/flow_engine.py
+
+import time
+from flow_table import FlowTable
+from flow_rollups import FlowRollups
+
+class FlowEngine:
+    """Flow state shared by the Qt GUI and the headless daemon.
+
+    Applies capture batches to a bounded FlowTable, keeps per-destination
+    indexes so resolver results and evictions can be attributed to flows,
+    requests resolution of new destinations, keeps the per-group rollups
+    (FlowRollups) and records history. It is not
+    thread-safe: its owner calls it from one thread only (the GUI thread,
+    or the headless event loop).
+    """
+
+    def __init__(self, max_flows=50000, idle_timeout=300.0, resolve=None, forget=None, history_store=None):
+        self.connections = FlowTable(max_flows=max_flows, idle_timeout=idle_timeout)
+        self.ip_connections = {} # dst_ip -> set of connection keys, to attribute volume to a map location
+        self.ip_info = {} # dst_ip -> resolver result (location, lat/lon, network, country) once resolved
+        self.domains = {} # dst_ip -> reverse DNS name, or None if it has none
+        self.resolve = resolve # Called with each new destination IP
+        self.forget = forget # Called with (dst_ip, dst_port, interface) of each evicted flow
+        self.history_store = history_store
+        self.rollups = FlowRollups()
+        self.batches_handled = 0
+
+    def apply_batch(self, batch):
+        """Applies one aggregated batch as per-flow deltas; returns [(connection key, FlowRecord)].
+
+        Every new flow also has a delta in the same batch, and a delta for a
+        flow that was evicted meanwhile simply recreates it.
+        """
+        updates = []
+        for connection_key, delta in batch["deltas"].items():
+            record = self.connections.get(connection_key)
+            is_new = record is None
+            if is_new:
+                record = self.connections.add(connection_key, delta["dst_ip"], delta["dst_port"],
+                                              delta["interface"], delta["process_name"])
+                self.ip_connections.setdefault(delta["dst_ip"], set()).add(connection_key)
+                if self.resolve is not None:
+                    self.resolve(delta["dst_ip"])
+            self.connections.apply_delta(record, delta["bytes"], delta["packets"], delta["process_name"])
+            self.rollups.add(record, delta["bytes"], delta["packets"], is_new)
+            updates.append((connection_key, record))
+        if self.history_store is not None:
+            self._record_history(batch)
+        self.batches_handled += 1
+        return updates
+
+    def evict(self):
+        """Drops idle flows (and the flows above max_flows); returns (removed records, IPs left without flows)."""
+        removed = self.connections.evict()
+        emptied_ips = []
+        for record in removed:
+            self.rollups.remove(record)
+            keys = self.ip_connections.get(record.dst_ip)
+            if keys is not None:
+                keys.discard(record.key)
+                if not keys:
+                    del self.ip_connections[record.dst_ip]
+                    self.ip_info.pop(record.dst_ip, None)
+                    self.domains.pop(record.dst_ip, None)
+                    emptied_ips.append(record.dst_ip)
+            # Let the capture report the flow as new again if it comes back
+            if self.forget is not None:
+                self.forget(record.dst_ip, record.dst_port, record.interface)
+        return removed, emptied_ips
+
+    def apply_resolved(self, results):
+        """Stores resolver results for IPs that still have flows; returns those results."""
+        kept = []
+        for resolved_data in results:
+            if resolved_data["ip"] in self.ip_connections: # Its flows may have been evicted meanwhile
+                self.ip_info[resolved_data["ip"]] = resolved_data
+                self.rollups.resolve(resolved_data["ip"], resolved_data)
+                kept.append(resolved_data)
+        return kept
+
+    def apply_domains(self, results):
+        """Stores reverse DNS answers [(ip, domain or None)] for IPs that still have flows."""
+        kept = []
+        for ip, domain in results:
+            if ip in self.ip_connections:
+                self.domains[ip] = domain
+                kept.append((ip, domain))
+        return kept
+
+    def _record_history(self, batch):
+        rows = []
+        for connection_key, delta in batch["deltas"].items():
+            record = self.connections.get(connection_key)
+            info = self.ip_info.get(record.dst_ip)
+            network, country = (info["network"], info.get("country", "N/A")) if info else ("Unknown", "Unknown")
+            # The resolver reports None for addresses missing from its databases; rollup values are NOT NULL
+            rows.append((record.process_name, record.dst_ip, record.dst_port, record.interface,
+                         network or "Unknown", country or "Unknown", delta["bytes"], delta["packets"]))
+        # Stamped with the capture time, not the time the batch got through the queues
+        captured_at = time.time() - (time.monotonic() - batch["captured_at"])
+        self.history_store.record_batch(captured_at, rows)
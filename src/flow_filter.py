@@ -0,0 +1,283 @@
+# src/flow_filter.py
+
+"""Filter expressions for the connection table, compiled once into a predicate over flow records.
+
+  expression := term (OR term)*
+  term       := factor ([AND] factor)*        (juxtaposition means AND)
+  factor     := NOT factor | '(' expression ')' | field op value | value
+  op         := =  (contains)   ==  (equals)   !=  (does not contain)
+                ~  (regex)      !~  (no regex match)
+                <  <=  >  >=    in  (CIDRs for ip, a comma list otherwise)
+
+A bare value matches any text column. Values may be quoted. A regex after ~
+or !~ runs to the next space, so it may contain ( ) | = without quotes;
+closing parentheses it does not open itself end it. Numbers take K/M/G/T
+(x1000) or Ki/Mi/Gi/Ti (x1024) suffixes, optionally followed by B, b or bps
+(volume is in bytes, rate in bits/s). Text matching ignores case.
+
+Comparisons on ip, process, interface and network remember their result for
+each distinct value of the column, so a value shared by many flows (a
+process, an interface, a busy destination) is tested once and a new flow
+with a known value costs a dict lookup. The memos hold at most
+MAX_MEMO_ENTRIES values per comparison; the oldest go first.
+"""
+
+import functools
+import ipaddress
+import itertools
+import re
+import socket
+
+# filter name -> (record field, numeric)
+FIELDS = {
+    "ip": ("dst_ip", False),
+    "domain": ("domain", False),
+    "port": ("dst_port", True),
+    "process": ("process_name", False),
+    "interface": ("interface", False),
+    "volume": ("volume", True),
+    "rate": ("rate_bps", True),
+    "location": ("location", False),
+    "network": ("network", False),
+}
+# Columns whose values repeat across flows. Most processes, interfaces and networks have many flows; destinations
+# have a few each (one per port and interface), so dst_ip gains less but its CIDR and regex tests cost the most
+MEMOIZED_FIELDS = ("dst_ip", "process_name", "interface", "network")
+TEXT_FIELDS = [field for field, numeric in FIELDS.values() if not numeric]
+MAX_MEMO_ENTRIES = 200000 # Per comparison; past this the oldest quarter is dropped
+
+TOKEN = re.compile(r'\s*(?:(?P<paren>[()])|(?P<op>==|!=|!~|<=|>=|=|~|<|>)|"(?P<quoted>(?:[^"\\]|\\.)*)"'
+                   r'|(?P<word>[^\s()=!~<>"]+))')
+REGEX_OPERAND = re.compile(r'\s*(?P<word>[^\s"]\S*)') # An unquoted regex runs to whitespace
+NUMBER = re.compile(r'^(\d+(?:\.\d*)?|\.\d+)\s*([kmgt]i?)?(?:b|bps|bit/s)?$', re.IGNORECASE)
+UNIT_SCALE = {"k": 10 ** 3, "m": 10 ** 6, "g": 10 ** 9, "t": 10 ** 12,
+              "ki": 2 ** 10, "mi": 2 ** 20, "gi": 2 ** 30, "ti": 2 ** 40}
+
+class FilterError(ValueError):
+    """A filter expression that does not parse; position is the offset of the offending text."""
+
+    def __init__(self, message, position):
+        super().__init__(f"{message} (at character {position + 1})")
+        self.position = position
+
+class FlowFilter:
+    """A compiled filter expression; call matches(record) for each flow record dict."""
+
+    def __init__(self, text):
+        self.text = text
+        self.memos = [] # (record field, {value: result}) for each memoized comparison
+        self.fields = set() # Record fields the expression reads
+        self._tokens = _tokenize(text)
+        self._position = 0
+        self.matches = self._parse_expression()
+        if self._position < len(self._tokens):
+            _, value, start = self._tokens[self._position]
+            raise FilterError(f"Unexpected '{value}'", start)
+        del self._tokens
+
+    def __call__(self, record):
+        return self.matches(record)
+
+    # --- Parser: each method returns a predicate taking a record ---
+
+    def _peek(self):
+        return self._tokens[self._position] if self._position < len(self._tokens) else (None, None, len(self.text))
+
+    def _next(self):
+        token = self._peek()
+        self._position += 1
+        return token
+
+    def _is_keyword(self, token, keyword):
+        return token[0] == "word" and token[1].upper() == keyword
+
+    def _parse_expression(self):
+        terms = [self._parse_term()]
+        while self._is_keyword(self._peek(), "OR"):
+            self._next()
+            terms.append(self._parse_term())
+        # Nested closures rather than any(): a generator per row costs more than the comparisons
+        return functools.reduce(_either, terms)
+
+    def _parse_term(self):
+        factors = [self._parse_factor()]
+        while True:
+            token = self._peek()
+            if self._is_keyword(token, "AND"):
+                self._next()
+            elif token[0] is None or token[1] == ")" or self._is_keyword(token, "OR"):
+                break
+            factors.append(self._parse_factor())
+        return functools.reduce(_both, factors)
+
+    def _parse_factor(self):
+        kind, value, start = self._next()
+        if kind is None:
+            raise FilterError("Expression ends early", start)
+        if kind == "word" and value.upper() == "NOT":
+            factor = self._parse_factor()
+            return lambda record: not factor(record)
+        if value == "(":
+            inner = self._parse_expression()
+            if self._next()[1] != ")":
+                raise FilterError("Missing ')'", start)
+            return inner
+        if kind not in ("word", "quoted") or kind == "word" and value.upper() in ("AND", "OR"):
+            raise FilterError(f"Unexpected '{value}'", start)
+
+        following = self._peek()
+        if kind == "word" and value.lower() in FIELDS and (
+                following[0] == "op" or self._is_keyword(following, "IN")):
+            self._next()
+            operand_kind, operand, operand_start = self._next()
+            if operand_kind not in ("word", "quoted"):
+                raise FilterError(f"Missing value after '{following[1]}'", operand_start)
+            return self._comparison(value.lower(), following[1].lower(), operand, operand_start)
+        # A bare value: a substring of any text column
+        needle = value.lower()
+        self.fields.update(TEXT_FIELDS)
+        return lambda record: any(needle in str(record[field]).lower() for field in TEXT_FIELDS)
+
+    # --- Comparisons ---
+
+    def _comparison(self, name, operator, operand, start):
+        field, numeric = FIELDS[name]
+        self.fields.add(field)
+        if operator == "in":
+            test = self._membership(name, numeric, operand, start)
+        elif operator in ("~", "!~"):
+            try:
+                pattern = re.compile(operand, re.IGNORECASE)
+            except re.error as error:
+                raise FilterError(f"Bad regular expression: {error}", start) from None
+            found = operator == "~"
+            test = lambda value: (pattern.search(str(value)) is not None) == found
+        elif numeric:
+            test = _numeric_test(operator, _parse_number(operand, start))
+        elif operator in ("<", "<=", ">", ">="):
+            raise FilterError(f"'{name}' is not numeric", start)
+        else:
+            test = _text_test(operator, operand.lower())
+
+        if field not in MEMOIZED_FIELDS:
+            return lambda record: test(record[field])
+        memo = {}
+        self.memos.append((field, memo))
+        def memoized(record):
+            value = record[field]
+            result = memo.get(value)
+            if result is None:
+                if len(memo) >= MAX_MEMO_ENTRIES:
+                    # Dicts keep insertion order: drop the values tested longest ago, in one batch
+                    for old in list(itertools.islice(memo, MAX_MEMO_ENTRIES // 4)):
+                        del memo[old]
+                result = memo[value] = test(value)
+            return result
+        return memoized
+
+    def _membership(self, name, numeric, operand, start):
+        items = [item.strip() for item in operand.split(",") if item.strip()]
+        if not items:
+            raise FilterError("Empty list after 'in'", start)
+        if name == "ip":
+            try:
+                networks = [ipaddress.ip_network(item, strict=False) for item in items]
+            except ValueError as error:
+                raise FilterError(str(error), start) from None
+            # Integer ranges: parsing with inet_pton is several times cheaper than ipaddress per flow
+            ranges = {4: [], 6: []}
+            for network in networks:
+                ranges[network.version].append((int(network.network_address), int(network.broadcast_address)))
+            def in_networks(value):
+                address = _address_value(value)
+                if address is not None:
+                    for first, last in ranges[address[0]]:
+                        if first <= address[1] <= last:
+                            return True
+                return False
+            return in_networks
+        if numeric:
+            ranges = []
+            for item in items:
+                low, _, high = item.partition("-") # port in 80,443,8000-8999
+                ranges.append((_parse_number(low, start), _parse_number(high or low, start)))
+            return lambda value: any(low <= value <= high for low, high in ranges)
+        choices = {item.lower() for item in items}
+        return lambda value: str(value).lower() in choices
+
+def compile_filter(text):
+    """Compiles a filter expression; returns None for an empty one. Raises FilterError."""
+    if not text.strip():
+        return None
+    return FlowFilter(text)
+
+def _tokenize(text):
+    tokens = [] # (kind, value, start)
+    position = 0
+    while position < len(text):
+        match = TOKEN.match(text, position)
+        if match is None:
+            if not text[position:].strip():
+                break
+            raise FilterError("Unterminated quote", position)
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "quoted":
+            value = re.sub(r'\\(.)', r'\1', value)
+        tokens.append((kind, value, match.start(kind) - (kind == "quoted")))
+        position = match.end()
+        if kind == "op" and value in ("~", "!~"):
+            operand = REGEX_OPERAND.match(text, position)
+            if operand is not None:
+                pattern = _regex_operand(operand.group("word"))
+                if pattern:
+                    tokens.append(("word", pattern, operand.start("word")))
+                    position = operand.start("word") + len(pattern)
+    return tokens
+
+def _regex_operand(word):
+    """Drops the closing parentheses that end an enclosing group rather than one of the regex's own."""
+    while word.endswith(")") and word.count(")") > word.count("("):
+        word = word[:-1]
+    return word
+
+def _either(first, second):
+    return lambda record: first(record) or second(record)
+
+def _both(first, second):
+    return lambda record: first(record) and second(record)
+
+def _address_value(ip):
+    """(version, integer) for an IP string, or None if it is not one."""
+    for version, family in ((4, socket.AF_INET), (6, socket.AF_INET6)):
+        try:
+            return version, int.from_bytes(socket.inet_pton(family, ip), "big")
+        except (OSError, TypeError):
+            pass
+    return None
+
+def _parse_number(text, start):
+    match = NUMBER.match(text.strip())
+    if match is None:
+        raise FilterError(f"'{text}' is not a number", start)
+    return float(match.group(1)) * UNIT_SCALE.get((match.group(2) or "").lower(), 1)
+
+def _numeric_test(operator, number):
+    if operator in ("=", "=="):
+        return lambda value: value == number
+    if operator == "!=":
+        return lambda value: value != number
+    if operator == "<":
+        return lambda value: value < number
+    if operator == "<=":
+        return lambda value: value <= number
+    if operator == ">":
+        return lambda value: value > number
+    return lambda value: value >= number
+
+def _text_test(operator, needle):
+    if operator == "=":
+        return lambda value: needle in str(value).lower()
+    if operator == "!=":
+        return lambda value: needle not in str(value).lower()
+    return lambda value: str(value).lower() == needle
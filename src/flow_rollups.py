@@ -0,0 +1,145 @@
+# src/flow_rollups.py
+
+"""Traffic totals of the tracked flows grouped by process, country, ASN, interface and VPN.
+
+FlowRollups is fed by FlowEngine: every flow delta, eviction and resolver
+result adjusts a fixed number of [bytes, packets, flows] counters, so the
+summary panel and the headless stats read the groups without scanning the
+flow table. A flow is counted under the process it has now and the location
+its destination has now: when the capture names the process of a flow that
+was "Unknown", or the resolver answers for a destination, the totals the
+flow (or destination) already has are moved to the new group in one step.
+
+Groups cover the flows currently in the flow table; evicted flows leave them.
+bytes_seen, packets_seen and flows_seen count everything since start.
+"""
+
+import heapq
+
+PROCESS = "process"
+COUNTRY = "country"
+ASN = "asn"
+INTERFACE = "interface"
+VPN = "vpn"
+DIMENSIONS = (PROCESS, COUNTRY, ASN, INTERFACE, VPN)
+
+VPN_INTERFACE = 'NordLynx'
+UNRESOLVED = "Unresolved" # Country and ASN of a destination the resolver has not answered for yet
+
+def vpn_group(interface):
+    return "VPN" if interface == VPN_INTERFACE else "Direct"
+
+def asn_group(result):
+    """'AS13335 Cloudflare, Inc.' from a resolver result, or its network text ('N/A', 'Error') without a number."""
+    network = result.get("network") or "Unknown"
+    return f"AS{result['asn']} {network}" if result.get("asn") is not None else network
+
+class FlowRollups:
+    """Per-group totals kept up to date in O(1) per flow delta, eviction and resolver result.
+
+    Each flow keeps the [bytes, packets, flows] lists of its process,
+    interface and VPN groups, and each destination those of its country and
+    ASN, so a delta to a known flow is a few additions without lookups.
+    """
+
+    def __init__(self):
+        self.groups = {dimension: {} for dimension in DIMENSIONS} # dimension -> group -> [bytes, packets, flows]
+        self.total = [0, 0, 0] # [bytes, packets, flows] of the tracked flows
+        self.bytes_seen = 0
+        self.packets_seen = 0
+        self.flows_seen = 0
+        self._flows = {} # flow key -> [process, its totals, interface totals, VPN totals]
+        self._destinations = {} # dst_ip -> [totals, country, its totals, ASN group, its totals]
+
+    def add(self, record, length, packets, is_new=False):
+        """Counts a delta already applied to record (a FlowRecord); is_new for the first one of a flow."""
+        if is_new:
+            flow, destination = self._add_flow(record)
+        else:
+            flow = self._flows[record.key]
+            destination = self._destinations[record.dst_ip]
+            if flow[0] != record.process_name: # Attributed to a process after its first packets
+                self._move_process(flow, record, length, packets)
+        for totals in (flow[1], flow[2], flow[3], destination[0], destination[2], destination[4], self.total):
+            totals[0] += length
+            totals[1] += packets
+        self.bytes_seen += length
+        self.packets_seen += packets
+
+    def remove(self, record):
+        """Takes an evicted flow's totals out of its groups."""
+        flow = self._flows.pop(record.key)
+        destination = self._destinations[record.dst_ip]
+        memberships = ((PROCESS, flow[0], flow[1]), (INTERFACE, record.interface, flow[2]),
+                       (VPN, vpn_group(record.interface), flow[3]), (COUNTRY, destination[1], destination[2]),
+                       (ASN, destination[3], destination[4]), (None, None, destination[0]), (None, None, self.total))
+        for dimension, group, totals in memberships:
+            totals[0] -= record.volume
+            totals[1] -= record.packets
+            totals[2] -= 1
+            if dimension is not None and not totals[2]: # Its last flow left
+                del self.groups[dimension][group]
+        if not destination[0][2]:
+            del self._destinations[record.dst_ip]
+
+    def resolve(self, ip, result):
+        """Moves the totals of a destination's flows to the country and ASN of a resolver result."""
+        destination = self._destinations.get(ip)
+        if destination is None:
+            return
+        totals = destination[0]
+        resolved = ((COUNTRY, 1, result.get("country") or "Unknown"), (ASN, 3, asn_group(result)))
+        for dimension, index, group in resolved:
+            if group != destination[index]:
+                self._move(dimension, destination[index], destination[index + 1], group, totals)
+                destination[index] = group
+                destination[index + 1] = self.groups[dimension][group]
+
+    def top(self, dimension, n=5):
+        """The n groups of a dimension with the most bytes: [(group, bytes, packets, flows)]."""
+        ranked = heapq.nlargest(n, self.groups[dimension].items(), key=lambda item: item[1][0])
+        return [(group, *totals) for group, totals in ranked]
+
+    def summary(self, n=5):
+        """Totals and the top n groups of each dimension, as JSON-friendly values."""
+        summary = {"bytes": self.total[0], "packets": self.total[1], "flows": self.total[2],
+                   "bytes_seen": self.bytes_seen, "packets_seen": self.packets_seen, "flows_seen": self.flows_seen}
+        for dimension in DIMENSIONS:
+            summary[dimension] = [[group, length, flows] for group, length, _, flows in self.top(dimension, n)]
+        return summary
+
+    def _add_flow(self, record):
+        destination = self._destinations.get(record.dst_ip)
+        if destination is None:
+            destination = self._destinations[record.dst_ip] = [
+                [0, 0, 0], UNRESOLVED, self._group(COUNTRY, UNRESOLVED), UNRESOLVED, self._group(ASN, UNRESOLVED)]
+        flow = self._flows[record.key] = [record.process_name, self._group(PROCESS, record.process_name),
+                                          self._group(INTERFACE, record.interface),
+                                          self._group(VPN, vpn_group(record.interface))]
+        for totals in (flow[1], flow[2], flow[3], destination[0], destination[2], destination[4], self.total):
+            totals[2] += 1
+        self.flows_seen += 1
+        return flow, destination
+
+    def _move_process(self, flow, record, length, packets):
+        """Moves the totals a flow had before this delta to the process it is now attributed to."""
+        self._move(PROCESS, flow[0], flow[1], record.process_name,
+                   (record.volume - length, record.packets - packets, 1))
+        flow[0] = record.process_name
+        flow[1] = self.groups[PROCESS][record.process_name]
+
+    def _move(self, dimension, old_group, old_totals, new_group, totals):
+        new_totals = self._group(dimension, new_group)
+        for i in range(3):
+            old_totals[i] -= totals[i]
+            new_totals[i] += totals[i]
+        if not old_totals[2]: # Its last flow moved to new_group
+            del self.groups[dimension][old_group]
+
+    def _group(self, dimension, group):
+        """The [bytes, packets, flows] list of a group, created empty if it has no flows yet."""
+        groups = self.groups[dimension]
+        totals = groups.get(group)
+        if totals is None:
+            totals = groups[group] = [0, 0, 0]
+        return totals
@@ -0,0 +1,127 @@
+# src/flow_table.py
+
+import heapq
+import time
+from collections import OrderedDict
+
+class FlowRecord:
+    """One aggregated connection. __slots__ keeps it to a fraction of a dict's size."""
+
+    __slots__ = ("key", "dst_ip", "dst_port", "interface", "process_name", "volume", "packets", "last_seen")
+
+    def __init__(self, key, dst_ip, dst_port, interface, process_name="Unknown", last_seen=0.0):
+        self.key = key
+        self.dst_ip = dst_ip
+        self.dst_port = dst_port
+        self.interface = interface
+        self.process_name = process_name
+        self.volume = 0
+        self.packets = 0
+        self.last_seen = last_seen
+
+class SpaceSaving:
+    """Space-Saving top-K: tracks the k heaviest keys in O(k) memory.
+
+    Each counter overestimates its key's true weight by at most its error, and
+    any key heavier than total/k is guaranteed to be among the counters.
+    The smallest counter is found with a min-heap in O(log k) amortized.
+    """
+
+    def __init__(self, k=100):
+        self.k = k
+        self._counters = {} # key -> [count, error]
+        # One (count, key) per counter. Counts only grow, so an entry may be stale (too small);
+        # it is refreshed when it reaches the top, and each refresh pays for an earlier update.
+        self._heap = []
+
+    def __contains__(self, key):
+        return key in self._counters
+
+    def update(self, key, weight):
+        counter = self._counters.get(key)
+        if counter is not None:
+            counter[0] += weight
+        elif len(self._counters) < self.k:
+            self._counters[key] = [weight, 0]
+            heapq.heappush(self._heap, (weight, key))
+        else:
+            # Replace the smallest counter; the newcomer inherits its count as error
+            count, smallest = self._heap[0]
+            while count != self._counters[smallest][0]:
+                heapq.heapreplace(self._heap, (self._counters[smallest][0], smallest))
+                count, smallest = self._heap[0]
+            del self._counters[smallest]
+            self._counters[key] = [count + weight, count]
+            heapq.heapreplace(self._heap, (count + weight, key))
+
+    def top(self, n=None):
+        """Returns [(key, estimated weight, error)] heaviest first."""
+        ranked = sorted(self._counters.items(), key=lambda item: item[1][0], reverse=True)
+        return [(key, count, error) for key, (count, error) in ranked[:n]]
+
+class FlowTable:
+    """Bounded flow table: idle flows expire, and a hard cap evicts the least recently seen.
+
+    Above the cap, flows currently tracked as heavy hitters go last, so the
+    largest flows keep exact totals while many small ones come and go. They
+    still expire when idle, and count against max_flows like any other flow.
+    """
+
+    def __init__(self, max_flows=50000, idle_timeout=300.0, heavy_hitters=100):
+        self.max_flows = max_flows
+        self.idle_timeout = idle_timeout
+        self.heavy_hitters = SpaceSaving(heavy_hitters)
+        self._flows = OrderedDict() # key -> FlowRecord, least recently seen first
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._flows)
+
+    def __contains__(self, key):
+        return key in self._flows
+
+    def __iter__(self):
+        return iter(self._flows.values())
+
+    def get(self, key):
+        return self._flows.get(key)
+
+    def add(self, key, dst_ip, dst_port, interface, process_name="Unknown", now=None):
+        record = FlowRecord(key, dst_ip, dst_port, interface, process_name,
+                            time.monotonic() if now is None else now)
+        self._flows[key] = record
+        return record
+
+    def apply_delta(self, record, length, packets, process_name, now=None):
+        record.volume += length
+        record.packets += packets
+        if process_name != "Unknown":
+            record.process_name = process_name
+        record.last_seen = time.monotonic() if now is None else now
+        self._flows.move_to_end(record.key)
+        self.heavy_hitters.update(record.key, length)
+
+    def over_capacity(self):
+        return len(self._flows) > self.max_flows
+
+    def evict(self, now=None):
+        """Removes idle flows, then the least recently seen ones above max_flows; returns the removed records."""
+        now = time.monotonic() if now is None else now
+        idle_before = now - self.idle_timeout
+        removed = []
+        spared = [] # Active heavy hitters passed over while above the cap
+        # The OrderedDict is in last-seen order, so we can stop at the first flow that must stay
+        for key, record in self._flows.items():
+            over_cap = len(self._flows) - len(removed) > self.max_flows
+            if record.last_seen >= idle_before and not over_cap:
+                break
+            if record.last_seen < idle_before or key not in self.heavy_hitters:
+                removed.append(record)
+            else:
+                spared.append(record)
+        # Still above the cap with only heavy hitters left: the least recently seen of them go too
+        removed += spared[:max(len(self._flows) - len(removed) - self.max_flows, 0)]
+        for record in removed:
+            del self._flows[record.key]
+        self.evicted += len(removed)
+        return removed
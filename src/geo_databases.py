@@ -0,0 +1,154 @@
+# src/geo_databases.py
+
+"""The GeoLite2 City and ASN databases, picked up again whenever their files are updated.
+
+GeoDatabases opens both files memory-mapped and checks their size, mtime and
+inode every few seconds from a background thread. A new version is loaded
+on that thread once the files have stopped changing for one check, so a
+weekly update can be dropped in place while Conmon runs. The readers are
+swapped with a single assignment: lookups never wait for a load, one already
+running finishes on the readers it started with, and the old readers are
+released with the last reference to them.
+
+Cached results are checked against the new version before the swap, and
+only the entries it answers differently are dropped.
+"""
+
+import datetime
+import os
+import threading
+import time
+import geoip2.database
+import maxminddb
+from geoip_lookup import GeoIpLookup
+from metrics import REGISTRY
+
+try:
+    import maxminddb.extension
+    MMAP_MODE = geoip2.database.MODE_MMAP_EXT # The C reader, on the same mapping
+except ImportError:
+    MMAP_MODE = geoip2.database.MODE_MMAP
+
+CHECK_INTERVAL = 10.0 # Seconds between checks of the database files
+
+GEOIP_LOAD = REGISTRY.histogram(
+    "conmon_geoip_load_seconds", "Time to open a new version of the GeoIP databases and check the cache against it")
+GEOIP_LOADS = REGISTRY.counter("conmon_geoip_loads_total", "GeoIP database loads by result", ("result",))
+GEOIP_INVALIDATED = REGISTRY.counter(
+    "conmon_geoip_cache_invalidated_total", "Cached results dropped because a new database version answers differently")
+
+class GeoDatabases:
+    """The current GeoIpLookup, replaced when the files change.
+
+    current is a (version, lookup) pair; lookup is None until the files
+    exist. Results meant for cache go through cache_result(), which refuses
+    those of a version that has been replaced meanwhile.
+    """
+
+    def __init__(self, city_path, asn_path, cache=None, interval=CHECK_INTERVAL):
+        self.paths = (city_path, asn_path)
+        self.cache = cache
+        self.interval = interval
+        self.current = (0, None)
+        self.ready = threading.Event() # Set once the first version is loaded
+        self._lock = threading.Lock() # Orders cache_result() against the swap
+        self._loaded = None # File signature of the current version
+        self._failed = None # Signature that failed to load, not retried until the files change again
+        self._seen = None # Signature at the previous check
+        self._reported_missing = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="GeoDatabases", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Stops watching and closes the current readers; call once no lookups are running."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        version, lookup = self.current
+        if lookup is not None:
+            self.current = (version, None)
+            lookup.close()
+
+    def _run(self):
+        while True:
+            self.check()
+            if self._stop.wait(self.interval):
+                return
+
+    def _signature(self):
+        """(size, mtime, inode) of both files, or None while either is missing."""
+        try:
+            return tuple((stat.st_size, stat.st_mtime_ns, stat.st_ino) for stat in map(os.stat, self.paths))
+        except OSError:
+            return None
+
+    def check(self):
+        """Loads the files if they changed; returns True when a new version was swapped in."""
+        signature = self._signature()
+        seen, self._seen = self._seen, signature
+        if signature is None:
+            if not self._reported_missing:
+                self._reported_missing = True
+                missing = [path for path in self.paths if not os.path.exists(path)]
+                print(f"Waiting for the GeoIP databases, missing: {', '.join(missing)}")
+            return False
+        self._reported_missing = False
+        if signature in (self._loaded, self._failed):
+            return False
+        if self.ready.is_set() and signature != seen:
+            return False # Possibly still being written; load it once it stays the same for a check
+        return self._load(signature)
+
+    def cache_result(self, version, network, result):
+        """Caches a lookup result, unless the version that produced it has been replaced."""
+        with self._lock:
+            if version == self.current[0]:
+                self.cache.put(network, result)
+
+    def _load(self, signature):
+        started = time.perf_counter()
+        try:
+            lookup = GeoIpLookup(*self.paths, mode=MMAP_MODE)
+        except (OSError, ValueError, maxminddb.InvalidDatabaseError) as e:
+            self._failed = signature
+            GEOIP_LOADS.inc(result="error")
+            print(f"ERROR: Could not load the GeoIP databases, keeping the current version: {e}")
+            return False
+        stale = []
+        checked = set()
+        if self.cache is not None and self.current[1] is not None:
+            stale = self._stale_entries(lookup, self.cache.items(), checked)
+        with self._lock:
+            version = self.current[0] + 1
+            self.current = (version, lookup)
+        if self.cache is not None:
+            # Entries cached from the old version between the snapshot and the swap
+            stale += self._stale_entries(lookup, self.cache.items(), checked)
+            GEOIP_INVALIDATED.inc(self.cache.discard(stale))
+        elapsed = time.perf_counter() - started
+        GEOIP_LOAD.observe(elapsed)
+        GEOIP_LOADS.inc(result="ok")
+        self._loaded = signature
+        self.ready.set()
+        built = ", ".join(datetime.datetime.fromtimestamp(reader.metadata().build_epoch, datetime.timezone.utc)
+                          .strftime('%Y-%m-%d') for reader in (lookup.city_reader, lookup.asn_reader))
+        print(f"Loaded GeoIP databases version {version} (built {built}) in {elapsed * 1000:.0f} ms"
+              + (f", {len(stale)} cached results invalidated" if version > 1 else ""))
+        return True
+
+    def _stale_entries(self, lookup, entries, checked):
+        """Networks of the entries that lookup answers differently; skips (and records) networks in checked."""
+        stale = []
+        for network, value in entries:
+            if network in checked:
+                continue
+            checked.add(network)
+            result, result_network = lookup.lookup(str(network.network_address))
+            if result_network != network or result != value:
+                stale.append(network)
+        return stale
@@ -0,0 +1,76 @@
+# src/geo_grid.py
+
+import numpy as np
+
+class GeoGrid:
+    """Aggregates destinations into a fixed lat/lon grid weighted by bytes sent.
+
+    The map draws one object per occupied cell instead of one marker per
+    destination, so its cost is bounded by the grid size rather than by the
+    number of destinations. Updates are vectorized with numpy and only cells
+    touched since the last take_changes() are reported.
+    """
+
+    def __init__(self, cell_degrees=1.0):
+        self.cell_degrees = cell_degrees
+        self.rows = int(np.ceil(180.0 / cell_degrees))
+        self.cols = int(np.ceil(360.0 / cell_degrees))
+        size = self.rows * self.cols
+        self.bytes = np.zeros(size, dtype=np.float64) # Bytes sent per cell
+        self.destinations = np.zeros(size, dtype=np.int64) # Distinct destination IPs per cell
+        self._dirty = np.zeros(size, dtype=bool)
+
+    def cell_indices(self, lats, lons):
+        """Maps arrays of coordinates to flat cell indices."""
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        rows = np.clip(((lats + 90.0) / self.cell_degrees).astype(np.int64), 0, self.rows - 1)
+        cols = np.clip(((lons + 180.0) / self.cell_degrees).astype(np.int64), 0, self.cols - 1)
+        return rows * self.cols + cols
+
+    def cell_index(self, lat, lon):
+        return int(self.cell_indices([lat], [lon])[0])
+
+    def add_destinations(self, cells, byte_counts):
+        """Places newly located destinations in their cells with the bytes they already sent."""
+        cells = np.asarray(cells, dtype=np.int64)
+        if cells.size == 0:
+            return
+        np.add.at(self.destinations, cells, 1)
+        np.add.at(self.bytes, cells, np.asarray(byte_counts, dtype=np.float64))
+        self._dirty[cells] = True
+
+    def remove_destinations(self, cells):
+        """Forgets destinations whose flows were all evicted; the bytes they sent stay in the cell."""
+        cells = np.asarray(cells, dtype=np.int64)
+        if cells.size == 0:
+            return
+        np.subtract.at(self.destinations, cells, 1)
+        self._dirty[cells] = True
+
+    def add_bytes(self, cells, byte_counts):
+        """Adds per-flow byte deltas to their cells; repeated cells accumulate."""
+        cells = np.asarray(cells, dtype=np.int64)
+        if cells.size == 0:
+            return
+        np.add.at(self.bytes, cells, np.asarray(byte_counts, dtype=np.float64))
+        self._dirty[cells] = True
+
+    def has_changes(self):
+        return bool(self._dirty.any())
+
+    def take_changes(self):
+        """Returns (cell ids, center lats, center lons, bytes, destinations) for cells changed since the last call."""
+        cells = np.flatnonzero(self._dirty)
+        self._dirty[cells] = False
+        return self._describe(cells)
+
+    def occupied(self):
+        """Same as take_changes() but for every cell with at least one destination."""
+        return self._describe(np.flatnonzero(self.destinations))
+
+    def _describe(self, cells):
+        rows, cols = np.divmod(cells, self.cols)
+        lats = (rows + 0.5) * self.cell_degrees - 90.0
+        lons = (cols + 0.5) * self.cell_degrees - 180.0
+        return cells, lats, lons, self.bytes[cells], self.destinations[cells]
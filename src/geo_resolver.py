@@ -0,0 +1,173 @@
+# src/geo_resolver.py
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from prefix_cache import PrefixCache
+import geoip_lookup
+from geoip_lookup import DB_CITY_PATH, DB_ASN_PATH, UNROUTED_RESULT
+from geo_databases import GeoDatabases, CHECK_INTERVAL
+from ip_classify import is_routable
+from metrics import REGISTRY
+
+RESOLVER_BACKLOG = REGISTRY.gauge("conmon_resolver_backlog", "IPs waiting for a GeoIP/ASN lookup")
+RESOLVER_LATENCY = REGISTRY.histogram(
+    "conmon_resolver_latency_seconds", "Time from queueing an IP to its GeoIP/ASN result, backlog included")
+RESOLVER_LOOKUP = REGISTRY.histogram(
+    "conmon_resolver_lookup_seconds", "Duration of GeoIP/ASN database work per call (one IP, or one worker batch)",
+    ("mode",))
+RESOLVER_CACHE = REGISTRY.counter("conmon_resolver_cache_total", "Prefix cache lookups by result", ("result",))
+RESOLVER_UNROUTED = REGISTRY.counter(
+    "conmon_resolver_unrouted_total", "IPs answered without a lookup because they are not publicly routable")
+
+class GeoResolver:
+    """Resolves destination IPs to location, country and ASN on a background thread.
+
+    Addresses that are not publicly routable (ip_classify) are answered
+    without a lookup. Others come from the prefix cache when possible; misses are looked up
+    in the GeoLite2 databases, either one at a time (workers=1, delivered
+    through on_result(result)) or in batches spread over worker processes
+    (workers>1, delivered through on_batch(results)). Both callbacks run on
+    the resolver thread. The databases are reloaded when their files change
+    (GeoDatabases); IPs queue up while they are missing.
+    """
+
+    def __init__(self, cache_size=4096, workers=1, batch_size=64, city_path=DB_CITY_PATH, asn_path=DB_ASN_PATH,
+                 on_result=None, on_batch=None, check_interval=CHECK_INTERVAL):
+        self.city_path = city_path
+        self.asn_path = asn_path
+        self.workers = workers
+        self.batch_size = batch_size
+        self.on_result = on_result
+        self.on_batch = on_batch
+        self._queue = deque() # IPs waiting to be resolved, in arrival order
+        self._pending = {} # Same IPs -> time they were queued, for O(1) duplicate checks and latency
+        self._condition = threading.Condition()
+        self.cache = PrefixCache(max_entries=cache_size)
+        self.databases = GeoDatabases(city_path, asn_path, self.cache, check_interval)
+        self.unrouted = 0 # IPs answered without touching the cache or the databases
+        self.is_running = True
+        self._thread = None
+
+    def start(self):
+        self.databases.start()
+        self._thread = threading.Thread(target=self._run, name="GeoResolver", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self.databases.ready.wait(0.5): # Until the files exist
+            if not self.is_running:
+                return
+        if self.workers > 1:
+            self._run_batched()
+        else:
+            self._run_single()
+        print(f"Resolver cache stats: {self.cache.stats()}")
+
+    def _run_single(self):
+        while True:
+            ips = self._next_ips(1)
+            if not ips:
+                break
+            ip, queued_at = ips[0]
+            result = self._resolve_ip(ip)
+            RESOLVER_LATENCY.observe(time.monotonic() - queued_at)
+            self.on_result(result)
+
+    def _run_batched(self):
+        """Spreads each batch of cache misses over a pool of worker processes."""
+        print(f"Resolver using {self.workers} workers, batches of up to {self.batch_size} IPs")
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=geoip_lookup.init_worker,
+                                 initargs=(self.city_path, self.asn_path)) as executor:
+            while True:
+                ips = self._next_ips(self.batch_size)
+                if not ips:
+                    break
+                results = []
+                misses = []
+                for ip, _ in ips:
+                    if not is_routable(ip):
+                        self.unrouted += 1
+                        results.append(dict(UNROUTED_RESULT, ip=ip))
+                        continue
+                    cached = self.cache.get(ip)
+                    if cached is not None:
+                        results.append(dict(cached, ip=ip))
+                    else:
+                        misses.append(ip)
+
+                chunk_size = -(-len(misses) // self.workers) or 1 # Ceiling division; 1 when nothing missed
+                chunks = [misses[i:i + chunk_size] for i in range(0, len(misses), chunk_size)]
+                if chunks:
+                    version = self.databases.current[0]
+                    with RESOLVER_LOOKUP.time(mode="batch"):
+                        for answered_by, chunk_results in executor.map(
+                                geoip_lookup.lookup_batch, chunks, repeat(version)):
+                            for ip, result, network in chunk_results:
+                                if network is not None:
+                                    # Under the version that answered, so a worker still on the old files
+                                    # cannot cache old answers as new ones
+                                    self.databases.cache_result(answered_by, network, result)
+                                results.append(dict(result, ip=ip))
+                now = time.monotonic()
+                for _, queued_at in ips:
+                    RESOLVER_LATENCY.observe(now - queued_at)
+                self.on_batch(results)
+
+    def _next_ips(self, limit):
+        """Blocks until IPs are queued; returns up to limit (ip, queued_at) pairs, or [] once stopped."""
+        with self._condition:
+            while self.is_running and not self._queue:
+                self._condition.wait()
+            if not self.is_running:
+                return []
+            ips = []
+            while self._queue and len(ips) < limit:
+                ip = self._queue.popleft()
+                ips.append((ip, self._pending.pop(ip)))
+            return ips
+
+    def resolve(self, ip_address):
+        with self._condition:
+            if ip_address in self._pending:
+                return
+            self._pending[ip_address] = time.monotonic()
+            self._queue.append(ip_address)
+            self._condition.notify()
+
+    def backlog(self):
+        return len(self._queue)
+
+    def collect_metrics(self):
+        """Publishes the backlog and prefix cache counters; registered by the application."""
+        RESOLVER_BACKLOG.set(self.backlog())
+        stats = self.cache.stats()
+        RESOLVER_CACHE.set_total(stats["hits"], result="hit")
+        RESOLVER_CACHE.set_total(stats["misses"], result="miss")
+        RESOLVER_UNROUTED.set_total(self.unrouted)
+
+    def stop(self):
+        with self._condition:
+            self.is_running = False
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        self.databases.close()
+
+    def _resolve_ip(self, ip):
+        """Answers from the prefix cache when possible, otherwise queries both databases."""
+        if not is_routable(ip):
+            self.unrouted += 1
+            return dict(UNROUTED_RESULT, ip=ip)
+        cached = self.cache.get(ip)
+        if cached is not None:
+            return dict(cached, ip=ip)
+
+        version, lookup = self.databases.current
+        with RESOLVER_LOOKUP.time(mode="single"):
+            result, network = lookup.lookup(ip)
+        if network is not None:
+            self.databases.cache_result(version, network, result)
+        return dict(result, ip=ip)
@@ -0,0 +1,120 @@
+# src/geoip_lookup.py
+
+import geoip2.database
+import geoip2.errors
+from ip_classify import is_routable
+
+DB_CITY_PATH = 'GeoLite2-City.mmdb'
+DB_ASN_PATH = 'GeoLite2-ASN.mmdb'
+
+# The answer for an address that is not publicly routable, which the databases know nothing about
+UNROUTED_RESULT = {"location_str": "N/A", "lat": None, "lon": None, "country": "N/A", "network": "N/A", "asn": None,
+                   "asn_prefix": None, "geo_prefix": None}
+
+class GeoIpLookup:
+    """City + ASN lookups for one IP, reporting the network each answer applies to.
+
+    Kept free of Qt so it can be used from resolver worker processes.
+    """
+
+    def __init__(self, city_path=DB_CITY_PATH, asn_path=DB_ASN_PATH, mode=geoip2.database.MODE_AUTO):
+        self.city_reader = geoip2.database.Reader(city_path, mode=mode)
+        self.asn_reader = geoip2.database.Reader(asn_path, mode=mode)
+
+    def lookup(self, ip):
+        """Returns (result dict without "ip", network to cache it under or None)."""
+        if not is_routable(ip):
+            return dict(UNROUTED_RESULT), None
+        location_data, city_network = self.get_location(ip)
+        network, asn, asn_network = self.get_network(ip)
+        result = {
+            "location_str": location_data['str'],
+            "lat": location_data['lat'],
+            "lon": location_data['lon'],
+            "country": location_data['country'],
+            "network": network,
+            "asn": asn,
+            # Address blocks the answers hold for, so a whole ASN or country can be blocked
+            "asn_prefix": str(asn_network) if asn_network is not None else None,
+            "geo_prefix": str(city_network) if city_network is not None else None,
+        }
+        # Both answers hold for every address in the narrower of the two networks
+        if city_network is None or asn_network is None:
+            return result, None
+        return result, max(city_network, asn_network, key=lambda net: net.prefixlen)
+
+    def get_location(self, ip):
+        """Returns (location dict, network the answer applies to or None)."""
+        default_response = {"str": "N/A", "lat": None, "lon": None, "country": "N/A"}
+        if not is_routable(ip):
+            return default_response, None
+        try:
+            response = self.city_reader.city(ip)
+            city = response.city.name or "Unknown"
+            country = response.country.name or "Unknown"
+            return {
+                "str": f"{city}, {country}",
+                "lat": response.location.latitude,
+                "lon": response.location.longitude,
+                "country": country
+            }, response.traits.network
+        except geoip2.errors.AddressNotFoundError as e:
+            return default_response, getattr(e, 'network', None)
+        except TypeError:
+            return default_response, None
+        except Exception:
+            return {"str": "Error", "lat": None, "lon": None, "country": "Error"}, None
+
+    def get_network(self, ip):
+        """Returns (ASN organization, AS number or None, network the answer applies to or None)."""
+        if not is_routable(ip):
+            return "N/A", None, None
+        try:
+            response = self.asn_reader.asn(ip)
+            return response.autonomous_system_organization, response.autonomous_system_number, response.network
+        except geoip2.errors.AddressNotFoundError as e:
+            return "N/A", None, getattr(e, 'network', None)
+        except Exception:
+            return "Error", None, None
+
+    def close(self):
+        self.city_reader.close()
+        self.asn_reader.close()
+
+# --- Resolver worker processes ---
+# Each worker opens the databases with MODE_MMAP, so all workers share the
+# same read-only pages from the OS page cache instead of loading copies.
+
+_worker_lookup = None
+_worker_paths = None
+_worker_version = None # Database version the worker's readers were opened for
+
+def init_worker(city_path, asn_path):
+    global _worker_paths
+    _worker_paths = (city_path, asn_path)
+
+def lookup_batch(ips, version=0):
+    """Resolves a chunk of IPs in a worker; returns (version, [(ip, result, network or None)]).
+
+    version is the resolver's GeoDatabases version: the worker reopens the
+    files when it differs from the one its readers were opened for. The
+    returned version is the one that answered, which is older than requested
+    while the worker cannot open the new files.
+    """
+    global _worker_lookup, _worker_version
+    if version != _worker_version:
+        try:
+            lookup = GeoIpLookup(*_worker_paths, mode=geoip2.database.MODE_MMAP)
+        except Exception:
+            if _worker_lookup is None:
+                raise
+            lookup = None # Keep answering from the previous version, and retry with the next batch
+        if lookup is not None:
+            if _worker_lookup is not None:
+                _worker_lookup.close()
+            _worker_lookup, _worker_version = lookup, version
+    results = []
+    for ip in ips:
+        result, network = _worker_lookup.lookup(ip)
+        results.append((ip, result, network))
+    return _worker_version, results
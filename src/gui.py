@@ -2,15 +2,21 @@
 
 import sys
 from PyQt5.QtWidgets import (
-    QApplication, QMainWindow, QTableWidget, QTableWidgetItem, 
-    QVBoxLayout, QWidget, QHeaderView, QSplitter, QPushButton, QHBoxLayout, QLabel, QLineEdit, QMenuBar, QAction, QMessageBox
+    QApplication, QMainWindow, QTableView, QAbstractItemView,
+    QVBoxLayout, QWidget, QHeaderView, QSplitter, QPushButton, QHBoxLayout, QLabel, QLineEdit, QMenuBar, QAction, QMessageBox, QMenu
 )
-from PyQt5.QtWebEngineWidgets import QWebEngineView
-from PyQt5.QtGui import QFont, QColor
-from PyQt5.QtCore import Qt, QUrl, pyqtSignal
+from PyQt5.QtGui import QFont
+from PyQt5.QtCore import Qt, QUrl, QTimer, pyqtSignal
 import os
+from connection_model import (
+    ConnectionTableModel, ConnectionFilterProxyModel, COL_DOMAIN, COL_VOLUME, COL_NETWORK, LAT_LON_ROLE
+)
+from rate_chart import RateChart
+from summary_panel import SummaryPanel
+from flow_filter import compile_filter, FilterError
+from metrics import REGISTRY
 
-# (Stylesheet remains the same)
+# Dark theme: gui_app applies it to the whole application, MainWindow to itself
 DARK_STYLESHEET = """
 QWidget {
     background-color: #1e1e1e;
@@ -24,11 +30,11 @@ QHeaderView::section {
     padding: 4px;
     border: 1px solid #555555;
 }
-QTableWidget {
+QTableView {
     gridline-color: #555555;
     border: 1px solid #555555;
 }
-QTableWidget::item {
+QTableView::item {
     border-bottom: 1px solid #555555;
 }
 QScrollBar:vertical, QScrollBar:horizontal {
@@ -54,16 +60,23 @@ QPushButton {
 QLineEdit {
     color: white;
 }
-""" # Collapsed for brevity
+"""
+
+MAP_PUSH_INTERVAL_MS = 500 # At most two marker pushes into the map page per second
+
+MAP_PUSH = REGISTRY.histogram("conmon_map_push_seconds", "Time to hand queued JavaScript to the map page")
 
 class MainWindow(QMainWindow):
     location_selected = pyqtSignal(float, float)
     firewall_toggle_changed = pyqtSignal(bool)
+    # (kind: destination/asn/country/process/all, destination IPs or, for process, process names, block)
+    block_requested = pyqtSignal(str, list, bool)
 
     def __init__(self):
         super().__init__()
         self.map_name = "map" # Default map name
         self._current_filter = None # Stores the active filter
+        self.process_blocking = False # Whether the firewall backend can block programs
         self.setWindowTitle("Conmon - Network Traffic Monitor")
         self.setGeometry(100, 100, 1200, 800)
         self.setStyleSheet(DARK_STYLESHEET)
@@ -90,8 +103,9 @@ class MainWindow(QMainWindow):
 
         # Filter input and buttons
         self.filter_input = QLineEdit()
-        self.filter_input.setPlaceholderText("Filter (e.g., process=chrome.exe, ip=1.2.3.4)")
+        self.filter_input.setPlaceholderText("Filter (e.g., process=chrome volume>10MB OR ip in 104.16.0.0/12)")
         self.filter_input.setFixedWidth(300)
+        self.filter_input.returnPressed.connect(self.apply_filter)
         control_bar.addWidget(self.filter_input)
 
         self.apply_filter_button = QPushButton("Apply Filter")
@@ -106,198 +120,274 @@ class MainWindow(QMainWindow):
         
         splitter = QSplitter(Qt.Vertical)
         splitter.setStyleSheet("QSplitter::handle { background-color: #555555; }")
-
-        self.web_view = QWebEngineView()
-        self.web_view.setUrl(QUrl.fromLocalFile(os.path.abspath('map.html')))
-        splitter.addWidget(self.web_view)
-
-        self.table_widget = QTableWidget()
-        self.table_widget.setColumnCount(7)
-        self.table_widget.setHorizontalHeaderLabels([
-            "Destination IP", "Port", "Process Name", "Interface", "Data Volume (Bytes)", "Location", "Network Provider",
-        ])
+        self.splitter = splitter
+
+        # load_map() swaps in the web view: importing QtWebEngine and starting its
+        # renderer process would otherwise delay the first window by seconds
+        self.web_view = None
+        self.map_placeholder = QLabel("Loading map...")
+        self.map_placeholder.setAlignment(Qt.AlignCenter)
+        splitter.addWidget(self.map_placeholder)
+        self._map_ready = False
+        self._map_scripts = [] # JavaScript waiting to be pushed into the map page
+        self._map_push_timer = QTimer(self)
+        self._map_push_timer.setSingleShot(True)
+        self._map_push_timer.setInterval(MAP_PUSH_INTERVAL_MS)
+        self._map_push_timer.timeout.connect(self._push_map_scripts)
+
+        # Throughput chart, and beside it the totals by process, country, ASN and interface
+        charts = QSplitter(Qt.Horizontal)
+        self.rate_chart = RateChart()
+        charts.addWidget(self.rate_chart)
+        self.summary_panel = SummaryPanel()
+        charts.addWidget(self.summary_panel)
+        charts.setSizes([500, 500])
+        splitter.addWidget(charts)
+        self.selected_flow_key = None # Flow whose rate is drawn beside the totals
+
+        self.table_model = ConnectionTableModel(self)
+        self.proxy_model = ConnectionFilterProxyModel(self)
+        self.proxy_model.setSourceModel(self.table_model)
+
+        self.table_view = QTableView()
+        self.table_view.setModel(self.proxy_model)
+        self.table_view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table_view.verticalHeader().setVisible(False)
         font = QFont('Segoe UI', 10)
-        self.table_widget.setFont(font)
-        header = self.table_widget.horizontalHeader()
+        self.table_view.setFont(font)
+        header = self.table_view.horizontalHeader()
         header.setSectionResizeMode(QHeaderView.ResizeToContents)
-        header.setSectionResizeMode(6, QHeaderView.Stretch) # Adjusted for new column
-        self.table_widget.setSortingEnabled(True)
-        self.table_widget.sortByColumn(3, Qt.DescendingOrder)
-        self.table_widget.cellClicked.connect(self.on_cell_clicked)
-        splitter.addWidget(self.table_widget)
-
-        splitter.setSizes([400, 400])
+        header.setSectionResizeMode(COL_NETWORK, QHeaderView.Stretch)
+        self.table_view.setSortingEnabled(True)
+        self.table_view.sortByColumn(COL_VOLUME, Qt.DescendingOrder) # Highest traffic at the top
+        self.table_view.clicked.connect(self.on_cell_clicked)
+        self.table_view.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.table_view.customContextMenuRequested.connect(self.show_table_menu)
+        splitter.addWidget(self.table_view)
+
+        splitter.setSizes([280, 300, 280])
         layout.addWidget(splitter)
 
         self.setCentralWidget(main_widget)
 
+        # Pipeline metrics, refreshed by the application once per second
+        self.metrics_label = QLabel("Starting...")
+        self.statusBar().addPermanentWidget(self.metrics_label, 1)
+
     def on_firewall_toggled(self, checked):
         self.firewall_toggle_changed.emit(checked)
         self.firewall_toggle.setText("Unblock Internet" if checked else "Block Internet")
 
-    def find_row_by_key(self, key):
-        """Helper function to find a row by its unique key stored in UserRole."""
-        for row in range(self.table_widget.rowCount()):
-            item = self.table_widget.item(row, 0) # Key is stored in the first column
-            if item and item.data(Qt.UserRole) == key:
-                return row
-        return -1
-
-    def add_or_update_connection(self, key, data):
-        """Adds a new row or updates an existing one using a robust key search."""
-        volume_item = QTableWidgetItem()
-        volume_item.setData(Qt.DisplayRole, int(data['volume']))
-
-        row = self.find_row_by_key(key)
-
-        if row != -1:
-            # --- Update Existing Row ---
-            self.table_widget.setItem(row, 3, QTableWidgetItem(data.get("interface", "Unknown"))) # Update Interface column
-            self.table_widget.setItem(row, 4, volume_item) # Adjusted for new column
-            if data.get("process_name") and self.table_widget.item(row, 2).text() == "Unknown":
-                 self.table_widget.setItem(row, 2, QTableWidgetItem(data["process_name"]))
-
-            # Update text color for non-VPN traffic
-            if data.get("interface") != 'NordLynx':
-                yellow_color = QColor(255, 255, 0) # RGB for yellow
-                for col in range(self.table_widget.columnCount()):
-                    item = self.table_widget.item(row, col)
-                    if item:
-                        item.setForeground(yellow_color)
-            else:
-                # Reset color to default if it was previously yellow and now is VPN
-                default_color = QColor(77, 255, 77) # From DARK_STYLESHEET
-                for col in range(self.table_widget.columnCount()):
-                    item = self.table_widget.item(row, col)
-                    if item:
-                        item.setForeground(default_color)
-        else:
-            # --- Add New Row ---
-            self.table_widget.setSortingEnabled(False)
-            row_position = self.table_widget.rowCount()
-            self.table_widget.insertRow(row_position)
-
-            ip_item = QTableWidgetItem(data["dst_ip"])
-            ip_item.setData(Qt.UserRole, key) # Store the unique key in the item
-
-            self.table_widget.setItem(row_position, 0, ip_item)
-            self.table_widget.setItem(row_position, 1, QTableWidgetItem(str(data["dst_port"])))
-            self.table_widget.setItem(row_position, 2, QTableWidgetItem(data.get("process_name", "Unknown")))
-            self.table_widget.setItem(row_position, 3, QTableWidgetItem(data.get("interface", "Unknown"))) # New Interface column
-            self.table_widget.setItem(row_position, 4, volume_item) # Adjusted for new column
-            
-            location_item = QTableWidgetItem("Resolving...")
-            location_item.setData(Qt.UserRole, None) # Initialize lat/lon data
-            self.table_widget.setItem(row_position, 5, location_item) # Adjusted for new column
-            
-            self.table_widget.setItem(row_position, 6, QTableWidgetItem("Resolving...")) # Adjusted for new column
-            self.table_widget.setSortingEnabled(True)
-
-        # Apply filter if active
-        if self._current_filter:
-            self._apply_filter_to_row(row if row != -1 else row_position, data)
+    def set_firewall_state(self, blocked, enabled=True):
+        """Shows the applied firewall state without requesting another change."""
+        self.firewall_toggle.blockSignals(True)
+        self.firewall_toggle.setChecked(blocked)
+        self.firewall_toggle.blockSignals(False)
+        self.firewall_toggle.setText("Unblock Internet" if blocked else "Block Internet")
+        self.firewall_toggle.setEnabled(enabled)
+
+    def selected_values(self, field):
+        """A field of the selected rows (dst_ip, process_name), in selection order, without repeats."""
+        values = []
+        for index in self.table_view.selectionModel().selectedRows():
+            value = self.table_model.record(self.proxy_model.mapToSource(index).row())[field]
+            if value not in values:
+                values.append(value)
+        return values
+
+    def selected_ips(self):
+        """Destination IPs of the selected rows, in selection order, without repeats."""
+        return self.selected_values("dst_ip")
+
+    def show_table_menu(self, position):
+        """Block/unblock menu for the selected rows; only offered while the firewall can be changed."""
+        if not self.firewall_toggle.isEnabled():
+            return
+        ips = self.selected_ips()
+        menu = QMenu(self)
+        kinds = [("destination", "destination", ips), ("asn", "ASN", ips), ("country", "country", ips)]
+        if self.process_blocking:
+            processes = [name for name in self.selected_values("process_name") if name != "Unknown"]
+            kinds.append(("process", "process", processes))
+        for kind, label, values in kinds:
+            plural = ("es" if kind == "process" else "s") if len(values) > 1 else ""
+            for block, verb in ((True, "Block"), (False, "Unblock")):
+                action = menu.addAction(f"{verb} selected {label}{plural}")
+                action.setEnabled(bool(values))
+                action.triggered.connect(
+                    lambda _, kind=kind, values=values, block=block: self.block_requested.emit(kind, values, block))
+        menu.addSeparator()
+        menu.addAction("Unblock all").triggered.connect(lambda _: self.block_requested.emit("all", [], False))
+        menu.exec_(self.table_view.viewport().mapToGlobal(position))
+
+    def add_or_update_connection(self, key, flow):
+        """Adds a new row or updates an existing one from a FlowRecord; the row is found by bisection."""
+        self.table_model.add_or_update(key, flow)
+
+    def update_connections(self, updates):
+        """Applies (key, FlowRecord) updates as one batch so the view repaints once."""
+        self.table_model.begin_batch()
+        try:
+            for key, flow in updates:
+                self.table_model.add_or_update(key, flow)
+        finally:
+            self.table_model.end_batch()
+
+    def remove_connections(self, keys):
+        """Drops rows for flows evicted from the flow table."""
+        self.table_model.remove_keys(keys)
+
+    def update_rates(self, rates):
+        """Applies (key, bits per second) pairs from the rate tracker as one table update."""
+        self.table_model.begin_batch()
+        try:
+            self.table_model.update_rates(rates)
+        finally:
+            self.table_model.end_batch()
+
+    def set_rate_series(self, series):
+        """Hands [(label, QColor, bps array)] to the rate chart, which repaints on its own frame timer."""
+        self.rate_chart.set_series(series)
 
     def update_resolved_info(self, ip, location, network, lat, lon):
         """Updates location and network for all rows with the matching IP."""
-        # This function now needs to iterate through all rows to find matching IPs
-        # as the key is no longer just IP.
-        for row in range(self.table_widget.rowCount()):
-            # Get the IP from the first column
-            ip_item = self.table_widget.item(row, 0)
-            if ip_item and ip_item.text() == ip:
-                location_item = QTableWidgetItem(location)
-                location_item.setData(Qt.UserRole, (lat, lon))
-                self.table_widget.setItem(row, 5, location_item) # Adjusted for new column
-                self.table_widget.setItem(row, 6, QTableWidgetItem(network)) # Adjusted for new column
-
-    def on_cell_clicked(self, row, column):
-        """Handle clicks on the table to pan the map."""
-        location_item = self.table_widget.item(row, 5) # Adjusted for new column
-        if location_item:
-            lat_lon = location_item.data(Qt.UserRole)
-            if lat_lon:
-                self.location_selected.emit(lat_lon[0], lat_lon[1])
-
-    def refresh_map(self):
-        self.web_view.reload()
+        self.table_model.update_resolved(ip, location, network, lat, lon)
+
+    def hide_domain_column(self):
+        """Used when reverse DNS is unavailable, so the column would only ever say N/A."""
+        self.table_view.setColumnHidden(COL_DOMAIN, True)
+
+    def update_domains(self, results):
+        """Applies a batch of (ip, domain or None) reverse DNS results."""
+        self.table_model.begin_batch()
+        try:
+            for ip, domain in results:
+                self.table_model.update_domain(ip, domain or "N/A")
+        finally:
+            self.table_model.end_batch()
+
+    def update_resolved_batch(self, results):
+        """Applies a list of resolver results as one table update."""
+        self.table_model.begin_batch()
+        try:
+            for resolved_data in results:
+                self.table_model.update_resolved(
+                    resolved_data["ip"],
+                    resolved_data["location_str"],
+                    resolved_data["network"],
+                    resolved_data.get("lat"),
+                    resolved_data.get("lon")
+                )
+        finally:
+            self.table_model.end_batch()
+
+    def on_cell_clicked(self, index):
+        """Handle clicks on the table to pan the map and chart the flow's rate."""
+        source_index = self.proxy_model.mapToSource(index)
+        self.selected_flow_key = self.table_model.record(source_index.row())["key"]
+        lat_lon = self.proxy_model.data(index, LAT_LON_ROLE)
+        if lat_lon and lat_lon[0] is not None and lat_lon[1] is not None:
+            self.location_selected.emit(lat_lon[0], lat_lon[1])
+
+    def load_map(self, map_path):
+        """Loads the map page once; later updates are pushed with queue_map_script()."""
+        if self.web_view is None:
+            from PyQt5.QtWebEngineWidgets import QWebEngineView # Needs Qt.AA_ShareOpenGLContexts, see Application
+            self.web_view = QWebEngineView()
+            self.web_view.loadFinished.connect(self._on_map_loaded)
+            self.splitter.replaceWidget(self.splitter.indexOf(self.map_placeholder), self.web_view)
+            self.map_placeholder.deleteLater()
+            self.map_placeholder = None
+        self._map_ready = False
+        self.web_view.setUrl(QUrl.fromLocalFile(os.path.abspath(map_path)))
+
+    def queue_map_script(self, script):
+        """Queues JavaScript for the map page; queued scripts are run together at a bounded rate."""
+        self._map_scripts.append(script)
+        if self._map_ready and not self._map_push_timer.isActive():
+            self._map_push_timer.start()
+
+    def _on_map_loaded(self, ok):
+        self._map_ready = ok
+        if ok and self._map_scripts:
+            self._push_map_scripts()
+
+    def _push_map_scripts(self):
+        if not self._map_ready or not self._map_scripts:
+            return
+        with MAP_PUSH.time():
+            script = "\n".join(self._map_scripts)
+            self._map_scripts = []
+            self.web_view.page().runJavaScript(script)
+
+    def pending_map_scripts(self):
+        return len(self._map_scripts)
+
+    def set_status_metrics(self, text):
+        self.metrics_label.setText(text)
+
+    def update_summary(self, rollups):
+        """Refreshes the summary panel from the flow engine's FlowRollups."""
+        self.summary_panel.refresh(rollups)
 
     def pan_map_to(self, lat, lon):
         """Executes JavaScript to pan the map view."""
-        if lat is not None and lon is not None:
+        if self._map_ready and lat is not None and lon is not None:
             self.web_view.page().runJavaScript(f"{self.map_name}.setView([{lat}, {lon}], 10);")
 
     def set_map_name(self, name):
         self.map_name = name
 
     def apply_filter(self):
-        filter_text = self.filter_input.text().strip()
-        if not filter_text:
-            self.reset_filters()
-            return
-
-        filter_parts = filter_text.split('=', 1)
-        if len(filter_parts) != 2:
-            self.reset_filters()
-            return
-
-        self._current_filter = {
-            "key": filter_parts[0].strip().lower(),
-            "value": filter_parts[1].strip().lower()
-        }
-
-        for row in range(self.table_widget.rowCount()):
-            # Retrieve the original data for the row to apply the filter
-            # This assumes you have a way to get the full row data, e.g., from a model
-            # For now, we'll re-evaluate based on visible items
-            self._apply_filter_to_row(row, None) # Pass None for data, as we'll read from table
-
-    def _apply_filter_to_row(self, row, data=None):
-        """Applies the current filter to a specific row."""
-        if not self._current_filter:
-            self.table_widget.setRowHidden(row, False)
+        """Compiles the filter text once; the proxy runs it on the flow records, and on new rows as they arrive."""
+        try:
+            flow_filter = compile_filter(self.filter_input.text())
+        except FilterError as error:
+            # Keep the filter that is showing; point at the mistake instead
+            self.filter_input.setToolTip(str(error))
+            self.filter_input.setStyleSheet("border: 1px solid #ff5555;")
+            self.statusBar().showMessage(f"Filter error: {error}", 5000)
             return
-
-        filter_key = self._current_filter["key"]
-        filter_value = self._current_filter["value"]
-
-        column_map = {
-            "ip": 0,
-            "port": 1,
-            "process": 2,
-            "interface": 3,
-            "location": 5,
-            "network": 6,
-        }
-
-        col_index = column_map.get(filter_key)
-        if col_index is None:
-            self.table_widget.setRowHidden(row, False)
-            return
-
-        item = self.table_widget.item(row, col_index)
-        if item and filter_value in item.text().lower():
-            self.table_widget.setRowHidden(row, False)
-        else:
-            self.table_widget.setRowHidden(row, True)
+        self.filter_input.setToolTip("")
+        self.filter_input.setStyleSheet("")
+        self.statusBar().clearMessage()
+        self._current_filter = flow_filter
+        self.proxy_model.set_flow_filter(flow_filter)
 
     def reset_filters(self):
         self.filter_input.clear()
+        self.filter_input.setToolTip("")
+        self.filter_input.setStyleSheet("")
         self._current_filter = None
-        for row in range(self.table_widget.rowCount()):
-            self.table_widget.setRowHidden(row, False)
+        self.proxy_model.clear_filter()
 
     def show_filter_help(self):
         help_message = """
-        Enter filters in the format: `field=value`
+        Enter a filter expression, e.g. `process=chrome AND volume>10MB`
 
-        Available fields:
+        Fields:
         - `ip`: Destination IP address
+        - `domain`: Domain name from reverse DNS
         - `port`: Destination Port
         - `process`: Process Name
         - `interface`: Network Interface (e.g., NordLynx, Ethernet)
+        - `volume`: Data volume in bytes
+        - `rate`: Current rate in bits/s
         - `location`: Geographical Location (City, Country)
         - `network`: Network Provider (ASN Organization)
 
-        Example: `process=chrome.exe` or `interface=NordLynx`
+        Operators:
+        - `=` contains, `==` equals, `!=` does not contain (text ignores case)
+        - `~` and `!~` regular expression match / no match; the expression runs
+          to the next space (quote it if it contains spaces)
+        - `<`, `<=`, `>`, `>=` numbers, with K/M/G or Ki/Mi/Gi suffixes
+        - `in`: CIDRs for ip, otherwise a comma list (ports also take ranges)
+        - `AND` (or just a space), `OR`, `NOT` and parentheses
+
+        A value without a field matches any text column.
+
+        Examples: `interface=NordLynx`, `ip in 104.16.0.0/12`,
+        `NOT interface=nordlynx AND rate>1Mbps`, `process~^(chrome|firefox)`,
+        `port in 80,443,8000-8999`
         """
         QMessageBox.information(self, "Filter Help", help_message)
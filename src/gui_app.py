@@ -0,0 +1,441 @@
+# src/gui_app.py
+
+import threading
+import time
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtCore import Qt, QCoreApplication, QTimer, pyqtSignal
+from PyQt5.QtGui import QColor
+from gui import MainWindow, MAP_PUSH_INTERVAL_MS, MAP_PUSH, DARK_STYLESHEET
+from sniffer import SnifferThread
+from capture_engine import default_interfaces, replay_report
+from history_store import HistoryStore
+from flow_engine import FlowEngine
+from rate_tracker import RateTracker, format_bps
+from metrics import REGISTRY, MetricsServer
+from firewall_manager import FirewallExecutor, create_backend
+from block_list import BlockList
+from process_cache import executable_paths
+from startup_profile import StartupProfile
+
+FLOW_EVICTION_INTERVAL_MS = 5000
+RATE_SAMPLE_INTERVAL_MS = 1000 # One throughput sample per second
+STATUS_REFRESH_INTERVAL_MS = 1000
+
+GUI_UPDATE = REGISTRY.histogram(
+    "conmon_gui_update_seconds", "Time the GUI thread spends applying each kind of update", ("handler",))
+BATCH_LATENCY = REGISTRY.histogram(
+    "conmon_flow_batch_latency_seconds", "Time from capturing the oldest packet of a batch to the table showing it")
+MAP_SCRIPT = REGISTRY.histogram(
+    "conmon_map_script_seconds", "Time to build the JavaScript for one map refresh", ("mode",))
+BATCHES_HANDLED = REGISTRY.counter("conmon_flow_batches_handled_total", "Flow batches applied by the GUI thread")
+BATCHES_PENDING = REGISTRY.gauge(
+    "conmon_flow_batches_pending", "Flow batches emitted by the sniffer but not yet applied (signal queue depth)")
+FLOWS_TRACKED = REGISTRY.gauge("conmon_flows", "Flows currently in the flow table")
+FLOWS_EVICTED = REGISTRY.counter("conmon_flows_evicted_total", "Flows evicted from the flow table")
+MAP_SCRIPTS_PENDING = REGISTRY.gauge("conmon_map_scripts_pending", "Map updates waiting to be pushed to the page")
+
+class Application(QApplication):
+    """The Qt front end: map, throughput chart, summary panel and connection table over the shared engines.
+
+    Startup is ordered for time to first packet: capture starts as soon as
+    the window exists, firewall rules are created by a worker thread,
+    and the resolvers and the map (folium, QtWebEngine) are set up from the
+    event loop once the window is showing traffic.
+    """
+
+    firewall_applied = pyqtSignal(bool, bool) # (block enabled, success) after each firewall backend call
+    map_built = pyqtSignal(object) # MapGenerator whose page was rendered on a background thread
+
+    def __init__(self, sys_argv, options, profile=None):
+        # Lets gui.MainWindow import QtWebEngine after the application exists, when the map is set up
+        QCoreApplication.setAttribute(Qt.AA_ShareOpenGLContexts)
+        super(Application, self).__init__(sys_argv)
+        self.options = options
+        self.profile = profile if profile is not None else StartupProfile()
+        # Apply the theme globally and definitively.
+        self.setStyleSheet(DARK_STYLESHEET)
+        self.profile.mark("qt application")
+
+        self.main_window = MainWindow()
+        self.main_window.location_selected.connect(self.main_window.pan_map_to)
+        self.main_window.firewall_toggle_changed.connect(self.handle_firewall_toggle)
+        self.main_window.block_requested.connect(self.handle_block_request)
+        self.main_window.firewall_toggle.setEnabled(False)
+        self.main_window.show()
+        self.profile.mark("main window")
+
+        self.rate_tracker = RateTracker()
+        self.batch_latencies = [] if self.options.replay is not None else None # Seconds from capture to table update
+
+        self.history_store = None
+        if self.options.history_db is not None:
+            self.history_store = HistoryStore(self.options.history_db)
+            self.history_store.start()
+        self.flow_engine = FlowEngine(self.options.max_flows, self.options.idle_timeout, resolve=self.resolve_ip,
+                                      forget=self.forget_flow, history_store=self.history_store)
+        self.connections = self.flow_engine.connections
+        self.ip_connections = self.flow_engine.ip_connections
+        self.resolver_thread = None # Started by _start_resolvers()
+        self.dns_resolver = None
+        self.dns_notifier = None
+        self._unresolved = [] # New destinations seen before the resolvers started
+        self.map_generator = None # Built by _setup_map()
+        self.geo_grid = None # Grid map modes only, like the two below
+        self.ip_cells = {} # dst_ip -> grid cell, once geolocated
+        self.map_layer_timer = None
+
+        # Determine interfaces to sniff
+        interfaces_to_sniff = []
+        if self.options.replay is None:
+            interfaces_to_sniff = default_interfaces() # The capture engine prints them as it starts
+        self.sniffer_thread = SnifferThread(
+            interfaces=interfaces_to_sniff,
+            backend=self.options.capture_backend,
+            flush_interval_ms=self.options.flush_interval,
+            replay_path=self.options.replay,
+            replay_speed=self.options.replay_speed,
+            processes=self.options.capture_processes,
+            ring_size=self.options.capture_ring_size,
+        )
+        self.sniffer_thread.flows_updated.connect(self.handle_flows)
+        self.sniffer_thread.replay_finished.connect(self.report_replay)
+        self.sniffer_thread.start()
+        self.capture_engine = self.sniffer_thread.engine
+        self.profile.mark("capture started")
+
+        # Replays are for testing and must not touch the host firewall, unless it is the fake one.
+        # The executor creates the rules in the background; toggles made meanwhile are applied after.
+        self.firewall = None
+        self.block_list = BlockList() # Destinations, ASNs, countries and processes blocked from the table menu
+        if self.options.replay is None or self.options.firewall_backend == 'fake':
+            self.firewall_applied.connect(self._on_firewall_applied)
+            self.firewall = FirewallExecutor(create_backend(self.options.firewall_backend),
+                                             on_complete=self.firewall_applied.emit)
+            self.firewall.start()
+            self.main_window.firewall_toggle.setEnabled(True)
+            self.main_window.process_blocking = self.firewall.backend.supports_programs
+
+        self.eviction_timer = QTimer(self)
+        self.eviction_timer.timeout.connect(self.evict_flows)
+        self.eviction_timer.start(FLOW_EVICTION_INTERVAL_MS)
+
+        self.rate_timer = QTimer(self)
+        self.rate_timer.timeout.connect(self.sample_rates)
+        self.rate_timer.start(RATE_SAMPLE_INTERVAL_MS)
+
+        self._last_status = (time.monotonic(), 0, 0) # (time, packets captured, packets parsed) at the last refresh
+        for collector in (self.capture_engine.collect_metrics, self._collect_metrics):
+            REGISTRY.add_collector(collector)
+        if self.history_store is not None:
+            REGISTRY.add_collector(self.history_store.collect_metrics)
+        self.metrics_server = None
+        if self.options.metrics_port:
+            self.metrics_server = MetricsServer(self.options.metrics_port)
+            self.metrics_server.start()
+        self.status_timer = QTimer(self)
+        self.status_timer.timeout.connect(self.refresh_status)
+        self.status_timer.start(STATUS_REFRESH_INTERVAL_MS)
+        self.profile.mark("timers and metrics")
+
+        # Runs once the event loop has painted the window and delivered the first batches
+        QTimer.singleShot(0, self._start_resolvers)
+
+    def _start_resolvers(self):
+        """Deferred startup, step 1: GeoIP/ASN and reverse DNS resolution."""
+        from resolver import ResolverThread, ReverseDnsNotifier
+        from dns_resolver import ReverseDnsResolver
+        self.resolver_thread = ResolverThread(
+            workers=self.options.resolver_workers,
+            batch_size=self.options.resolver_batch_size,
+            city_path=self.options.geoip_city,
+            asn_path=self.options.geoip_asn,
+        )
+        self.resolver_thread.resolved.connect(self.handle_resolved)
+        self.resolver_thread.resolved_batch.connect(self.handle_resolved_batch)
+        self.resolver_thread.start()
+
+        # Reverse DNS runs on its own asyncio loop, beside the GeoIP resolver
+        self.dns_notifier = ReverseDnsNotifier()
+        self.dns_notifier.domains_resolved.connect(self.handle_domains)
+        self.dns_resolver = ReverseDnsResolver(callback=self.dns_notifier.domains_resolved.emit)
+        if not self.dns_resolver.start():
+            self.main_window.hide_domain_column()
+        REGISTRY.add_collector(self.resolver_thread.collect_metrics)
+        REGISTRY.add_collector(self.dns_resolver.collect_metrics)
+
+        unresolved, self._unresolved = self._unresolved, []
+        for ip in unresolved:
+            if ip in self.ip_connections: # Not evicted meanwhile
+                self.resolve_ip(ip)
+        self.profile.mark("resolvers (deferred)")
+        # folium takes most of a second to import and render, so the page is built off the GUI thread
+        self.map_built.connect(self._setup_map)
+        threading.Thread(target=self._build_map, name="MapBuild", daemon=True).start()
+
+    def _build_map(self):
+        from map_generator import MapGenerator
+        map_generator = MapGenerator(mode=self.options.map_mode)
+        map_generator.save_map()
+        self.map_built.emit(map_generator)
+
+    def _setup_map(self, map_generator):
+        """Deferred startup, step 2: loads the rendered map page, then adds what was resolved so far."""
+        self.profile.mark("map page built (deferred)")
+        self.map_generator = map_generator
+        self.main_window.set_map_name(self.map_generator.map.get_name())
+        if self.options.map_mode != 'markers':
+            from geo_grid import GeoGrid
+            self.geo_grid = GeoGrid(cell_degrees=self.options.map_cell_size)
+            self.map_layer_timer = QTimer(self)
+            self.map_layer_timer.timeout.connect(self.push_map_layer)
+            self.map_layer_timer.start(MAP_PUSH_INTERVAL_MS)
+        self.main_window.load_map(self.map_generator.map_path)
+        self.profile.mark("map view created (deferred)")
+        self._add_to_map(list(self.flow_engine.ip_info.values()))
+        self.profile.milestone("startup complete")
+        self._report_startup()
+
+    def _on_firewall_applied(self, blocked, ok):
+        """A failed change puts the toggle back to the state the firewall is really in."""
+        if ok:
+            self.profile.milestone("firewall rules ready")
+            return
+        print("Firewall change failed; see the command output above")
+        # Without rules (setup failed) there is nothing left to toggle
+        self.main_window.set_firewall_state(blocked, enabled=self.firewall.installed)
+
+    def _report_startup(self):
+        """Prints the startup profile once the deferred setup is done and traffic has been shown."""
+        if self.profile.has("startup complete", "first table update"):
+            self.profile.report()
+
+    def handle_firewall_toggle(self, is_checked):
+        if self.firewall is not None:
+            self.firewall.set_block(is_checked) # Returns at once; the executor reports back
+
+    def handle_block_request(self, kind, values, block):
+        """Blocks or unblocks the selected destinations or processes, or the ASNs or countries of the destinations."""
+        if self.firewall is None:
+            return
+        if kind == "all":
+            changed = self.block_list.clear()
+        elif kind in ("destination", "process"):
+            changed = self.block_list.update(kind, values, block)
+        else:
+            field = "asn" if kind == "asn" else "country"
+            values = set()
+            for ip in values:
+                value = (self.flow_engine.ip_info.get(ip) or {}).get(field)
+                if value not in (None, "N/A", "Unknown", "Error"):
+                    values.add(value)
+            if not values:
+                print(f"No {field} known yet for the selected destinations")
+                return
+            changed = self.block_list.update(kind, values, block)
+        if changed:
+            self._apply_block_list()
+
+    def _apply_block_list(self):
+        networks = self.block_list.networks()
+        print(f"Blocking {self.block_list.summary()} as {len(networks)} networks")
+        self.firewall.set_blocked_networks(networks)
+        if self.firewall.backend.supports_programs:
+            # Resolved now: a process that is not running has no known executable
+            programs = []
+            if self.block_list.processes:
+                programs = executable_paths(self.block_list.processes)
+                print(f"Blocking processes {', '.join(sorted(self.block_list.processes))} as {len(programs)} programs")
+            self.firewall.set_blocked_programs(programs)
+
+    def resolve_ip(self, ip):
+        """Queues a new destination for GeoIP/ASN and reverse DNS resolution."""
+        if self.resolver_thread is None:
+            self._unresolved.append(ip)
+            return
+        self.resolver_thread.resolve(ip)
+        self.dns_resolver.resolve(ip)
+
+    def forget_flow(self, dst_ip, dst_port, interface):
+        self.capture_engine.forget(dst_ip, dst_port, interface)
+
+    @GUI_UPDATE.timed(handler="flows")
+    def handle_flows(self, batch):
+        """Applies one aggregated batch from the sniffer to the flow engine, the table, the rates and the map."""
+        updates = self.flow_engine.apply_batch(batch)
+        rate_keys = []
+        rate_groups = []
+        rate_bytes = []
+        for connection_key, record in updates:
+            rate_keys.append(connection_key)
+            rate_groups.append(("all", ("interface", record.interface), ("process", record.process_name)))
+            rate_bytes.append(batch["deltas"][connection_key]["bytes"])
+        self.main_window.update_connections(updates)
+        self.rate_tracker.add(rate_keys, rate_groups, rate_bytes)
+
+        if self.geo_grid is not None:
+            cells = []
+            volumes = []
+            for connection_key, delta in batch["deltas"].items():
+                cell = self.ip_cells.get(delta["dst_ip"])
+                if cell is not None:
+                    cells.append(cell)
+                    volumes.append(delta["bytes"])
+            self.geo_grid.add_bytes(cells, volumes)
+
+        if self.connections.over_capacity():
+            self.evict_flows()
+
+        latency = time.monotonic() - batch["captured_at"]
+        BATCH_LATENCY.observe(latency)
+        if "first table update" not in self.profile.milestones:
+            self.profile.milestone("first packet captured", batch["captured_at"])
+            self.profile.milestone("first table update")
+            self._report_startup()
+        if self.batch_latencies is not None:
+            self.batch_latencies.append(latency)
+
+    def report_replay(self, stats):
+        """Prints replay throughput and the capture-to-table latency of its batches."""
+        for line in replay_report(stats, self.batch_latencies):
+            print(line)
+
+    @GUI_UPDATE.timed(handler="evict")
+    def evict_flows(self):
+        """Drops idle flows (and the flows above --max-flows) from every per-flow structure."""
+        removed, emptied_ips = self.flow_engine.evict()
+        if not removed:
+            return
+        if self.geo_grid is not None:
+            emptied_cells = [self.ip_cells.pop(ip) for ip in emptied_ips if ip in self.ip_cells]
+            self.geo_grid.remove_destinations(emptied_cells)
+        removed_keys = [record.key for record in removed]
+        self.rate_tracker.release(removed_keys)
+        self.main_window.remove_connections(removed_keys)
+
+    @GUI_UPDATE.timed(handler="rates")
+    def sample_rates(self):
+        """Closes the current throughput sample, refreshes the rate column and feeds the chart."""
+        self.main_window.update_rates(self.rate_tracker.tick())
+        groups = self.rate_tracker.groups
+        series = [self._rate_series(groups, "all", "All traffic", QColor(220, 220, 220))]
+        for key in groups.keys():
+            if key != "all" and key[0] == "interface":
+                color = QColor(77, 255, 77) if key[1] == 'NordLynx' else QColor(255, 255, 0)
+                series.append(self._rate_series(groups, key, key[1], color))
+        selected = self.main_window.selected_flow_key
+        if selected is not None and selected in self.rate_tracker.flows:
+            series.append(self._rate_series(self.rate_tracker.flows, selected, selected, QColor(0, 200, 255)))
+        self.main_window.set_rate_series(series)
+
+    def _rate_series(self, rate_series, key, label, color):
+        current, ewma, p95 = self.rate_tracker.summary(rate_series, key)
+        text = f"{label}: {format_bps(current)} (avg {format_bps(ewma)}, p95 {format_bps(p95)})"
+        return (text, color, rate_series.series(key) * 8)
+
+    def handle_resolved(self, resolved_data):
+        self.handle_resolved_batch([resolved_data])
+
+    @GUI_UPDATE.timed(handler="resolved")
+    def handle_resolved_batch(self, results):
+        """Applies resolver results, pushing any new map markers to the page in one script."""
+        self.flow_engine.apply_resolved(results)
+        self.main_window.update_resolved_batch(results)
+        self._add_to_map(results)
+        if self.block_list.observe(results) and self.firewall is not None:
+            self._apply_block_list() # A blocked ASN or country showed a new address block
+
+    def _add_to_map(self, results):
+        if self.map_generator is None:
+            return # _setup_map() adds them from the flow engine
+        if self.geo_grid is not None:
+            self._add_to_grid(results)
+            return
+
+        new_markers = []
+        for resolved_data in results:
+            if resolved_data["lat"] is not None and resolved_data["lon"] is not None:
+                popup = f"{resolved_data['ip']}\n{resolved_data['network']}"
+                if self.map_generator.add_location(resolved_data["lat"], resolved_data["lon"]):
+                    new_markers.append((resolved_data["lat"], resolved_data["lon"], popup))
+
+        if new_markers:
+            with MAP_SCRIPT.time(mode="markers"):
+                script = self.map_generator.markers_script(new_markers)
+            self.main_window.queue_map_script(script)
+
+    @GUI_UPDATE.timed(handler="domains")
+    def handle_domains(self, results):
+        self.flow_engine.apply_domains(results)
+        self.main_window.update_domains(results)
+
+    def _collect_metrics(self):
+        BATCHES_HANDLED.set_total(self.flow_engine.batches_handled)
+        BATCHES_PENDING.set(max(self.capture_engine.batches_emitted - self.flow_engine.batches_handled, 0))
+        FLOWS_TRACKED.set(len(self.connections))
+        FLOWS_EVICTED.set_total(self.connections.evicted)
+        MAP_SCRIPTS_PENDING.set(self.main_window.pending_map_scripts())
+
+    def refresh_status(self):
+        """Summarizes the pipeline metrics in the status bar and refreshes the summary panel."""
+        self.main_window.update_summary(self.flow_engine.rollups)
+        REGISTRY.collect()
+        captured = sum(stats[0] for stats in list(self.capture_engine.interface_stats.values()))
+        parsed = sum(stats[1] for stats in list(self.capture_engine.interface_stats.values()))
+        dropped = self.capture_engine.dropped()
+        dropped = f", {dropped:,} dropped by full capture rings" if dropped else ""
+        now = time.monotonic()
+        last_time, last_captured, last_parsed = self._last_status
+        elapsed = max(now - last_time, 1e-3)
+        self._last_status = (now, captured, parsed)
+        ms = lambda histogram, **labels: histogram.quantile(0.95, **labels) * 1000
+        if self.resolver_thread is None:
+            resolvers = "Resolvers starting"
+        else:
+            from geo_resolver import RESOLVER_LATENCY
+            from dns_resolver import DNS_IN_FLIGHT
+            resolvers = (f"Resolver backlog {self.resolver_thread.backlog()} (p95 {ms(RESOLVER_LATENCY):.0f} ms)  |  "
+                         f"DNS in flight {DNS_IN_FLIGHT.value()}")
+        self.main_window.set_status_metrics(
+            f"Capture {(captured - last_captured) / elapsed:,.0f} pkt/s "
+            f"({(parsed - last_parsed) / elapsed:,.0f} parsed, {captured - parsed:,} unparsed total{dropped})  |  "
+            f"Batches pending {BATCHES_PENDING.value()}  |  Flows {len(self.connections):,}  |  "
+            f"{resolvers}  |  "
+            f"GUI p95 {ms(GUI_UPDATE, handler='flows'):.1f} ms  |  "
+            f"Map push p95 {ms(MAP_PUSH):.1f} ms  |  "
+            f"Latency p95 {ms(BATCH_LATENCY):.0f} ms")
+
+    def _add_to_grid(self, results):
+        """Places newly geolocated IPs in their grid cells, carrying the volume they already sent."""
+        located = [r for r in results
+                   if r["lat"] is not None and r["lon"] is not None
+                   and r["ip"] not in self.ip_cells and r["ip"] in self.ip_connections]
+        if not located:
+            return
+        cells = self.geo_grid.cell_indices([r["lat"] for r in located], [r["lon"] for r in located])
+        volumes = []
+        for resolved_data, cell in zip(located, cells.tolist()):
+            self.ip_cells[resolved_data["ip"]] = cell
+            keys = self.ip_connections[resolved_data["ip"]]
+            volumes.append(sum(self.connections.get(key).volume for key in keys))
+        self.geo_grid.add_destinations(cells, volumes)
+
+    def push_map_layer(self):
+        with MAP_SCRIPT.time(mode=self.map_generator.mode):
+            script = self.map_generator.grid_script(self.geo_grid)
+        if script:
+            self.main_window.queue_map_script(script)
+
+    def exec_(self):
+        exit_code = super(Application, self).exec_()
+        self.profile.report() # If it was not printed yet, e.g. no traffic was seen
+        self.sniffer_thread.stop()
+        if self.resolver_thread is not None:
+            self.resolver_thread.stop()
+            self.dns_resolver.stop()
+        if self.history_store is not None:
+            self.history_store.stop() # Drains what is still queued
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        if self.firewall is not None:
+            self.firewall.stop() # Disables the block and removes the rules
+        return exit_code
@@ -0,0 +1,342 @@
+# src/headless.py
+
+"""Headless front end: runs the capture, flow and resolver engines without Qt and streams JSON lines.
+
+Every --snapshot-interval seconds one line is written with the flows that
+changed since the previous snapshot (new traffic, or a resolver/DNS answer
+for their destination) and the keys of the flows evicted meanwhile:
+
+  {"type": "snapshot", "time": <unix time>, "flows": [...], "evicted": [...],
+   "stats": {"flows": ..., "batches": ..., "packets_captured": ..., "packets_dropped": ...,
+             "resolver_backlog": ..., "rollups": {...}}}
+
+"rollups" holds the totals of the tracked flows and since start, and the top
+groups by process, country, ASN, interface and VPN as [name, bytes, flows]
+(FlowRollups.summary()).
+
+A replay ends with a final snapshot and a {"type": "replay_finished", ...} line.
+"""
+
+import contextlib
+import json
+import os
+import queue
+import signal
+import socket
+import sys
+import threading
+import time
+from capture_engine import CaptureEngine, default_interfaces, replay_report
+from geo_resolver import GeoResolver
+from dns_resolver import ReverseDnsResolver
+from flow_engine import FlowEngine
+from history_store import HistoryStore
+from metrics import REGISTRY, MetricsServer
+from startup_profile import StartupProfile
+
+FLOW_EVICTION_INTERVAL = 5.0 # Seconds, as in the GUI
+MAX_CLIENT_BUFFER = 4 * 1024 * 1024 # Bytes a socket client may fall behind before it is dropped
+
+HEADLESS_BATCH_LATENCY = REGISTRY.histogram(
+    "conmon_headless_batch_latency_seconds", "Time from capturing the oldest packet of a batch to applying it")
+SNAPSHOT_WRITE = REGISTRY.histogram("conmon_snapshot_write_seconds", "Time to serialize and write one snapshot")
+SNAPSHOT_CLIENTS = REGISTRY.gauge("conmon_snapshot_clients", "Clients connected to the snapshot socket")
+
+class StreamOutput:
+    """Writes snapshot lines to stdout or a file."""
+
+    def __init__(self, stream, close_stream=False):
+        self.stream = stream
+        self.close_stream = close_stream
+
+    def start(self):
+        pass
+
+    def write(self, line):
+        self.stream.write(line + "\n")
+        self.stream.flush()
+
+    def close(self):
+        if self.close_stream:
+            self.stream.close()
+
+class SocketOutput:
+    """Serves snapshot lines to every client connected to a local Unix or TCP socket.
+
+    Writes never block the event loop: each client has an outgoing buffer,
+    and a client whose buffer grows past MAX_CLIENT_BUFFER is disconnected.
+    """
+
+    def __init__(self, family, address):
+        self.family = family
+        self.address = address
+        self._server = None
+        self._clients = {} # socket -> bytearray not yet sent
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        if self.family == socket.AF_UNIX and os.path.exists(self.address):
+            os.unlink(self.address) # Left over from an earlier run
+        self._server = socket.socket(self.family, socket.SOCK_STREAM)
+        if self.family == socket.AF_INET:
+            self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(self.address)
+        self._server.listen()
+        self._thread = threading.Thread(target=self._accept_loop, name="SnapshotServer", daemon=True)
+        self._thread.start()
+        print(f"Serving flow snapshots on {self._server.getsockname()}")
+
+    def _accept_loop(self):
+        while True:
+            try:
+                client, _ = self._server.accept()
+            except OSError:
+                return # Closed
+            client.setblocking(False)
+            with self._lock:
+                self._clients[client] = bytearray()
+            SNAPSHOT_CLIENTS.set(len(self._clients))
+
+    def write(self, line):
+        data = (line + "\n").encode("utf-8")
+        with self._lock:
+            for client, pending in list(self._clients.items()):
+                pending += data
+                try:
+                    sent = client.send(pending)
+                    del pending[:sent]
+                except BlockingIOError:
+                    pass
+                except OSError:
+                    self._drop(client)
+                    continue
+                if len(pending) > MAX_CLIENT_BUFFER:
+                    print("Dropping a snapshot client that is not keeping up")
+                    self._drop(client)
+            SNAPSHOT_CLIENTS.set(len(self._clients))
+
+    def _drop(self, client):
+        self._clients.pop(client, None)
+        client.close()
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+        with self._lock:
+            for client in list(self._clients):
+                self._drop(client)
+        if self.family == socket.AF_UNIX and os.path.exists(self.address):
+            os.unlink(self.address)
+
+def open_output(target, stdout):
+    """Maps --output to an output: '-' (stdout), 'unix:PATH', 'tcp:HOST:PORT', or a file path."""
+    if target == '-':
+        return StreamOutput(stdout)
+    if target.startswith('unix:'):
+        return SocketOutput(socket.AF_UNIX, target[len('unix:'):])
+    if target.startswith('tcp:'):
+        host, _, port = target[len('tcp:'):].rpartition(':')
+        return SocketOutput(socket.AF_INET, (host or '127.0.0.1', int(port)))
+    return StreamOutput(open(target, 'a', encoding='utf-8'), close_stream=True)
+
+class HeadlessMonitor:
+    """Owns the engines and applies their results on a single event-loop thread.
+
+    The engines deliver batches and results from their own threads into one
+    queue, so FlowEngine is only touched here, as it is only touched by the
+    GUI thread in the Qt front end.
+    """
+
+    def __init__(self, options, output, profile=None):
+        self.options = options
+        self.output = output
+        self.profile = profile if profile is not None else StartupProfile()
+        self.events = queue.Queue()
+        self.stopping = False
+        self._changed = set() # Connection keys to include in the next snapshot
+        self._evicted = []
+        self.batch_latencies = [] if options.replay is not None else None
+        self.replay_stats = None
+
+        self.history_store = None
+        if options.history_db is not None:
+            self.history_store = HistoryStore(options.history_db)
+        self.geo_resolver = GeoResolver(workers=options.resolver_workers, batch_size=options.resolver_batch_size,
+                                        city_path=options.geoip_city, asn_path=options.geoip_asn,
+                                        on_result=lambda result: self.events.put(("resolved", [result])),
+                                        on_batch=lambda results: self.events.put(("resolved", results)))
+        self.dns_resolver = ReverseDnsResolver(callback=lambda results: self.events.put(("domains", results)))
+        interfaces = default_interfaces() if options.replay is None else []
+        self.capture_engine = CaptureEngine(
+            interfaces=interfaces,
+            backend=options.capture_backend,
+            flush_interval_ms=options.flush_interval,
+            replay_path=options.replay,
+            replay_speed=options.replay_speed,
+            on_batch=lambda batch: self.events.put(("flows", batch)),
+            on_replay_finished=lambda stats: self.events.put(("replay_finished", stats)),
+            processes=options.capture_processes,
+            ring_size=options.capture_ring_size,
+        )
+        self.flow_engine = FlowEngine(options.max_flows, options.idle_timeout, resolve=self.resolve_ip,
+                                      forget=self.capture_engine.forget,
+                                      history_store=self.history_store)
+        self.metrics_server = MetricsServer(options.metrics_port) if options.metrics_port else None
+
+    def resolve_ip(self, ip):
+        self.geo_resolver.resolve(ip)
+        self.dns_resolver.resolve(ip)
+
+    def run(self):
+        """Runs until interrupted, or until a replay is exhausted; returns the exit code."""
+        self.output.start()
+        if self.history_store is not None:
+            self.history_store.start()
+            REGISTRY.add_collector(self.history_store.collect_metrics)
+        self.geo_resolver.start()
+        self.dns_resolver.start()
+        self.capture_engine.start()
+        for collector in (self.capture_engine.collect_metrics, self.geo_resolver.collect_metrics,
+                          self.dns_resolver.collect_metrics):
+            REGISTRY.add_collector(collector)
+        if self.metrics_server is not None:
+            self.metrics_server.start()
+        self.profile.mark("engines started")
+
+        now = time.monotonic()
+        next_snapshot = now + self.options.snapshot_interval
+        next_eviction = now + FLOW_EVICTION_INTERVAL
+        try:
+            while not self.stopping:
+                try:
+                    kind, payload = self.events.get(timeout=max(min(next_snapshot, next_eviction) - now, 0))
+                    self.handle_event(kind, payload)
+                except queue.Empty:
+                    pass
+                now = time.monotonic()
+                if now >= next_eviction:
+                    self.evict_flows()
+                    next_eviction = now + FLOW_EVICTION_INTERVAL
+                if now >= next_snapshot:
+                    self.write_snapshot()
+                    next_snapshot = now + self.options.snapshot_interval
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+        return 0
+
+    def handle_event(self, kind, payload):
+        if kind == "flows":
+            for connection_key, _ in self.flow_engine.apply_batch(payload):
+                self._changed.add(connection_key)
+            if self.flow_engine.connections.over_capacity():
+                self.evict_flows()
+            latency = time.monotonic() - payload["captured_at"]
+            HEADLESS_BATCH_LATENCY.observe(latency)
+            self.profile.milestone("first packet captured", payload["captured_at"])
+            if self.batch_latencies is not None:
+                self.batch_latencies.append(latency)
+        elif kind == "resolved":
+            for resolved_data in self.flow_engine.apply_resolved(payload):
+                self._changed.update(self.flow_engine.ip_connections[resolved_data["ip"]])
+        elif kind == "domains":
+            for ip, _ in self.flow_engine.apply_domains(payload):
+                self._changed.update(self.flow_engine.ip_connections[ip])
+        elif kind == "replay_finished":
+            self.replay_stats = payload
+            self.stopping = True
+
+    def evict_flows(self):
+        removed, _ = self.flow_engine.evict()
+        for record in removed:
+            self._changed.discard(record.key)
+            self._evicted.append(record.key)
+
+    def write_snapshot(self):
+        """Writes the flows that changed since the last snapshot; nothing if none did."""
+        if not self._changed and not self._evicted:
+            return
+        with SNAPSHOT_WRITE.time():
+            flows = []
+            for connection_key in self._changed:
+                record = self.flow_engine.connections.get(connection_key)
+                if record is not None:
+                    flows.append(self.flow_json(record))
+            snapshot = {
+                "type": "snapshot",
+                "time": time.time(),
+                "flows": flows,
+                "evicted": self._evicted,
+                "stats": self.stats(),
+            }
+            self._changed = set()
+            self._evicted = []
+            self.output.write(json.dumps(snapshot, separators=(',', ':')))
+        if flows:
+            self.profile.milestone("first snapshot written")
+            self.profile.report()
+
+    def flow_json(self, record):
+        info = self.flow_engine.ip_info.get(record.dst_ip) or {}
+        return {
+            "key": record.key,
+            "dst_ip": record.dst_ip,
+            "dst_port": record.dst_port,
+            "interface": record.interface,
+            "process": record.process_name,
+            "bytes": record.volume,
+            "packets": record.packets,
+            "domain": self.flow_engine.domains.get(record.dst_ip),
+            "location": info.get("location_str"),
+            "lat": info.get("lat"),
+            "lon": info.get("lon"),
+            "country": info.get("country"),
+            "network": info.get("network"),
+            "asn": info.get("asn"),
+        }
+
+    def stats(self):
+        interface_stats = list(self.capture_engine.interface_stats.values())
+        return {
+            "flows": len(self.flow_engine.connections),
+            "batches": self.flow_engine.batches_handled,
+            "packets_captured": sum(stats[0] for stats in interface_stats),
+            "packets_parsed": sum(stats[1] for stats in interface_stats),
+            "packets_dropped": self.capture_engine.dropped(),
+            "resolver_backlog": self.geo_resolver.backlog(),
+            "rollups": self.flow_engine.rollups.summary(),
+        }
+
+    def shutdown(self):
+        self.profile.report() # If no traffic was seen
+        self.capture_engine.stop()
+        # Apply whatever the engines delivered before they stopped, then write it out
+        while True:
+            try:
+                kind, payload = self.events.get_nowait()
+            except queue.Empty:
+                break
+            self.handle_event(kind, payload)
+        self.write_snapshot()
+        if self.replay_stats is not None:
+            self.output.write(json.dumps(dict(self.replay_stats, type="replay_finished")))
+            for line in replay_report(self.replay_stats, self.batch_latencies):
+                print(line)
+        self.geo_resolver.stop()
+        self.dns_resolver.stop()
+        if self.history_store is not None:
+            self.history_store.stop() # Drains what is still queued
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        self.output.close()
+
+def run_headless(options, profile=None):
+    """Entry point for --headless. Diagnostics go to stderr so stdout carries only snapshot lines."""
+    output = open_output(options.output, sys.stdout)
+    with contextlib.redirect_stdout(sys.stderr):
+        monitor = HeadlessMonitor(options, output, profile)
+        # SIGTERM (e.g. from a service manager) stops the loop like Ctrl+C does
+        signal.signal(signal.SIGTERM, lambda signum, frame: setattr(monitor, 'stopping', True))
+        return monitor.run()
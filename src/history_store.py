@@ -0,0 +1,234 @@
+# src/history_store.py
+
+import argparse
+import os
+import queue
+import sqlite3
+import threading
+import time
+from metrics import REGISTRY
+
+DEFAULT_HISTORY_PATH = 'conmon_history.db'
+
+# Dimensions kept in the rollup tables
+DIMENSIONS = ("process", "destination", "asn", "country")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS flow_deltas (
+    ts INTEGER NOT NULL,
+    process TEXT, dst_ip TEXT, dst_port INTEGER, interface TEXT,
+    asn TEXT, country TEXT,
+    bytes INTEGER NOT NULL, packets INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS flow_deltas_ts ON flow_deltas (ts);
+CREATE TABLE IF NOT EXISTS rollup_minute (
+    bucket INTEGER NOT NULL, dimension TEXT NOT NULL, value TEXT NOT NULL,
+    bytes INTEGER NOT NULL, packets INTEGER NOT NULL,
+    PRIMARY KEY (dimension, bucket, value)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollup_hour (
+    bucket INTEGER NOT NULL, dimension TEXT NOT NULL, value TEXT NOT NULL,
+    bytes INTEGER NOT NULL, packets INTEGER NOT NULL,
+    PRIMARY KEY (dimension, bucket, value)
+) WITHOUT ROWID;
+"""
+
+HISTORY_QUEUE = REGISTRY.gauge("conmon_history_queued_batches", "Flow batches waiting to be written to SQLite")
+HISTORY_ROWS = REGISTRY.counter("conmon_history_rows_written_total", "Flow delta rows written to SQLite")
+HISTORY_DROPPED = REGISTRY.counter(
+    "conmon_history_dropped_batches_total", "Flow batches dropped because the writer fell behind")
+HISTORY_WRITE = REGISTRY.histogram("conmon_history_write_seconds", "Duration of one history write transaction")
+
+class HistoryStore:
+    """Persists flow deltas to SQLite (WAL mode) with per-minute and per-hour rollups.
+
+    record_batch() only enqueues and never blocks the caller; a background
+    writer commits everything queued within flush_interval in one transaction
+    and updates the rollups in the same transaction, so top-talker queries
+    read a few pre-aggregated rows instead of scanning raw deltas. If the
+    writer falls behind and the queue fills, or a write fails, batches are
+    dropped and counted.
+    """
+
+    def __init__(self, path=DEFAULT_HISTORY_PATH, flush_interval=1.0, max_queue=1000,
+                 raw_retention_days=7, minute_retention_days=2, hour_retention_days=90):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.raw_retention = raw_retention_days * 86400
+        self.minute_retention = minute_retention_days * 86400
+        self.hour_retention = hour_retention_days * 86400
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._running = False
+        self._read_connection = None
+        self._read_lock = threading.Lock()
+
+        self.batches_written = 0
+        self.rows_written = 0
+        self.dropped_batches = 0
+
+    def start(self):
+        connection = self._connect()
+        connection.executescript(SCHEMA)
+        connection.close()
+        self._running = True
+        self._thread = threading.Thread(target=self._writer_loop, name="HistoryWriter", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self._read_connection:
+            self._read_connection.close()
+            self._read_connection = None
+
+    def record_batch(self, timestamp, rows):
+        """Queues flow deltas for writing.
+
+        rows is a list of (process, dst_ip, dst_port, interface, asn, country, bytes, packets).
+        """
+        if not rows:
+            return
+        try:
+            self._queue.put_nowait((int(timestamp), rows))
+        except queue.Full:
+            self.dropped_batches += 1
+
+    def top_talkers(self, dimension, since_seconds=86400, limit=10, now=None):
+        """Returns [(value, bytes, packets)] for the top values of a dimension over the last since_seconds.
+
+        Whole hours come from rollup_hour and the partial first hour from rollup_minute.
+        """
+        if dimension not in DIMENSIONS:
+            raise ValueError(f"Unknown dimension: {dimension}")
+        now = int(time.time() if now is None else now)
+        start = now - since_seconds
+        first_full_hour = -(-start // 3600) * 3600
+        query = """
+            SELECT value, SUM(bytes) AS total_bytes, SUM(packets) FROM (
+                SELECT value, bytes, packets FROM rollup_hour
+                    WHERE dimension = ? AND bucket >= ?
+                UNION ALL
+                SELECT value, bytes, packets FROM rollup_minute
+                    WHERE dimension = ? AND bucket >= ? AND bucket < ?
+            ) GROUP BY value ORDER BY total_bytes DESC LIMIT ?
+        """
+        with self._read_lock:
+            if self._read_connection is None:
+                self._read_connection = self._connect(check_same_thread=False)
+            return self._read_connection.execute(
+                query, (dimension, first_full_hour, dimension, start // 60 * 60, first_full_hour, limit)).fetchall()
+
+    def stats(self):
+        return {
+            "queued_batches": self._queue.qsize(),
+            "batches_written": self.batches_written,
+            "rows_written": self.rows_written,
+            "dropped_batches": self.dropped_batches,
+        }
+
+    def collect_metrics(self):
+        """Publishes the queue depth and write counters; registered by the application."""
+        HISTORY_QUEUE.set(self._queue.qsize())
+        HISTORY_ROWS.set_total(self.rows_written)
+        HISTORY_DROPPED.set_total(self.dropped_batches)
+
+    def _connect(self, check_same_thread=True):
+        connection = sqlite3.connect(self.path, timeout=10, check_same_thread=check_same_thread)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL") # Safe with WAL; a crash loses at most the last commit
+        return connection
+
+    def _writer_loop(self):
+        connection = self._connect()
+        last_prune = 0.0
+        try:
+            while self._running or not self._queue.empty():
+                try:
+                    batches = [self._queue.get(timeout=self.flush_interval)]
+                except queue.Empty:
+                    continue
+                # Take whatever else has accumulated so it goes into the same transaction
+                while True:
+                    try:
+                        batches.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                try:
+                    with HISTORY_WRITE.time():
+                        self._write(connection, batches)
+                except sqlite3.Error as e:
+                    # The transaction rolled back, so every batch in it is lost
+                    self.dropped_batches += len(batches)
+                    print(f"History store write failed, dropped {len(batches)} batches: {e}")
+                if time.monotonic() - last_prune > 3600:
+                    self._prune(connection)
+                    last_prune = time.monotonic()
+        finally:
+            connection.close()
+
+    def _write(self, connection, batches):
+        raw_rows = []
+        minute_rollups = {}
+        hour_rollups = {}
+        for timestamp, rows in batches:
+            minute = timestamp // 60 * 60
+            hour = timestamp // 3600 * 3600
+            for process, dst_ip, dst_port, interface, asn, country, length, packets in rows:
+                raw_rows.append((timestamp, process, dst_ip, dst_port, interface, asn, country, length, packets))
+                for dimension, value in (("process", process), ("destination", dst_ip),
+                                         ("asn", asn), ("country", country)):
+                    for rollups, bucket in ((minute_rollups, minute), (hour_rollups, hour)):
+                        totals = rollups.get((bucket, dimension, value))
+                        if totals is None:
+                            rollups[(bucket, dimension, value)] = [length, packets]
+                        else:
+                            totals[0] += length
+                            totals[1] += packets
+
+        upsert = """
+            INSERT INTO {table} (bucket, dimension, value, bytes, packets) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (dimension, bucket, value)
+            DO UPDATE SET bytes = bytes + excluded.bytes, packets = packets + excluded.packets
+        """
+        with connection:
+            connection.executemany("INSERT INTO flow_deltas VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", raw_rows)
+            for table, rollups in (("rollup_minute", minute_rollups), ("rollup_hour", hour_rollups)):
+                connection.executemany(upsert.format(table=table),
+                                       [(b, d, v, t[0], t[1]) for (b, d, v), t in rollups.items()])
+        self.batches_written += len(batches)
+        self.rows_written += len(raw_rows)
+
+    def _prune(self, connection):
+        now = int(time.time())
+        with connection:
+            connection.execute("DELETE FROM flow_deltas WHERE ts < ?", (now - self.raw_retention,))
+            connection.execute("DELETE FROM rollup_minute WHERE bucket < ?", (now - self.minute_retention,))
+            connection.execute("DELETE FROM rollup_hour WHERE bucket < ?", (now - self.hour_retention,))
+
+def main(argv=None):
+    """Prints the top talkers of an existing history database."""
+    parser = argparse.ArgumentParser(description="Show top talkers from a Conmon history database")
+    parser.add_argument('path', nargs='?', default=DEFAULT_HISTORY_PATH)
+    parser.add_argument('--dimension', choices=DIMENSIONS, default='process')
+    parser.add_argument('--hours', type=float, default=24)
+    parser.add_argument('--limit', type=int, default=10)
+    args = parser.parse_args(argv)
+    if not os.path.isfile(args.path):
+        # sqlite3.connect() would create an empty database there
+        parser.error(f"no history database at {args.path}")
+    store = HistoryStore(args.path)
+    try:
+        started = time.perf_counter()
+        talkers = store.top_talkers(args.dimension, int(args.hours * 3600), args.limit)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+    finally:
+        store.stop()
+    for value, total_bytes, packets in talkers:
+        print(f"{value:40} {total_bytes:>15,} bytes {packets:>10,} packets")
+    print(f"({elapsed_ms:.1f} ms)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+# src/ip_classify.py
+
+"""IP address classification shared by the capture, the resolvers and the firewall.
+
+Addresses are numbered as raw_capture numbers destinations: IPv6 addresses as
+their 128-bit value, IPv4 ones mapped into ::ffff:0:0/96. SPECIAL_NETWORKS
+(the IANA special-purpose registries) and the host's own subnets are
+flattened into a sorted table of non-overlapping intervals, the most specific
+network winning, so classifying an address is one bisect; classify_array()
+does a whole numpy array of IPv4 addresses with one searchsorted.
+
+Two questions are asked of a kind:
+  is_routable()  only PUBLIC addresses are worth a GeoIP/ASN lookup
+  is_captured()  kinds in UNCAPTURED stay on the host or its link; the capture
+                 filter and parse_headers(skip_private=True) drop them
+"""
+
+import ipaddress
+import socket
+import struct
+from bisect import bisect_right
+import psutil
+
+PUBLIC = "public"
+PRIVATE = "private" # RFC 1918, and IPv6 unique local addresses
+SHARED = "shared" # Carrier-grade NAT (RFC 6598)
+LOOPBACK = "loopback"
+LINK_LOCAL = "link-local"
+MULTICAST = "multicast"
+BROADCAST = "broadcast"
+UNSPECIFIED = "unspecified"
+RESERVED = "reserved"
+DOCUMENTATION = "documentation"
+BENCHMARK = "benchmark" # RFC 2544, also what the synthetic benchmark traffic is sent to
+LOCAL = "local" # A subnet of one of the host's interfaces
+KINDS = (PUBLIC, PRIVATE, SHARED, LOOPBACK, LINK_LOCAL, MULTICAST, BROADCAST, UNSPECIFIED, RESERVED,
+         DOCUMENTATION, BENCHMARK, LOCAL) # classify_array() returns indexes into this
+
+UNCAPTURED = frozenset((PRIVATE, LOOPBACK, LINK_LOCAL, MULTICAST, BROADCAST, UNSPECIFIED, RESERVED, LOCAL))
+
+SPECIAL_NETWORKS = tuple((ipaddress.ip_network(network), kind) for network, kind in (
+    ("0.0.0.0/8", RESERVED), ("0.0.0.0/32", UNSPECIFIED), ("10.0.0.0/8", PRIVATE), ("100.64.0.0/10", SHARED),
+    ("127.0.0.0/8", LOOPBACK), ("169.254.0.0/16", LINK_LOCAL), ("172.16.0.0/12", PRIVATE),
+    ("192.0.0.0/24", RESERVED), ("192.0.2.0/24", DOCUMENTATION), ("192.168.0.0/16", PRIVATE),
+    ("198.18.0.0/15", BENCHMARK), ("198.51.100.0/24", DOCUMENTATION), ("203.0.113.0/24", DOCUMENTATION),
+    ("224.0.0.0/4", MULTICAST), ("240.0.0.0/4", RESERVED), ("255.255.255.255/32", BROADCAST),
+    # IPv6; ::ffff:0:0/96 is left out, IPv4-mapped addresses are classified by the IPv4 ranges above
+    ("::/128", UNSPECIFIED), ("::1/128", LOOPBACK), ("64:ff9b:1::/48", RESERVED), ("100::/64", RESERVED),
+    ("2001:2::/48", BENCHMARK), ("2001:db8::/32", DOCUMENTATION), ("3fff::/20", DOCUMENTATION),
+    ("fc00::/7", PRIVATE), ("fe80::/10", LINK_LOCAL), ("ff00::/8", MULTICAST),
+))
+MIN_PREFIX = {4: 8, 6: 16} # Shorter interface netmasks are treated as misconfigured, not as a LAN
+
+IPV4_MAPPED = 0xFFFF << 32
+
+def collapse_networks(networks):
+    """collapse_addresses() over a mix of IPv4 and IPv6 networks (it accepts one version at a time)."""
+    networks = list(networks)
+    collapsed = []
+    for version in (4, 6):
+        collapsed.extend(ipaddress.collapse_addresses(n for n in networks if n.version == version))
+    return collapsed
+
+def local_networks():
+    """The subnets of the host's interface addresses (IPv4 and IPv6), collapsed."""
+    networks = []
+    for addrs in psutil.net_if_addrs().values():
+        for addr in addrs:
+            if addr.family not in (socket.AF_INET, socket.AF_INET6) or not addr.netmask:
+                continue
+            try:
+                address = ipaddress.ip_address(addr.address.split('%')[0]) # Drop an IPv6 scope (fe80::1%eth0)
+                # Windows and some BSDs report an IPv6 netmask as an address, which ip_network() rejects
+                prefix = bin(int(ipaddress.ip_address(addr.netmask))).count('1')
+            except ValueError:
+                continue
+            if prefix >= MIN_PREFIX[address.version]:
+                networks.append(ipaddress.ip_network(f'{address}/{prefix}', strict=False))
+    return collapse_networks(networks)
+
+def to_number(ip):
+    """The number of an IP string (IPv4 mapped into ::ffff:0:0/96); ValueError if it is not an address."""
+    try:
+        return IPV4_MAPPED | struct.unpack('!I', socket.inet_pton(socket.AF_INET, ip))[0]
+    except OSError:
+        pass
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), 'big')
+    except (OSError, TypeError):
+        raise ValueError(f"'{ip}' is not an IP address") from None
+
+def _range(network):
+    mapped = IPV4_MAPPED if network.version == 4 else 0
+    return mapped | int(network.network_address), mapped | int(network.broadcast_address)
+
+class AddressTable:
+    """SPECIAL_NETWORKS and a set of local subnets as sorted intervals of numbers.
+
+    starts/ends/kinds hold the non-public intervals, inclusive and
+    non-overlapping; every address between them is PUBLIC. The uncaptured
+    intervals are merged into a second, shorter table for the per-packet test.
+    """
+
+    def __init__(self, local=()):
+        self.local = tuple(local)
+        networks = list(SPECIAL_NETWORKS) + [(network, LOCAL) for network in self.local]
+        # Paint the least specific networks first; at equal length a local subnet wins
+        networks.sort(key=lambda item: (item[0].prefixlen + (96 if item[0].version == 4 else 0),
+                                        item[1] == LOCAL))
+        ranges = [(_range(network), kind) for network, kind in networks]
+        bounds = sorted({first for (first, _), _ in ranges} | {last + 1 for (_, last), _ in ranges})
+        self.starts, self.ends, self.kinds = [], [], []
+        for first, following in zip(bounds, bounds[1:]):
+            kind = PUBLIC
+            for (start, end), network_kind in ranges:
+                if start <= first <= end:
+                    kind = network_kind
+            if kind == PUBLIC:
+                continue
+            if self.kinds and self.kinds[-1] == kind and self.ends[-1] == first - 1:
+                self.ends[-1] = following - 1
+            else:
+                self.starts.append(first)
+                self.ends.append(following - 1)
+                self.kinds.append(kind)
+        self.uncaptured_starts, self.uncaptured_ends = [], []
+        for start, end, kind in zip(self.starts, self.ends, self.kinds):
+            if kind not in UNCAPTURED:
+                continue
+            if self.uncaptured_ends and self.uncaptured_ends[-1] == start - 1:
+                self.uncaptured_ends[-1] = end
+            else:
+                self.uncaptured_starts.append(start)
+                self.uncaptured_ends.append(end)
+        self._ipv4 = None # numpy copy of the IPv4 part, built by the first classify_array()
+
+    def classify(self, value):
+        """The kind of an address number."""
+        index = bisect_right(self.starts, value) - 1
+        if index >= 0 and value <= self.ends[index]:
+            return self.kinds[index]
+        return PUBLIC
+
+    def is_captured(self, value):
+        """False for an address number in an UNCAPTURED kind."""
+        index = bisect_right(self.uncaptured_starts, value) - 1
+        return index < 0 or value > self.uncaptured_ends[index]
+
+    def networks(self, kinds):
+        """The addresses of the given kinds as a collapsed list of ip_networks."""
+        networks = []
+        for start, end, kind in zip(self.starts, self.ends, self.kinds):
+            if kind in kinds:
+                if start >> 32 == 0xFFFF:
+                    first, last = ipaddress.IPv4Address(start & 0xFFFFFFFF), ipaddress.IPv4Address(end & 0xFFFFFFFF)
+                else:
+                    first, last = ipaddress.IPv6Address(start), ipaddress.IPv6Address(end)
+                networks.extend(ipaddress.summarize_address_range(first, last))
+        return collapse_networks(networks)
+
+    def classify_array(self, addresses):
+        """Indexes into KINDS for a numpy array of IPv4 addresses (as integers, e.g. uint32)."""
+        import numpy as np # Only the batch API needs it
+
+        if self._ipv4 is None:
+            rows = [(start & 0xFFFFFFFF, end & 0xFFFFFFFF, KINDS.index(kind))
+                    for start, end, kind in zip(self.starts, self.ends, self.kinds) if start >> 32 == 0xFFFF]
+            self._ipv4 = (np.array([row[0] for row in rows], dtype=np.uint32),
+                          np.array([row[1] for row in rows], dtype=np.uint32),
+                          np.array([row[2] for row in rows], dtype=np.uint8))
+        starts, ends, codes = self._ipv4
+        addresses = np.asarray(addresses, dtype=np.uint32)
+        index = np.searchsorted(starts, addresses, side='right') - 1
+        inside = (index >= 0) & (addresses <= ends[index]) # index -1 reads the last row, masked out by index >= 0
+        return np.where(inside, codes[index], 0).astype(np.uint8)
+
+_shared = {"table": AddressTable()} # Swapped whole by set_local_networks(), never changed in place
+
+def table():
+    """The current table: SPECIAL_NETWORKS plus the local subnets last passed to set_local_networks()."""
+    return _shared["table"]
+
+def set_local_networks(networks):
+    """Replaces the local subnets of the shared table; returns the (possibly new) table.
+
+    Callers on other threads keep using the table they read, so the swap needs no lock.
+    """
+    networks = tuple(collapse_networks(networks))
+    if networks != _shared["table"].local:
+        _shared["table"] = AddressTable(networks)
+    return _shared["table"]
+
+def classify(value):
+    """The kind of an address number (see to_number)."""
+    return _shared["table"].classify(value)
+
+def classify_ip(ip):
+    """The kind of an IP string; ValueError if it is not an address."""
+    return _shared["table"].classify(to_number(ip))
+
+def is_routable(ip):
+    """True for a public IP string, the only ones the GeoIP and ASN databases can say anything about."""
+    try:
+        return _shared["table"].classify(to_number(ip)) == PUBLIC
+    except ValueError:
+        return False
+
+def is_captured(value):
+    """False for an address number the capture drops (an UNCAPTURED kind); the per-packet test."""
+    current = _shared["table"]
+    index = bisect_right(current.uncaptured_starts, value) - 1
+    return index < 0 or value > current.uncaptured_ends[index]
+
+def classify_array(addresses):
+    """Indexes into KINDS for a numpy array of IPv4 addresses; KINDS[code] is the kind."""
+    return _shared["table"].classify_array(addresses)
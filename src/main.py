@@ -1,175 +1,81 @@
+import time
+STARTED = time.monotonic() # Before any other import, so --startup-profile includes them
 import sys
-from PyQt5.QtWidgets import QApplication
-from gui import MainWindow
-from sniffer import SnifferThread
-from resolver import ResolverThread
-from map_generator import MapGenerator
-from firewall_manager import FirewallManager
-import psutil
-import socket
-
-def get_lan_interface():
-    """Attempts to find the primary non-loopback, non-VPN LAN interface, prioritizing 'Ethernet'."""
-    addresses = psutil.net_if_addrs()
-    stats = psutil.net_if_stats()
-    
-    potential_interfaces = []
-    ethernet_interface = None
-
-    for iface_name, iface_addrs in addresses.items():
-        print(f"Considering interface: {iface_name}")
-        if iface_name == 'NordLynx':  # Skip the VPN interface
-            print(f"  Skipping {iface_name}: VPN interface.")
-            continue
-
-        if iface_name not in stats or not stats[iface_name].isup:
-            print(f"  Skipping {iface_name}: Not up or no stats.")
-            continue  # Skip inactive interfaces
-
-        has_ipv4 = False
-        for snicaddr in iface_addrs:
-            if snicaddr.family == socket.AF_INET:  # Look for IPv4 addresses
-                has_ipv4 = True
-                # Exclude loopback and APIPA addresses
-                if not snicaddr.address.startswith(('127.', '169.254.')):
-                    print(f"  Found potential LAN IPv4 for {iface_name}: {snicaddr.address}")
-                    if iface_name == 'Ethernet':
-                        ethernet_interface = iface_name
-                    else:
-                        potential_interfaces.append(iface_name)
-                    break # Found a valid IPv4, move to next interface
-        
-        if not has_ipv4:
-            print(f"  Skipping {iface_name}: No IPv4 address.")
-
-    if ethernet_interface:
-        print(f"Selected LAN interface: {ethernet_interface} (Prioritized Ethernet)")
-        return ethernet_interface
-    elif potential_interfaces:
-        print(f"Selected LAN interface: {potential_interfaces[0]} (First available)")
-        return potential_interfaces[0]
-    
-    print("No suitable LAN interface found.")
-    return None
-
-# Authoritative Dark Theme Stylesheet
-DARK_STYLESHEET = """
-QWidget {
-    background-color: #1e1e1e;
-    color: #4dff4d;
-    font-family: 'Segoe UI', Arial, sans-serif;
-    font-size: 10pt;
-}
-QHeaderView::section {
-    background-color: #333333;
-    color: #4dff4d;
-    padding: 4px;
-    border: 1px solid #555555;
-}
-QTableWidget {
-    gridline-color: #555555;
-    border: 1px solid #555555;
-}
-QTableWidget::item {
-    border-bottom: 1px solid #555555;
-}
-QScrollBar:vertical, QScrollBar:horizontal {
-    background: #333333;
-    border: 1px solid #555555;
-    width: 15px;
-    height: 15px;
-    margin: 0px 0px 0px 0px;
-}
-QScrollBar::handle:vertical, QScrollBar::handle:horizontal {
-    background: #555555;
-    min-height: 20px;
-    min-width: 20px;
-}
-QSplitter::handle {
-    background-color: #555555;
-}
-"""
-
-class Application(QApplication):
-    def __init__(self, sys_argv):
-        super(Application, self).__init__(sys_argv)
-        # Apply the theme globally and definitively.
-        self.setStyleSheet(DARK_STYLESHEET)
-
-        self.firewall_manager = FirewallManager()
-
-        self.main_window = MainWindow()
-        self.main_window.location_selected.connect(self.main_window.pan_map_to)
-        self.main_window.firewall_toggle_changed.connect(self.handle_firewall_toggle)
-        self.main_window.show()
-
-        self.map_generator = MapGenerator()
-        self.map_generator.save_map()
-        self.main_window.set_map_name(self.map_generator.map.get_name())
-
-        self.resolver_thread = ResolverThread()
-        self.resolver_thread.resolved.connect(self.handle_resolved)
-        self.resolver_thread.start()
-
-        # Determine interfaces to sniff
-        interfaces_to_sniff = ['NordLynx']
-        lan_iface = get_lan_interface()
-        if lan_iface and lan_iface not in interfaces_to_sniff:
-            interfaces_to_sniff.append(lan_iface)
-        print(f"Interfaces to sniff: {interfaces_to_sniff}") # Debug print
-        self.sniffer_thread = SnifferThread(interfaces=interfaces_to_sniff)
-        self.sniffer_thread.packet_captured.connect(self.handle_packet)
-        self.sniffer_thread.start()
-
-        self.connections = {}
-
-    def handle_firewall_toggle(self, is_checked):
-        if is_checked:
-            self.firewall_manager.enable_block()
-        else:
-            self.firewall_manager.disable_block()
-
-    def handle_packet(self, packet_data):
-        connection_key = f"{packet_data['dst_ip']}:{packet_data['dst_port']}:{packet_data['interface']}"
-
-        if connection_key not in self.connections:
-            self.connections[connection_key] = {
-                "dst_ip": packet_data['dst_ip'],
-                "dst_port": packet_data['dst_port'],
-                "volume": 0,
-                "process_name": packet_data["process_name"],
-                "interface": packet_data["interface"],
-            }
-            self.resolver_thread.resolve(packet_data['dst_ip'])
-        
-        self.connections[connection_key]["volume"] += packet_data["length"]
-        if packet_data["process_name"] != "Unknown":
-            self.connections[connection_key]["process_name"] = packet_data["process_name"]
-
-        self.main_window.add_or_update_connection(connection_key, self.connections[connection_key])
-
-    def handle_resolved(self, resolved_data):
-        if resolved_data["lat"] is not None and resolved_data["lon"] is not None:
-            popup = f"{resolved_data['ip']}\n{resolved_data['network']}"
-            self.map_generator.add_location(resolved_data["lat"], resolved_data["lon"], popup)
-            self.map_generator.save_map()
-            self.main_window.refresh_map()
-
-        self.main_window.update_resolved_info(
-            resolved_data["ip"],
-            resolved_data["location_str"],
-            resolved_data["network"],
-            resolved_data.get("lat"),
-            resolved_data.get("lon")
-        )
-
-    def exec_(self):
-        exit_code = super(Application, self).exec_()
-        self.sniffer_thread.stop()
-        self.resolver_thread.stop()
-        self.firewall_manager.cleanup()
-        return exit_code
+import argparse
+from capture_engine import CAPTURE_BACKENDS
+from capture_ring import DEFAULT_RING_SIZE
+from map_generator import MAP_MODES
+from history_store import DEFAULT_HISTORY_PATH
+from firewall_manager import FIREWALL_BACKENDS, default_backend
+from geoip_lookup import DB_CITY_PATH, DB_ASN_PATH
+from startup_profile import StartupProfile
+
+def parse_args(argv):
+    """Parses Conmon's own options, leaving the rest of argv for Qt."""
+    parser = argparse.ArgumentParser(description="Conmon - Host Outbound Network Traffic Monitor")
+    parser.add_argument('--capture-backend', choices=CAPTURE_BACKENDS, default='pyshark',
+                        help="'raw' parses packet headers directly instead of dissecting with tshark")
+    parser.add_argument('--capture-processes', action='store_true',
+                        help="Capture each interface (or the replayed file) in its own worker process, "
+                             "passing packets through a shared-memory ring buffer, so capture can use several cores")
+    parser.add_argument('--capture-ring-size', type=int, default=DEFAULT_RING_SIZE, metavar='N',
+                        help=f"Packets each capture process can buffer before dropping (default: {DEFAULT_RING_SIZE})")
+    parser.add_argument('--flush-interval', type=int, default=200, metavar='MS',
+                        help="How often the sniffer delivers aggregated flow updates (default: 200 ms)")
+    parser.add_argument('--resolver-workers', type=int, default=1, metavar='N',
+                        help="Resolve GeoIP/ASN lookups in batches across N worker processes (default: 1)")
+    parser.add_argument('--resolver-batch-size', type=int, default=64, metavar='N',
+                        help="Maximum IPs handed to the resolver workers at once (default: 64)")
+    parser.add_argument('--geoip-city', default=DB_CITY_PATH, metavar='PATH',
+                        help=f"GeoLite2 City database, reloaded when the file changes (default: {DB_CITY_PATH})")
+    parser.add_argument('--geoip-asn', default=DB_ASN_PATH, metavar='PATH',
+                        help=f"GeoLite2 ASN database, reloaded when the file changes (default: {DB_ASN_PATH})")
+    parser.add_argument('--map-mode', choices=MAP_MODES, default='markers',
+                        help="'clusters' or 'heatmap' bin destinations into a grid weighted by bytes sent")
+    parser.add_argument('--map-cell-size', type=float, default=1.0, metavar='DEGREES',
+                        help="Grid cell size for the clusters/heatmap modes (default: 1.0)")
+    parser.add_argument('--history-db', metavar='PATH',
+                        help=f"SQLite file for persistent flow history (default: {DEFAULT_HISTORY_PATH}; "
+                             "replays only record history when this is given)")
+    parser.add_argument('--no-history', action='store_true', help="Do not record flow history")
+    parser.add_argument('--max-flows', type=int, default=50000, metavar='N',
+                        help="Maximum flows kept in memory and in the table (default: 50000)")
+    parser.add_argument('--idle-timeout', type=float, default=300, metavar='SECONDS',
+                        help="Evict flows with no traffic for this long (default: 300)")
+    parser.add_argument('--metrics-port', type=int, default=0, metavar='PORT',
+                        help="Serve Prometheus metrics on http://127.0.0.1:PORT/metrics (default: off)")
+    parser.add_argument('--replay', metavar='FILE',
+                        help="Replay a .pcap/.pcapng file instead of capturing live (no privileges needed)")
+    parser.add_argument('--replay-speed', type=float, default=0.0, metavar='FACTOR',
+                        help="0 replays as fast as possible (default), 1 at the original timing, 2 twice as fast")
+    parser.add_argument('--headless', action='store_true',
+                        help="Run without the GUI and stream flow snapshots as JSON lines (no Qt needed)")
+    parser.add_argument('--output', default='-', metavar='TARGET',
+                        help="Headless snapshot destination: '-' for stdout (default), a file path, "
+                             "'unix:PATH' or 'tcp:HOST:PORT' to serve connecting clients")
+    parser.add_argument('--snapshot-interval', type=float, default=1.0, metavar='SECONDS',
+                        help="Headless: how often changed flows are written out (default: 1.0)")
+    parser.add_argument('--firewall-backend', choices=FIREWALL_BACKENDS, default=default_backend(),
+                        help="How the Block Internet toggle is applied (default: netsh on Windows, else nftables; "
+                             "'fake' only logs, and is the one backend allowed during --replay)")
+    parser.add_argument('--startup-profile', action='store_true',
+                        help="Print how long each startup phase took and when the first packet was shown")
+    options, qt_args = parser.parse_known_args(argv[1:])
+    # None records no history: replayed traffic must not mix with the host's unless asked for
+    if options.no_history:
+        options.history_db = None
+    elif options.history_db is None and options.replay is None:
+        options.history_db = DEFAULT_HISTORY_PATH
+    return options, qt_args
 
 if __name__ == '__main__':
-    app = Application(sys.argv)
-    sys.exit(app.exec_())
\ No newline at end of file
+    options, qt_args = parse_args(sys.argv)
+    profile = StartupProfile(STARTED, enabled=options.startup_profile)
+    if options.headless:
+        from headless import run_headless # Never imports Qt
+        profile.mark("imports")
+        sys.exit(run_headless(options, profile))
+    from gui_app import Application
+    profile.mark("imports")
+    app = Application(sys.argv[:1] + qt_args, options, profile)
+    sys.exit(app.exec_())
@@ -1,20 +1,80 @@
 # src/map_generator.py
 
-import folium
+import json
+import numpy as np
+
+MAP_MODES = ('markers', 'clusters', 'heatmap')
 
 class MapGenerator:
-    def __init__(self, map_path='map.html'):
+    """Renders the base map page once; markers found afterwards are pushed to the loaded page as JavaScript.
+
+    In 'markers' mode each unique location gets a marker. The 'clusters' and
+    'heatmap' modes draw a GeoGrid instead: one circle, or one heat point, per
+    occupied grid cell, sized by the bytes sent there.
+    """
+
+    def __init__(self, map_path='map.html', mode='markers'):
+        if mode not in MAP_MODES:
+            raise ValueError(f"Unknown map mode: {mode}")
+        import folium # Half a second to import, so only once a map is actually built
+        import folium.plugins
         self.map_path = map_path
+        self.mode = mode
         self.locations = set() # Use a set to avoid duplicate markers
         self.map = folium.Map(location=[20, 0], zoom_start=2, tiles='CartoDB dark_matter')
+        # Expose the Leaflet map under a stable global name for the JavaScript we push later.
+        # Added once here; adding it on every save made map.html grow with each write.
+        self.map.get_root().html.add_child(folium.Element(f"<script>var {self.map.get_name()} = {self.map.get_name()};</script>"))
+        if mode == 'heatmap':
+            for _, url in folium.plugins.HeatMap.default_js:
+                self.map.get_root().header.add_child(folium.JavascriptLink(url))
+        self._html = None # Rendered base page; folium appends duplicate scripts on every render
 
-    def add_location(self, lat, lon, popup_text):
-        """Adds a marker to the map if it doesn't already exist."""
-        if (lat, lon) not in self.locations:
-            folium.Marker([lat, lon], popup=popup_text).add_to(self.map)
-            self.locations.add((lat, lon))
+    def add_location(self, lat, lon):
+        """Records a marker location; returns True if it was not on the map yet."""
+        if (lat, lon) in self.locations:
+            return False
+        self.locations.add((lat, lon))
+        return True
+
+    def markers_script(self, markers):
+        """Builds one JavaScript statement that adds a batch of (lat, lon, popup_text) markers."""
+        points = json.dumps([[lat, lon, popup] for lat, lon, popup in markers])
+        return (f"(function(m){{for (const p of {points}) {{"
+                f"L.marker([p[0], p[1]]).bindPopup(p[2]).addTo(m);}}}})({self.map.get_name()});")
+
+    def grid_script(self, grid):
+        """Builds JavaScript that brings the grid layer up to date, or None if nothing changed."""
+        if not grid.has_changes():
+            return None
+        if self.mode == 'heatmap':
+            # Leaflet.heat can only replace its points, so send every occupied cell
+            grid.take_changes()
+            _, lats, lons, volumes, _ = grid.occupied()
+            intensity = np.log1p(volumes) / max(np.log1p(volumes.max()), 1.0)
+            points = np.column_stack((lats, lons, np.round(intensity, 3))).tolist()
+            return (f"(function(m){{window.conmonHeat = window.conmonHeat || "
+                    f"L.heatLayer([], {{radius: 20, blur: 15, maxZoom: 6}}).addTo(m);"
+                    f"conmonHeat.setLatLngs({json.dumps(points)});}})({self.map.get_name()});")
+
+        # Clusters: create, resize or remove only the circles of cells that changed
+        cells, lats, lons, volumes, destinations = grid.take_changes()
+        radii = np.clip(4.0 + 3.0 * np.log10(1.0 + volumes / 1024.0), 4.0, 40.0)
+        radii[destinations == 0] = 0 # Every destination in the cell was evicted
+        bins = [
+            [int(cell), lat, lon, round(radius, 1), f"{count} destinations<br>{int(volume):,} bytes"]
+            for cell, lat, lon, radius, count, volume
+            in zip(cells.tolist(), lats.tolist(), lons.tolist(), radii.tolist(), destinations.tolist(), volumes.tolist())
+        ]
+        return (f"(function(m){{window.conmonBins = window.conmonBins || {{}};"
+                f"for (const b of {json.dumps(bins)}) {{let c = conmonBins[b[0]];"
+                f"if (b[3] === 0) {{if (c) {{m.removeLayer(c); delete conmonBins[b[0]];}} continue;}}"
+                f"if (!c) {{c = L.circleMarker([b[1], b[2]], {{color: '#4dff4d', weight: 1, fillOpacity: 0.4}}).addTo(m);"
+                f"conmonBins[b[0]] = c;}} c.setRadius(b[3]); c.bindPopup(b[4]);}}}})({self.map.get_name()});")
 
     def save_map(self):
-        """Saves the map to an HTML file."""
-        self.map.get_root().html.add_child(folium.Element(f"<script>var {self.map.get_name()} = {self.map.get_name()};</script>"))
-        self.map.save(self.map_path)
+        """Saves the base map to an HTML file; only needed once at startup."""
+        if self._html is None:
+            self._html = self.map.get_root().render()
+        with open(self.map_path, 'w', encoding='utf-8') as f:
+            f.write(self._html)
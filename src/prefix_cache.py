@@ -0,0 +1,93 @@
+# src/prefix_cache.py
+
+import ipaddress
+import threading
+from collections import OrderedDict
+
+class PrefixCache:
+    """LRU cache of lookup results keyed by network prefix instead of by single IP.
+
+    GeoIP responses report the network the answer applies to, so one entry
+    answers every address in the same block (e.g. a CDN /20). Lookups try each
+    prefix length currently in the cache, longest first, using integer shifts.
+    """
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._entries = OrderedDict() # (version, prefixlen, network bits) -> (network, value)
+        self._prefix_lengths = {4: {}, 6: {}} # version -> {prefixlen: entry count}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, ip):
+        """Returns the cached value for the most specific network containing ip, or None."""
+        address = ipaddress.ip_address(ip)
+        value = int(address)
+        max_bits = address.max_prefixlen
+        with self._lock:
+            lengths = self._prefix_lengths[address.version]
+            for prefixlen in sorted(lengths, reverse=True):
+                key = (address.version, prefixlen, value >> (max_bits - prefixlen))
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, network, value):
+        """Caches value for every address in network (an ip_network or CIDR string)."""
+        network = ipaddress.ip_network(network, strict=False)
+        key = (network.version, network.prefixlen,
+               int(network.network_address) >> (network.max_prefixlen - network.prefixlen))
+        with self._lock:
+            if key not in self._entries:
+                lengths = self._prefix_lengths[network.version]
+                lengths[network.prefixlen] = lengths.get(network.prefixlen, 0) + 1
+            self._entries[key] = (network, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._evict_oldest()
+
+    def items(self):
+        """A snapshot of the cached (network, value) pairs, least recently used first."""
+        with self._lock:
+            return list(self._entries.values())
+
+    def discard(self, networks):
+        """Drops the entries of the given networks, if cached; returns how many were dropped."""
+        dropped = 0
+        with self._lock:
+            for network in networks:
+                key = (network.version, network.prefixlen,
+                       int(network.network_address) >> (network.max_prefixlen - network.prefixlen))
+                if self._entries.pop(key, None) is not None:
+                    self._forget_prefix(network.version, network.prefixlen)
+                    dropped += 1
+        return dropped
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._prefix_lengths = {4: {}, 6: {}}
+
+    def stats(self):
+        return {"entries": len(self._entries), "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
+
+    def _evict_oldest(self):
+        (version, prefixlen, _), _ = self._entries.popitem(last=False)
+        self._forget_prefix(version, prefixlen)
+        self.evictions += 1
+
+    def _forget_prefix(self, version, prefixlen):
+        lengths = self._prefix_lengths[version]
+        lengths[prefixlen] -= 1
+        if not lengths[prefixlen]:
+            del lengths[prefixlen]
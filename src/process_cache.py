@@ -0,0 +1,192 @@
+# src/process_cache.py
+
+import threading
+import time
+import psutil
+
+class ProcessCache:
+    """Maps local ports to (pid, process name) without scanning the socket table per packet."""
+
+    def __init__(self, refresh_interval=2.0, min_lookup_interval=0.25, max_flows=65536):
+        self.refresh_interval = refresh_interval # Seconds between background refreshes
+        self.min_lookup_interval = min_lookup_interval # Minimum spacing of on-demand scans
+        self.max_flows = max_flows
+        self._port_index = {} # local port -> (pid, process name)
+        self._pid_names = {} # pid -> process name, so a Process is only built once per pid
+        self._flows = {} # flow key (dst_ip, src_port, dst_port) -> (pid, process name) once known
+        self._port_flows = {} # local port -> memoized flow keys from it
+        self._destination_flows = {} # (dst_ip, dst_port) -> memoized flow keys to it
+        self._flows_lock = threading.Lock() # Guards the memo and its two indexes; lookups read it without
+        self._scan_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._last_scan = 0.0
+
+        # Counters to verify that the cache is doing its job
+        self.flow_hits = 0
+        self.port_hits = 0
+        self.misses = 0
+        self.on_demand_scans = 0
+        self.throttled_lookups = 0
+        self.background_scans = 0
+
+    def start(self):
+        """Starts the background refresh thread, which performs the initial scan.
+
+        The first scan can take a while on hosts with many sockets, so it no
+        longer holds up capture; lookups until it finishes scan on demand.
+        """
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._refresh_loop, name="ProcessCacheRefresh", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def lookup(self, src_port, flow_key=None):
+        """Returns the process name owning src_port, or "Unknown" if it cannot be attributed yet.
+
+        flow_key is (dst_ip, src_port, dst_port). Its process is remembered
+        after the socket closes, until a scan finds the port owned by another
+        process or forget() is called for the destination.
+        """
+        if flow_key is not None:
+            entry = self._flows.get(flow_key)
+            if entry is not None:
+                self.flow_hits += 1
+                return entry[1]
+
+        entry = self._port_index.get(src_port)
+        if entry is not None:
+            self.port_hits += 1
+        else:
+            self.misses += 1
+            entry = self._lookup_on_demand(src_port)
+            if entry is None:
+                return "Unknown"
+
+        if flow_key is not None:
+            self._remember_flow(flow_key, entry)
+        return entry[1]
+
+    def forget(self, dst_ip, dst_port):
+        """Drops the memoized flows to a destination, e.g. once FlowEngine has evicted its flow."""
+        with self._flows_lock:
+            for flow_key in list(self._destination_flows.get((dst_ip, dst_port), ())):
+                self._drop_flow(flow_key)
+
+    def stats(self):
+        return {
+            "flow_hits": self.flow_hits,
+            "port_hits": self.port_hits,
+            "misses": self.misses,
+            "on_demand_scans": self.on_demand_scans,
+            "throttled_lookups": self.throttled_lookups,
+            "background_scans": self.background_scans,
+            "ports_indexed": len(self._port_index),
+            "flows_memoized": len(self._flows),
+        }
+
+    def _lookup_on_demand(self, src_port):
+        """Rescans the socket table for an unknown port, at most once per min_lookup_interval."""
+        if time.monotonic() - self._last_scan < self.min_lookup_interval:
+            self.throttled_lookups += 1
+            return None
+        with self._scan_lock:
+            # Another thread may have rescanned while we waited for the lock
+            if time.monotonic() - self._last_scan >= self.min_lookup_interval:
+                self.on_demand_scans += 1
+                self._scan_locked()
+        return self._port_index.get(src_port)
+
+    def _remember_flow(self, flow_key, entry):
+        with self._flows_lock:
+            if flow_key not in self._flows and len(self._flows) >= self.max_flows:
+                # Dicts keep insertion order, so this drops the oldest memoized flow
+                self._drop_flow(next(iter(self._flows)))
+            self._flows[flow_key] = entry
+            self._port_flows.setdefault(flow_key[1], set()).add(flow_key)
+            self._destination_flows.setdefault((flow_key[0], flow_key[2]), set()).add(flow_key)
+
+    def _drop_flow(self, flow_key):
+        """Removes a memoized flow and its index entries; called with _flows_lock held."""
+        del self._flows[flow_key]
+        dst_ip, src_port, dst_port = flow_key
+        for index, index_key in ((self._port_flows, src_port), (self._destination_flows, (dst_ip, dst_port))):
+            flow_keys = index[index_key]
+            flow_keys.discard(flow_key)
+            if not flow_keys:
+                del index[index_key]
+
+    def _refresh_loop(self):
+        if time.monotonic() - self._last_scan >= self.refresh_interval / 2:
+            self._scan() # Initial scan, unless an on-demand lookup already did it
+        while not self._stop_event.wait(self.refresh_interval):
+            # Skip the periodic refresh if an on-demand scan just ran
+            if time.monotonic() - self._last_scan < self.refresh_interval / 2:
+                continue
+            self.background_scans += 1
+            self._scan()
+
+    def _scan(self):
+        with self._scan_lock:
+            self._scan_locked()
+
+    def _scan_locked(self):
+        """Rebuilds the port index, only creating Process objects for pids not seen before."""
+        try:
+            connections = psutil.net_connections(kind='inet')
+        except (psutil.AccessDenied, OSError) as e:
+            print(f"Process cache scan failed: {e}")
+            self._last_scan = time.monotonic()
+            return
+
+        port_pids = {}
+        for conn in connections:
+            if conn.pid and conn.laddr:
+                port_pids[conn.laddr.port] = conn.pid
+
+        pid_names = {}
+        for pid in set(port_pids.values()):
+            name = self._pid_names.get(pid)
+            if name is None:
+                try:
+                    name = psutil.Process(pid).name()
+                except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                    continue
+            pid_names[pid] = name
+
+        port_index = {}
+        for port, pid in port_pids.items():
+            name = pid_names.get(pid)
+            if name is not None:
+                port_index[port] = (pid, name)
+
+        # Swap in the new tables in one assignment each so readers never see a partial index
+        self._pid_names = pid_names
+        self._port_index = port_index
+        self._last_scan = time.monotonic()
+
+        with self._flows_lock:
+            # A port owned by another process than the one memoized was closed and reused
+            for port, (pid, _) in port_index.items():
+                flow_keys = self._port_flows.get(port)
+                if flow_keys:
+                    for flow_key in [flow_key for flow_key in flow_keys if self._flows[flow_key][0] != pid]:
+                        self._drop_flow(flow_key)
+
+def executable_paths(names):
+    """Full paths of the executables of running processes with the given names, sorted.
+
+    Firewall rules match a program by its path; a name alone (chrome.exe)
+    does not identify one.
+    """
+    names = set(names)
+    paths = set()
+    for process in psutil.process_iter(['name', 'exe']):
+        if process.info['name'] in names and process.info['exe']:
+            paths.add(process.info['exe'])
+    return sorted(paths)
@@ -0,0 +1,64 @@
+# src/rate_chart.py
+
+from PyQt5.QtWidgets import QWidget
+from PyQt5.QtGui import QColor, QPainter, QPen, QPolygonF
+from PyQt5.QtCore import Qt, QPointF, QTimer
+from rate_tracker import format_bps
+
+CHART_FRAME_INTERVAL_MS = 100 # Redraw at most ten times per second
+
+class RateChart(QWidget):
+    """Line chart of recent bits-per-second series.
+
+    set_series() only stores the data; a timer repaints at a capped frame
+    rate and only when something changed, so bursts of updates cost one
+    paint per frame at most.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setMinimumHeight(120)
+        self._series = [] # [(label, QColor, numpy array of bps oldest first)]
+        self._dirty = False
+        self._frame_timer = QTimer(self)
+        self._frame_timer.timeout.connect(self._on_frame)
+        self._frame_timer.start(CHART_FRAME_INTERVAL_MS)
+
+    def set_series(self, series):
+        self._series = series
+        self._dirty = True
+
+    def _on_frame(self):
+        if self._dirty:
+            self._dirty = False
+            self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.fillRect(self.rect(), QColor(30, 30, 30))
+        if not self._series:
+            painter.end()
+            return
+
+        margin = 6
+        width = self.width() - 2 * margin
+        height = self.height() - 2 * margin
+        peak = max((float(values.max()) for _, _, values in self._series if len(values)), default=0.0) or 1.0
+
+        painter.setPen(QPen(QColor(85, 85, 85)))
+        painter.drawRect(margin, margin, width, height)
+        for label_row, (label, color, values) in enumerate(self._series):
+            if len(values) < 2:
+                continue
+            step = width / (len(values) - 1)
+            scaled = margin + height - values / peak * height
+            polygon = QPolygonF([QPointF(margin + i * step, float(y)) for i, y in enumerate(scaled)])
+            painter.setPen(QPen(color, 1.5))
+            painter.drawPolyline(polygon)
+            painter.drawText(margin + 4, margin + 14 * (label_row + 1), label)
+
+        painter.setPen(QPen(QColor(200, 200, 200)))
+        painter.drawText(self.rect().adjusted(0, margin, -margin - 4, 0), Qt.AlignRight | Qt.AlignTop,
+                         f"peak {format_bps(peak)}")
+        painter.end()
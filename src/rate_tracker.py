@@ -0,0 +1,159 @@
+# src/rate_tracker.py
+
+import time
+import numpy as np
+
+class RateSeries:
+    """Fixed-size per-second throughput history for many keys at once.
+
+    Samples live in one (slots x history) float32 array used as a ring: every
+    key owns a row and tick() closes the current second for all rows in a
+    single vectorized write. Rates, EWMA and percentiles are computed across
+    all rows together, so the cost per tick does not depend on how many
+    flows sent traffic.
+    """
+
+    def __init__(self, history=60, capacity=1024, ewma_alpha=0.3):
+        self.history = history
+        self.ewma_alpha = ewma_alpha
+        self._slots = {} # key -> row
+        self._keys = [None] * capacity # row -> key
+        self._free = list(range(capacity - 1, -1, -1))
+        self.samples = np.zeros((capacity, history), dtype=np.float32) # Bytes per second
+        self.ewma = np.zeros(capacity, dtype=np.float32)
+        self._current = np.zeros(capacity, dtype=np.float64) # Bytes in the second being sampled
+        self._used = np.zeros(capacity, dtype=bool)
+        self.head = history - 1 # Column of the latest completed sample
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, key):
+        return key in self._slots
+
+    def keys(self):
+        return list(self._slots)
+
+    def slot(self, key):
+        """Returns the key's row, allocating one (and growing the arrays) if needed."""
+        row = self._slots.get(key)
+        if row is None:
+            if not self._free:
+                self._grow()
+            row = self._free.pop()
+            self._slots[key] = row
+            self._keys[row] = key
+            self._used[row] = True
+        return row
+
+    def add(self, keys, byte_counts):
+        """Adds byte deltas to the current second; repeated keys accumulate."""
+        if not keys:
+            return
+        rows = np.fromiter((self.slot(key) for key in keys), dtype=np.int64, count=len(keys))
+        np.add.at(self._current, rows, np.asarray(byte_counts, dtype=np.float64))
+
+    def release(self, keys):
+        """Frees the rows of keys that are no longer tracked."""
+        for key in keys:
+            row = self._slots.pop(key, None)
+            if row is None:
+                continue
+            self._keys[row] = None
+            self._used[row] = False
+            self.samples[row] = 0
+            self.ewma[row] = 0
+            self._current[row] = 0
+            self._free.append(row)
+
+    def tick(self, elapsed=1.0):
+        """Closes the current sample for every row; returns the rows whose rate changed."""
+        previous = self.head
+        self.head = (self.head + 1) % self.history
+        column = (self._current / max(elapsed, 1e-3)).astype(np.float32)
+        self.samples[:, self.head] = column
+        self.ewma += self.ewma_alpha * (column - self.ewma)
+        self._current[:] = 0
+        return np.flatnonzero(self._used & (column != self.samples[:, previous]))
+
+    def keys_for(self, rows):
+        return [self._keys[row] for row in rows]
+
+    def rates(self, rows=None):
+        """Latest bytes per second for the given rows (all rows by default)."""
+        return self.samples[:, self.head] if rows is None else self.samples[rows, self.head]
+
+    def percentiles(self, q, rows=None):
+        """q-th percentile of each row's window, computed for all requested rows in one call."""
+        samples = self.samples if rows is None else self.samples[rows]
+        return np.percentile(samples, q, axis=1)
+
+    def series(self, key):
+        """Returns the key's window oldest first, or None if the key is not tracked."""
+        row = self._slots.get(key)
+        if row is None:
+            return None
+        return np.roll(self.samples[row], -(self.head + 1))
+
+    def _grow(self):
+        capacity = len(self._keys)
+        self._keys.extend([None] * capacity)
+        self._free.extend(range(2 * capacity - 1, capacity - 1, -1))
+        self.samples = np.concatenate([self.samples, np.zeros_like(self.samples)])
+        self.ewma = np.concatenate([self.ewma, np.zeros_like(self.ewma)])
+        self._current = np.concatenate([self._current, np.zeros_like(self._current)])
+        self._used = np.concatenate([self._used, np.zeros_like(self._used)])
+
+class RateTracker:
+    """Per-flow rate series plus group series (all traffic, per interface, per process).
+
+    Group series receive the same deltas as their flows, so their history
+    survives flow eviction and is never rebuilt by rescanning flows.
+    """
+
+    def __init__(self, history=60, flow_capacity=1024):
+        self.flows = RateSeries(history, flow_capacity)
+        self.groups = RateSeries(history, 64)
+        self._last_tick = time.monotonic()
+
+    def add(self, flow_keys, groups, byte_counts):
+        """Records one batch: flow_keys[i] and each group key in groups[i] sent byte_counts[i]."""
+        self.flows.add(flow_keys, byte_counts)
+        group_keys = []
+        group_bytes = []
+        for keys, length in zip(groups, byte_counts):
+            for key in keys:
+                group_keys.append(key)
+                group_bytes.append(length)
+        self.groups.add(group_keys, group_bytes)
+
+    def release(self, flow_keys):
+        self.flows.release(flow_keys)
+
+    def tick(self, now=None):
+        """Closes the current second; returns [(flow key, bits per second)] for flows whose rate changed."""
+        now = time.monotonic() if now is None else now
+        elapsed, self._last_tick = now - self._last_tick, now
+        self.groups.tick(elapsed)
+        rows = self.flows.tick(elapsed)
+        return list(zip(self.flows.keys_for(rows), (self.flows.rates(rows) * 8).tolist()))
+
+    def summary(self, series, key, q=95):
+        """Returns (current, ewma, percentile) in bits per second for one key of a series."""
+        if key not in series:
+            return 0.0, 0.0, 0.0
+        row = series.slot(key)
+        return (float(series.rates([row])[0]) * 8, float(series.ewma[row]) * 8,
+                float(series.percentiles(q, [row])[0]) * 8)
+
+def format_bps(bps):
+    for unit in ("bps", "Kbps", "Mbps", "Gbps"):
+        if bps < 1000 or unit == "Gbps":
+            return f"{bps:.0f} {unit}" if unit == "bps" else f"{bps:.1f} {unit}"
+        bps /= 1000
+
+def format_bytes(count):
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if count < 1000 or unit == "TB":
+            return f"{count:.0f} {unit}" if unit == "B" else f"{count:.1f} {unit}"
+        count /= 1000
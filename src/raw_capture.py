@@ -0,0 +1,406 @@
+# src/raw_capture.py
+
+import ctypes
+import socket
+import struct
+import subprocess
+import sys
+import ip_classify
+from ip_classify import is_captured
+
+SNAPLEN = 128 # Enough for Ethernet + VLAN + IPv4 with options or IPv6 with a hop-by-hop header + the ports
+
+# pcap link-layer header types we know how to skip
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+
+# Linux ARPHRD_* hardware types reported by AF_PACKET sockets
+ARPHRD_ETHER = 1
+ARPHRD_LOOPBACK = 772
+ARPHRD_NONE = 0xFFFE # Tunnel devices such as WireGuard/NordLynx deliver bare IP packets
+
+ETH_P_ALL = 0x0003
+PACKET_OUTGOING = 4
+SOL_PACKET = 263
+PACKET_AUXDATA = 8
+AUXDATA_SIZE = socket.CMSG_SPACE(20) if hasattr(socket, 'CMSG_SPACE') else 0 # struct tpacket_auxdata
+SO_ATTACH_FILTER = getattr(socket, 'SO_ATTACH_FILTER', 26)
+BPF_INSTRUCTION = struct.Struct('=HBBI') # struct sock_filter: code, jt, jf, k
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = 0x8100
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+IP_ETHERTYPES = (ETHERTYPE_IPV4, ETHERTYPE_IPV6)
+TRANSPORT_PROTOCOLS = (IPPROTO_TCP, IPPROTO_UDP)
+IPV6_FRAGMENT = 44
+IPV6_EXTENSION_HEADERS = (0, 43, IPV6_FRAGMENT, 60) # Hop-by-hop, routing, fragment, destination options
+NULL_FAMILIES = (2, 10, 23, 24, 28, 30) # AF_INET, and AF_INET6 on Linux, Windows, the BSDs and macOS
+
+PCAP_MAGIC = {
+    b'\xd4\xc3\xb2\xa1': '<', # Little-endian, microsecond timestamps
+    b'\xa1\xb2\xc3\xd4': '>',
+    b'\x4d\x3c\xb2\xa1': '<', # Nanosecond timestamps
+    b'\xa1\xb2\x3c\x4d': '>',
+}
+
+# pcapng block types (Section Header, Interface Description, Packet, Simple Packet, Enhanced Packet)
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_IDB = 0x00000001
+PCAPNG_PB = 0x00000002
+PCAPNG_SPB = 0x00000003
+PCAPNG_EPB = 0x00000006
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+PCAPNG_OPT_TSRESOL = 9
+
+IPV4_MAPPED = ip_classify.IPV4_MAPPED # ::ffff:0:0/96, how IPv4 destinations are numbered alongside IPv6 ones
+
+_ip_strings = {} # Address as int -> string, avoids re-formatting hot destinations
+
+def ip_to_str(value):
+    """Formats a destination as parse_headers() returns it: an IPv6 number, IPv4 as ::ffff:a.b.c.d."""
+    ip = _ip_strings.get(value)
+    if ip is None:
+        if len(_ip_strings) > 65536:
+            _ip_strings.clear()
+        if value >> 32 == 0xFFFF:
+            ip = socket.inet_ntoa((value & 0xFFFFFFFF).to_bytes(4, 'big'))
+        else:
+            ip = socket.inet_ntop(socket.AF_INET6, value.to_bytes(16, 'big'))
+        _ip_strings[value] = ip
+    return ip
+
+def _network_offset(view, linktype):
+    """Returns the offset of the IPv4 or IPv6 header within the frame, or -1 if it is neither."""
+    if linktype == LINKTYPE_ETHERNET:
+        if len(view) < 14:
+            return -1
+        offset = 12
+        ethertype = struct.unpack_from('!H', view, offset)[0]
+        while ethertype == ETHERTYPE_VLAN and len(view) >= offset + 6:
+            offset += 4
+            ethertype = struct.unpack_from('!H', view, offset)[0]
+        return offset + 2 if ethertype in IP_ETHERTYPES else -1
+    if linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        return 0
+    if linktype == LINKTYPE_NULL:
+        # 4-byte address family in the capturing host's byte order
+        if len(view) < 4 or (view[0] not in NULL_FAMILIES and view[3] not in NULL_FAMILIES):
+            return -1
+        return 4
+    if linktype == LINKTYPE_LINUX_SLL:
+        if len(view) < 16 or struct.unpack_from('!H', view, 14)[0] not in IP_ETHERTYPES:
+            return -1
+        return 16
+    return -1
+
+def _ipv6_transport(view, offset):
+    """Returns the offset of the TCP/UDP header behind an IPv6 header and its extension headers, or -1."""
+    if len(view) < offset + 40:
+        return -1
+    next_header = view[offset + 6]
+    transport = offset + 40
+    while next_header in IPV6_EXTENSION_HEADERS:
+        if len(view) < transport + 8:
+            return -1
+        if next_header == IPV6_FRAGMENT:
+            # Only the first fragment carries the ports
+            if struct.unpack_from('!H', view, transport + 2)[0] & 0xFFF8:
+                return -1
+            next_header = view[transport]
+            transport += 8
+        else:
+            next_header, length = view[transport], view[transport + 1]
+            transport += (length + 1) * 8
+    return transport if next_header in TRANSPORT_PROTOCOLS else -1
+
+def parse_frame(view, linktype, skip_private=False):
+    """Parses only the IP and TCP/UDP headers of a frame.
+
+    Works directly on a memoryview so no packet bytes are copied. Returns
+    (dst_ip, src_port, dst_port) or None for anything that is not TCP or UDP
+    over IPv4/IPv6, or, when skip_private is set, for destinations that stay on
+    the host or its link (ip_classify.UNCAPTURED).
+    """
+    headers = parse_headers(view, linktype, skip_private)
+    if headers is None:
+        return None
+    return ip_to_str(headers[0]), headers[1], headers[2]
+
+def parse_headers(view, linktype, skip_private=False):
+    """parse_frame() with the destination as an int (see ip_to_str), as capture workers store it."""
+    offset = _network_offset(view, linktype)
+    if offset < 0 or len(view) < offset + 20:
+        return None
+    version_ihl = view[offset]
+    if version_ihl >> 4 == 4:
+        if view[offset + 9] not in TRANSPORT_PROTOCOLS:
+            return None
+        # Only the first fragment carries the ports
+        if struct.unpack_from('!H', view, offset + 6)[0] & 0x1FFF:
+            return None
+        dst_ip = IPV4_MAPPED | struct.unpack_from('!I', view, offset + 16)[0]
+        if skip_private and not is_captured(dst_ip):
+            return None
+        transport = offset + (version_ihl & 0x0F) * 4
+    elif version_ihl >> 4 == 6:
+        transport = _ipv6_transport(view, offset)
+        if transport < 0:
+            return None
+        high, low = struct.unpack_from('!QQ', view, offset + 24)
+        dst_ip = high << 64 | low
+        if skip_private and not is_captured(dst_ip):
+            return None
+    else:
+        return None
+    if len(view) < transport + 4:
+        return None
+    src_port, dst_port = struct.unpack_from('!HH', view, transport)
+    return dst_ip, src_port, dst_port
+
+class AfPacketSource:
+    """Reads outgoing frames from a Linux AF_PACKET socket into a reused buffer."""
+
+    def __init__(self, iface_name, snaplen=SNAPLEN, timeout=0.5):
+        self.iface_name = iface_name
+        self.snaplen = snaplen
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        self.sock.bind((iface_name, 0))
+        # The kernel filter truncates kept packets to snaplen, after which only the auxiliary
+        # data still carries their wire length
+        self.sock.setsockopt(SOL_PACKET, PACKET_AUXDATA, 1)
+        self.sock.settimeout(timeout) # Lets the caller notice a stop request
+        self.buffer = bytearray(snaplen)
+        self.view = memoryview(self.buffer)
+        hatype = self.sock.getsockname()[3]
+        if hatype in (ARPHRD_ETHER, ARPHRD_LOOPBACK):
+            self.linktype = LINKTYPE_ETHERNET
+        elif hatype == ARPHRD_NONE:
+            self.linktype = LINKTYPE_RAW
+        else:
+            self.linktype = None
+
+    def attach_filter(self, instructions):
+        """Replaces the socket's kernel filter with classic BPF (code, jt, jf, k) instructions.
+
+        The kernel swaps programs atomically, so this is safe while another thread reads frames.
+        """
+        program = ctypes.create_string_buffer(b''.join(BPF_INSTRUCTION.pack(*i) for i in instructions))
+        fprog = struct.pack('HP', len(instructions), ctypes.addressof(program)) # struct sock_fprog
+        self.sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+
+    def frames(self, is_running):
+        """Yields (view, wire_length, linktype) for each outgoing frame.
+
+        The view aliases an internal buffer and is only valid until the next iteration.
+        """
+        buffers = [self.buffer]
+        while is_running():
+            try:
+                # MSG_TRUNC makes the kernel report the length it kept even though
+                # only snaplen bytes are copied into our buffer.
+                nbytes, ancdata, _, address = self.sock.recvmsg_into(buffers, AUXDATA_SIZE, socket.MSG_TRUNC)
+            except socket.timeout:
+                continue
+            if address[2] != PACKET_OUTGOING or self.linktype is None:
+                continue
+            length = nbytes
+            for level, kind, data in ancdata:
+                if level == SOL_PACKET and kind == PACKET_AUXDATA:
+                    length = struct.unpack_from('=I', data, 4)[0] # tp_len
+            yield self.view[:min(nbytes, self.snaplen)], length, self.linktype
+
+    def close(self):
+        self.sock.close()
+
+class PcapStreamSource:
+    """Reads frames from a classic pcap byte stream (a file or the stdout of dumpcap/tcpdump)."""
+
+    def __init__(self, stream, process=None):
+        self.stream = stream
+        self.process = process
+        header = self._read_exact(24)
+        if header is None or header[:4] not in PCAP_MAGIC:
+            raise ValueError("Not a pcap stream")
+        self.byte_order = PCAP_MAGIC[header[:4]]
+        self.nanoseconds = header[:4] in (b'\x4d\x3c\xb2\xa1', b'\xa1\xb2\x3c\x4d')
+        snaplen, self.linktype = struct.unpack_from(self.byte_order + 'II', header, 16)
+        self.record_header = struct.Struct(self.byte_order + 'IIII')
+        self.buffer = bytearray(max(snaplen, 0xFFFF) if snaplen else 0xFFFF)
+        self.view = memoryview(self.buffer)
+
+    @classmethod
+    def from_interface(cls, iface_name, bpf_filter, snaplen=SNAPLEN):
+        """Starts dumpcap (shipped with Wireshark) writing a header-only pcap stream to a pipe."""
+        command = ['dumpcap', '-q', '-i', iface_name, '-s', str(snaplen), '-P', '-w', '-']
+        if bpf_filter:
+            command[5:5] = ['-f', bpf_filter]
+        creationflags = subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                   bufsize=1 << 20, creationflags=creationflags)
+        return cls(process.stdout, process)
+
+    def _read_exact(self, size):
+        data = self.stream.read(size)
+        if not data or len(data) < size:
+            return None
+        return data
+
+    def records(self, is_running):
+        """Yields (timestamp, view, wire_length, linktype) for each record in the stream."""
+        divisor = 1e9 if self.nanoseconds else 1e6
+        header = bytearray(16)
+        while is_running():
+            if self.stream.readinto(header) != 16:
+                return
+            ts_sec, ts_frac, incl_len, orig_len = self.record_header.unpack(header)
+            if incl_len > len(self.buffer):
+                self.buffer = bytearray(incl_len)
+                self.view = memoryview(self.buffer)
+            frame = self.view[:incl_len]
+            if self.stream.readinto(frame) != incl_len:
+                return
+            yield ts_sec + ts_frac / divisor, frame, orig_len, self.linktype
+
+    def frames(self, is_running):
+        """Yields (view, wire_length, linktype), matching AfPacketSource.frames."""
+        for _, frame, orig_len, linktype in self.records(is_running):
+            yield frame, orig_len, linktype
+
+    def close(self):
+        if self.process:
+            self.process.terminate()
+        self.stream.close()
+
+class PcapNgStreamSource:
+    """Reads packets from a pcapng byte stream (the default format of Wireshark and dumpcap).
+
+    Handles multiple sections and interfaces, per-interface link types and
+    timestamp resolutions, and Enhanced, Simple and obsolete Packet blocks.
+    Other blocks are skipped.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.byte_order = '<'
+        self.interfaces = [] # (linktype, timestamp units per second, snaplen) per Interface Description Block
+        self.buffer = bytearray(0xFFFF)
+        self.view = memoryview(self.buffer)
+        header = self.stream.read(12)
+        if not header or len(header) < 12 or struct.unpack_from('<I', header)[0] != PCAPNG_SHB:
+            raise ValueError("Not a pcapng stream")
+        self._start_section(header)
+
+    def _start_section(self, header):
+        """Reads the rest of a Section Header Block given its first 12 bytes."""
+        magic = struct.unpack_from('<I', header, 8)[0]
+        if magic == PCAPNG_BYTE_ORDER_MAGIC:
+            self.byte_order = '<'
+        elif magic == struct.unpack('<I', struct.pack('>I', PCAPNG_BYTE_ORDER_MAGIC))[0]:
+            self.byte_order = '>'
+        else:
+            raise ValueError("Bad pcapng byte-order magic")
+        total_length = struct.unpack_from(self.byte_order + 'I', header, 4)[0]
+        if self._read_body(total_length - 12) is None:
+            raise ValueError("Truncated pcapng section header")
+        self.interfaces = []
+
+    def _read_body(self, size):
+        """Reads size bytes into the reused buffer; returns a view of them or None at end of stream."""
+        if size > len(self.buffer):
+            self.buffer = bytearray(size)
+            self.view = memoryview(self.buffer)
+        body = self.view[:size]
+        if self.stream.readinto(body) != size:
+            return None
+        return body
+
+    def _add_interface(self, body):
+        linktype, _, snaplen = struct.unpack_from(self.byte_order + 'HHI', body)
+        resolution = 1e6
+        offset = 8
+        while offset + 4 <= len(body) - 4: # The trailing 4 bytes repeat the block length
+            code, length = struct.unpack_from(self.byte_order + 'HH', body, offset)
+            if code == 0:
+                break
+            if code == PCAPNG_OPT_TSRESOL and length >= 1:
+                value = body[offset + 4]
+                resolution = 2.0 ** (value & 0x7F) if value & 0x80 else 10.0 ** value
+            offset += 4 + (length + 3) // 4 * 4
+        self.interfaces.append((linktype, resolution, snaplen))
+
+    def records(self, is_running):
+        """Yields (timestamp, view, wire_length, linktype) for each packet in the stream."""
+        block_header = bytearray(8)
+        order = self.byte_order
+        while is_running():
+            if self.stream.readinto(block_header) != 8:
+                return
+            block_type, total_length = struct.unpack_from(order + 'II', block_header)
+            if block_type == PCAPNG_SHB:
+                rest = self.stream.read(4)
+                if not rest or len(rest) < 4:
+                    return
+                self._start_section(bytes(block_header) + rest)
+                order = self.byte_order
+                continue
+            if total_length < 12:
+                raise ValueError("Corrupt pcapng block length")
+            body = self._read_body(total_length - 8)
+            if body is None:
+                return
+            if block_type == PCAPNG_EPB:
+                interface_id, ts_high, ts_low, captured, wire_length = struct.unpack_from(order + 'IIIII', body)
+                data_offset = 20
+            elif block_type == PCAPNG_SPB:
+                interface_id, ts_high, ts_low = 0, 0, 0
+                wire_length = struct.unpack_from(order + 'I', body)[0]
+                captured = min(wire_length, total_length - 16)
+                data_offset = 4
+            elif block_type == PCAPNG_PB:
+                interface_id, _, ts_high, ts_low, captured, wire_length = struct.unpack_from(order + 'HHIIII', body)
+                data_offset = 20
+            else:
+                if block_type == PCAPNG_IDB:
+                    self._add_interface(body)
+                continue
+            if interface_id >= len(self.interfaces):
+                continue # Packet for an interface that was never described
+            linktype, resolution, _ = self.interfaces[interface_id]
+            yield ((ts_high << 32 | ts_low) / resolution, body[data_offset:data_offset + captured],
+                   wire_length, linktype)
+
+    def frames(self, is_running):
+        """Yields (view, wire_length, linktype), matching AfPacketSource.frames."""
+        for _, frame, wire_length, linktype in self.records(is_running):
+            yield frame, wire_length, linktype
+
+    def close(self):
+        self.stream.close()
+
+def open_capture_file(path):
+    """Opens a .pcap or .pcapng file, choosing the reader from its magic number."""
+    stream = open(path, 'rb', buffering=1 << 20)
+    try:
+        magic = stream.peek(4)[:4]
+        if magic in PCAP_MAGIC:
+            return PcapStreamSource(stream)
+        if magic == struct.pack('<I', PCAPNG_SHB):
+            return PcapNgStreamSource(stream)
+        raise ValueError(f"{path} is neither a pcap nor a pcapng file")
+    except Exception:
+        stream.close()
+        raise
+
+def open_interface(iface_name, bpf_filter, snaplen=SNAPLEN):
+    """Opens the fastest raw frame source available on this platform."""
+    if hasattr(socket, 'AF_PACKET'):
+        # bpf_filter is libpcap syntax; the caller attaches compiled instructions instead
+        # (capture_filter.FilteredInterface), and parse_frame(skip_private=True) still checks every frame
+        return AfPacketSource(iface_name, snaplen)
+    return PcapStreamSource.from_interface(iface_name, bpf_filter, snaplen)
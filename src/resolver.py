@@ -1,81 +1,35 @@
 # src/resolver.py
 
-import geoip2.database
-from PyQt5.QtCore import QThread, pyqtSignal
+from PyQt5.QtCore import QObject, pyqtSignal
+from geoip_lookup import DB_CITY_PATH, DB_ASN_PATH
+from geo_resolver import GeoResolver
 
-DB_CITY_PATH = 'GeoLite2-City.mmdb'
-DB_ASN_PATH = 'GeoLite2-ASN.mmdb'
+class ReverseDnsNotifier(QObject):
+    """Carries ReverseDnsResolver results from its asyncio thread to the GUI thread."""
+    domains_resolved = pyqtSignal(list) # [(ip, domain or None)]
 
-class ResolverThread(QThread):
-    resolved = pyqtSignal(dict)
+class ResolverThread(QObject):
+    """Qt front for GeoResolver: re-emits its results as signals, which Qt queues to the GUI thread."""
 
-    def __init__(self):
-        super().__init__()
-        self.city_reader = None
-        self.asn_reader = None
-        self.ips_to_resolve = []
-        self.is_running = True
+    resolved = pyqtSignal(dict) # One result at a time (workers=1)
+    resolved_batch = pyqtSignal(list) # A list of results per batch (workers>1)
 
-    def run(self):
-        try:
-            self.city_reader = geoip2.database.Reader(DB_CITY_PATH)
-            self.asn_reader = geoip2.database.Reader(DB_ASN_PATH)
-        except FileNotFoundError as e:
-            print(f"ERROR: Database not found: {e.filename}")
-            return
+    def __init__(self, cache_size=4096, workers=1, batch_size=64, city_path=DB_CITY_PATH, asn_path=DB_ASN_PATH):
+        super().__init__()
+        self.engine = GeoResolver(cache_size, workers, batch_size, city_path, asn_path,
+                                  on_result=self.resolved.emit, on_batch=self.resolved_batch.emit)
 
-        while self.is_running:
-            if self.ips_to_resolve:
-                ip = self.ips_to_resolve.pop(0)
-                location_data = self._get_location(ip)
-                network = self._get_network(ip)
-                self.resolved.emit({
-                    "ip": ip, 
-                    "location_str": location_data['str'], 
-                    "lat": location_data['lat'],
-                    "lon": location_data['lon'],
-                    "network": network
-                })
-            else:
-                self.msleep(100)
-
-    def resolve(self, ip_address):
-        if ip_address not in self.ips_to_resolve:
-            self.ips_to_resolve.append(ip_address)
+    def start(self):
+        self.engine.start()
 
     def stop(self):
-        self.is_running = False
-        self.quit()
-        self.wait()
+        self.engine.stop()
 
-    def _get_location(self, ip):
-        default_response = {"str": "N/A", "lat": None, "lon": None}
-        if self._is_private_ip(ip) or not self.city_reader:
-            return default_response
-        try:
-            response = self.city_reader.city(ip)
-            city = response.city.name or "Unknown"
-            country = response.country.name or "Unknown"
-            return {
-                "str": f"{city}, {country}",
-                "lat": response.location.latitude,
-                "lon": response.location.longitude
-            }
-        except (geoip2.errors.AddressNotFoundError, TypeError):
-            return default_response
-        except Exception:
-            return {"str": "Error", "lat": None, "lon": None}
+    def resolve(self, ip_address):
+        self.engine.resolve(ip_address)
 
-    def _get_network(self, ip):
-        if self._is_private_ip(ip) or not self.asn_reader:
-            return "N/A"
-        try:
-            response = self.asn_reader.asn(ip)
-            return response.autonomous_system_organization
-        except geoip2.errors.AddressNotFoundError:
-            return "N/A"
-        except Exception:
-            return "Error"
+    def backlog(self):
+        return self.engine.backlog()
 
-    def _is_private_ip(self, ip):
-        return ip.startswith(('192.168.', '10.', '172.16.'))
\ No newline at end of file
+    def collect_metrics(self):
+        self.engine.collect_metrics()
@@ -0,0 +1,44 @@
+# src/startup_profile.py
+
+import time
+
+class StartupProfile:
+    """Times the startup phases and milestones for --startup-profile.
+
+    mark(phase) closes a phase that ran since the previous mark; milestone(name)
+    notes when something happened (first packet captured, first table update).
+    Everything is measured on the monotonic clock from `started`, normally the
+    moment main.py began running, so module imports are included.
+    """
+
+    def __init__(self, started=None, enabled=False):
+        self.started = time.monotonic() if started is None else started
+        self.enabled = enabled
+        self.phases = [] # (phase, seconds it took, seconds since start when it ended)
+        self.milestones = {} # name -> seconds since start
+        self.reported = False
+        self._last = self.started
+
+    def mark(self, phase):
+        now = time.monotonic()
+        self.phases.append((phase, now - self._last, now - self.started))
+        self._last = now
+
+    def milestone(self, name, at=None):
+        """Records the first occurrence of name; at is a time.monotonic() value, defaulting to now."""
+        if name not in self.milestones:
+            self.milestones[name] = (time.monotonic() if at is None else at) - self.started
+
+    def has(self, *names):
+        return all(name in self.milestones for name in names)
+
+    def report(self):
+        """Prints the profile once, if enabled."""
+        if not self.enabled or self.reported:
+            return
+        self.reported = True
+        print("Startup profile (ms):")
+        for phase, seconds, total in self.phases:
+            print(f"  {phase:<30} {seconds * 1000:8.1f}   at {total * 1000:8.1f}")
+        for name, total in sorted(self.milestones.items(), key=lambda item: item[1]):
+            print(f"  {name:<30} {'':>8}   at {total * 1000:8.1f}")
@@ -0,0 +1,69 @@
+# src/summary_panel.py
+
+from PyQt5.QtWidgets import (
+    QWidget, QLabel, QTableWidget, QTableWidgetItem, QHeaderView, QGridLayout, QAbstractItemView
+)
+from PyQt5.QtCore import Qt
+from flow_rollups import PROCESS, COUNTRY, ASN, INTERFACE, VPN
+from rate_tracker import format_bytes
+
+SUMMARY_ROWS = 5 # Groups listed per dimension
+
+# (dimension, header) for each table, in display order
+SUMMARY_TABLES = [(PROCESS, "Process"), (COUNTRY, "Country"), (ASN, "Network"), (INTERFACE, "Interface")]
+
+class SummaryPanel(QWidget):
+    """Dashboard of total volume, connection counts and the top groups by process, country, ASN and interface.
+
+    It reads a FlowRollups directly, so a refresh costs the same however many
+    flows are tracked; the application calls refresh() from its status timer.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        layout = QGridLayout(self)
+        layout.setContentsMargins(4, 0, 0, 0)
+        layout.setSpacing(4)
+        self.totals_label = QLabel("No traffic yet")
+        layout.addWidget(self.totals_label, 0, 0, 1, 2)
+        self.tables = {}
+        for index, (dimension, header) in enumerate(SUMMARY_TABLES):
+            table = QTableWidget(SUMMARY_ROWS, 3)
+            table.setHorizontalHeaderLabels([header, "Volume", "Connections"])
+            table.verticalHeader().setVisible(False)
+            table.verticalHeader().setDefaultSectionSize(table.fontMetrics().height() + 4)
+            table.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+            table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+            table.setSelectionMode(QAbstractItemView.NoSelection)
+            table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+            table.horizontalHeader().setSectionResizeMode(1, QHeaderView.ResizeToContents)
+            table.horizontalHeader().setSectionResizeMode(2, QHeaderView.ResizeToContents)
+            for row in range(SUMMARY_ROWS):
+                for column in range(3):
+                    item = QTableWidgetItem("")
+                    if column:
+                        item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                    table.setItem(row, column, item)
+            layout.addWidget(table, 1 + index // 2, index % 2)
+            self.tables[dimension] = table
+
+    def refresh(self, rollups):
+        """Shows the current totals and top groups of a FlowRollups."""
+        length, _, flows = rollups.total
+        vpn = rollups.groups[VPN]
+        split = "  |  ".join(f"{group} {format_bytes(vpn[group][0])}" for group in ("VPN", "Direct") if group in vpn)
+        self.totals_label.setText(
+            f"Volume {format_bytes(length)} in {flows:,} connections  |  "
+            f"{format_bytes(rollups.bytes_seen)} in {rollups.flows_seen:,} since start"
+            + (f"  |  {split}" if split else ""))
+        for dimension, table in self.tables.items():
+            top = rollups.top(dimension, SUMMARY_ROWS)
+            for row in range(SUMMARY_ROWS):
+                if row < len(top):
+                    group, length, _, flows = top[row]
+                    texts = (str(group), format_bytes(length), f"{flows:,}")
+                else:
+                    texts = ("", "", "")
+                for column, text in enumerate(texts):
+                    table.item(row, column).setText(text)
+                table.item(row, 0).setToolTip(texts[0]) # Long ASN names are elided
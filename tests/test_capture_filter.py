@@ -0,0 +1,165 @@
+# tests/test_capture_filter.py
+
+import ipaddress
+import struct
+import pytest
+import capture_filter
+import ip_classify
+import raw_capture
+from capture_filter import (
+    BPF_ALU_AND_K, BPF_ALU_RSH_K, BPF_JMP_JA, BPF_JMP_JEQ_K, BPF_JMP_JSET_K, BPF_LD_B_ABS, BPF_LD_H_ABS,
+    BPF_LD_W_ABS, BPF_RET_K, SKF_AD_PKTTYPE, bpf_expression, bpf_program,
+)
+
+SNAPLEN = raw_capture.SNAPLEN
+OUTGOING, HOST = raw_capture.PACKET_OUTGOING, 0
+
+def run_bpf(program, frame, pkttype=OUTGOING):
+    """Runs a classic BPF program as the kernel would; returns the accept length (0 drops the packet)."""
+    accumulator = 0
+    pc = 0
+    while True:
+        assert 0 <= pc < len(program), "jumped out of the program"
+        code, jt, jf, k = program[pc]
+        pc += 1
+        if code in (BPF_LD_W_ABS, BPF_LD_H_ABS, BPF_LD_B_ABS):
+            if k == SKF_AD_PKTTYPE:
+                accumulator = pkttype
+                continue
+            size = {BPF_LD_W_ABS: 4, BPF_LD_H_ABS: 2, BPF_LD_B_ABS: 1}[code]
+            if k + size > len(frame):
+                return 0 # Out-of-bounds loads drop the packet
+            accumulator = int.from_bytes(frame[k:k + size], 'big')
+        elif code == BPF_ALU_AND_K:
+            accumulator &= k
+        elif code == BPF_ALU_RSH_K:
+            accumulator >>= k
+        elif code == BPF_JMP_JA:
+            pc += k
+        elif code == BPF_JMP_JEQ_K:
+            pc += jt if accumulator == k else jf
+        elif code == BPF_JMP_JSET_K:
+            pc += jt if accumulator & k else jf
+        elif code == BPF_RET_K:
+            return k
+        else:
+            raise AssertionError(f"unexpected opcode {code:#x}")
+
+def ipv4(dst, protocol=raw_capture.IPPROTO_TCP, fragment=0):
+    header = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 40, 0, fragment, 64, protocol, 0,
+                         ipaddress.IPv4Address("192.0.2.2").packed, ipaddress.IPv4Address(dst).packed)
+    return header + struct.pack('!HH', 50000, 443) + bytes(16)
+
+def ipv6(dst, next_header=raw_capture.IPPROTO_TCP):
+    header = struct.pack('!IHBB16s16s', 6 << 28, 20, next_header, 64,
+                         ipaddress.IPv6Address("2001:db8::2").packed, ipaddress.IPv6Address(dst).packed)
+    return header + struct.pack('!HH', 50000, 443) + bytes(16)
+
+def ethernet(packet, ethertype=None, vlan=False):
+    if ethertype is None:
+        ethertype = raw_capture.ETHERTYPE_IPV6 if packet[0] >> 4 == 6 else raw_capture.ETHERTYPE_IPV4
+    tag = struct.pack('!HH', raw_capture.ETHERTYPE_VLAN, 7) if vlan else b''
+    return bytes(12) + tag + struct.pack('!H', ethertype) + packet
+
+@pytest.fixture
+def networks():
+    """The excluded networks with 192.0.2.0/24 and 2001:db8::/64 as the host's subnets."""
+    return capture_filter.excluded_networks(local=[ipaddress.ip_network("192.0.2.0/24"),
+                                                   ipaddress.ip_network("2001:db8::/64")])
+
+@pytest.mark.parametrize("linktype, frame", [
+    (raw_capture.LINKTYPE_ETHERNET, ethernet),
+    (raw_capture.LINKTYPE_RAW, lambda packet: packet),
+])
+def test_program_accepts_outgoing_public_tcp_and_udp(networks, linktype, frame):
+    program = bpf_program(networks, linktype)
+    accepted = ["8.8.8.8", "1.1.1.1", "172.32.0.1", "198.18.0.5", "203.0.113.9", "100.64.0.1"]
+    dropped = ["10.1.2.3", "172.16.0.1", "172.31.255.255", "192.168.1.1", "127.0.0.1", "169.254.1.1",
+               "224.0.0.251", "255.255.255.255", "0.0.0.0", "240.0.0.1", "192.0.2.77"]
+    for dst in accepted:
+        assert run_bpf(program, frame(ipv4(dst))) == SNAPLEN, dst
+        assert run_bpf(program, frame(ipv4(dst, raw_capture.IPPROTO_UDP))) == SNAPLEN, dst
+    for dst in dropped:
+        assert run_bpf(program, frame(ipv4(dst))) == 0, dst
+    accepted6 = ["2606:4700::1", "2001:db9::1", "2001:db8:0:1::1", "fbff:ffff::1", "fec0::1"]
+    dropped6 = ["::1", "fe80::1", "febf:ffff::1", "fc00::1", "fdff::1", "ff02::fb", "2001:db8::99", "::"]
+    for dst in accepted6:
+        assert run_bpf(program, frame(ipv6(dst))) == SNAPLEN, dst
+    for dst in dropped6:
+        assert run_bpf(program, frame(ipv6(dst))) == 0, dst
+
+@pytest.mark.parametrize("linktype, frame", [
+    (raw_capture.LINKTYPE_ETHERNET, ethernet),
+    (raw_capture.LINKTYPE_RAW, lambda packet: packet),
+])
+def test_program_drops_what_parse_headers_cannot_use(networks, linktype, frame):
+    program = bpf_program(networks, linktype)
+    assert run_bpf(program, frame(ipv4("8.8.8.8")), pkttype=HOST) == 0 # Incoming
+    assert run_bpf(program, frame(ipv4("8.8.8.8", protocol=1))) == 0 # ICMP
+    assert run_bpf(program, frame(ipv4("8.8.8.8", fragment=0x2000))) == SNAPLEN # First fragment, more follow
+    assert run_bpf(program, frame(ipv4("8.8.8.8", fragment=185))) == 0 # Later fragment: no ports
+    assert run_bpf(program, frame(ipv6("2606:4700::1", next_header=58))) == 0 # ICMPv6
+    # Extension headers hide the transport; parse_headers() walks them
+    for next_header in raw_capture.IPV6_EXTENSION_HEADERS:
+        assert run_bpf(program, frame(ipv6("2606:4700::1", next_header))) == SNAPLEN
+
+def test_ethernet_program_passes_vlan_frames_and_drops_other_ethertypes(networks):
+    program = bpf_program(networks, raw_capture.LINKTYPE_ETHERNET)
+    assert run_bpf(program, ethernet(ipv4("10.1.2.3"), vlan=True)) == SNAPLEN # Checked by parse_headers()
+    assert run_bpf(program, ethernet(bytes(28), ethertype=0x0806)) == 0 # ARP
+    assert run_bpf(program, ethernet(ipv4("8.8.8.8"))[:20]) == 0 # Truncated
+
+def test_snaplen_is_the_accept_value(networks):
+    program = bpf_program(networks, raw_capture.LINKTYPE_RAW, snaplen=96)
+    assert run_bpf(program, ipv4("8.8.8.8")) == 96
+
+def test_unknown_link_type_has_no_program(networks):
+    assert bpf_program(networks, raw_capture.LINKTYPE_LINUX_SLL) is None
+
+def test_jumps_stay_short_with_many_networks():
+    excluded = [ipaddress.ip_network(f"8.{i >> 8}.{i & 255}.0/24") for i in range(600)]
+    excluded += [ipaddress.ip_network(f"2606:4700:{i:x}::/48") for i in range(300)]
+    program = bpf_program(excluded, raw_capture.LINKTYPE_ETHERNET)
+    for index, (code, jt, jf, k) in enumerate(program):
+        assert 0 <= jt <= 255 and 0 <= jf <= 255
+        if code in (BPF_JMP_JEQ_K, BPF_JMP_JSET_K):
+            assert index + 1 + max(jt, jf) < len(program)
+        elif code == BPF_JMP_JA:
+            assert index + 1 + k < len(program)
+    assert run_bpf(program, ethernet(ipv4("8.2.87.1"))) == 0 # Network 599
+    assert run_bpf(program, ethernet(ipv4("8.2.88.1"))) == SNAPLEN
+    assert run_bpf(program, ethernet(ipv6("2606:4700:12b::1"))) == 0 # Network 299
+    assert run_bpf(program, ethernet(ipv6("2606:4700:12c::1"))) == SNAPLEN
+
+def test_reject_block_masks_partial_words():
+    program = bpf_program([ipaddress.ip_network("2001:db8:80::/41")], raw_capture.LINKTYPE_RAW)
+    assert run_bpf(program, ipv6("2001:db8:80::1")) == 0
+    assert run_bpf(program, ipv6("2001:db8:ff:ffff::1")) == 0
+    assert run_bpf(program, ipv6("2001:db8:7f::1")) == SNAPLEN
+    assert run_bpf(program, ipv6("2001:db8:100::1")) == SNAPLEN
+
+def test_excluded_networks_follow_the_local_subnets(networks):
+    assert ipaddress.ip_network("192.0.2.0/24") in networks # Documentation, but a local subnet here
+    assert ipaddress.ip_network("10.0.0.0/8") in networks
+    assert ipaddress.ip_network("198.18.0.0/15") not in networks # Benchmark traffic is captured
+    assert all(not network.overlaps(ipaddress.ip_network("100.64.0.0/10")) for network in networks
+               if network.version == 4)
+
+def test_excluded_networks_leave_the_shared_table_alone(networks):
+    assert ip_classify.table().local == ()
+    assert ipaddress.ip_network("192.0.2.0/24") not in capture_filter.excluded_networks()
+
+def test_watcher_sets_the_local_subnets(monkeypatch):
+    subnet = ipaddress.ip_network("192.0.2.0/24")
+    monkeypatch.setattr(ip_classify, "local_networks", lambda: [subnet])
+    try:
+        watcher = capture_filter.NetworkWatcher("test")
+        assert ip_classify.table().local == (subnet,) and subnet in watcher.networks
+        assert not ip_classify.is_captured(ip_classify.to_number("192.0.2.1"))
+    finally:
+        ip_classify.set_local_networks(())
+
+def test_expression():
+    assert bpf_expression([]) == "tcp or udp"
+    assert bpf_expression([ipaddress.ip_network("10.0.0.0/8"), ipaddress.ip_network("fe80::/10")]) == (
+        "(tcp or udp) and not (dst net 10.0.0.0/8 or dst net fe80::/10)")
@@ -0,0 +1,155 @@
+# tests/test_connection_model.py
+
+import random
+import pytest
+
+QtCore = pytest.importorskip("PyQt5.QtCore")
+from PyQt5.QtCore import QCoreApplication, QPersistentModelIndex, Qt
+from connection_model import COL_DOMAIN, COL_IP, COL_RATE, COL_VOLUME, ConnectionFilterProxyModel, ConnectionTableModel
+from flow_filter import compile_filter
+from flow_table import FlowRecord
+
+@pytest.fixture(scope="module")
+def app():
+    return QCoreApplication.instance() or QCoreApplication(["tests"])
+
+def flow(i, volume=0, interface="Ethernet"):
+    record = FlowRecord(f"198.18.0.{i}:443:{interface}", f"198.18.0.{i}", 443, interface, "test.exe")
+    record.volume = volume
+    return record
+
+def fill(model, volumes):
+    flows = [flow(i, volume) for i, volume in enumerate(volumes)]
+    model.begin_batch()
+    for record in flows:
+        model.add_or_update(record.key, record)
+    model.end_batch()
+    return flows
+
+def column(model, field):
+    return [model.record(row)[field] for row in range(model.rowCount())]
+
+def assert_indexes_consistent(model):
+    for row in range(model.rowCount()):
+        record = model.record(row)
+        assert model.row_for_key(record["key"]) == row
+        assert row in model.rows_for_ip(record["dst_ip"])
+
+def test_rows_follow_the_sort_after_apply_moves(app):
+    model = ConnectionTableModel()
+    model.sort(COL_VOLUME, Qt.DescendingOrder)
+    rng = random.Random(5)
+    flows = fill(model, [rng.randrange(10 ** 6) for _ in range(300)])
+    assert column(model, "key") == [record.key for record in flows] # Appended in arrival order
+    model.apply_moves()
+    assert column(model, "volume") == sorted(column(model, "volume"), reverse=True)
+    for moved in (3, 200): # Few rows bisect into place; many re-sort
+        model.begin_batch()
+        for record in rng.sample(flows, moved):
+            record.volume += rng.randrange(10 ** 6)
+            model.add_or_update(record.key, record)
+        model.end_batch()
+        model.apply_moves()
+        assert column(model, "volume") == sorted(column(model, "volume"), reverse=True)
+        assert_indexes_consistent(model)
+
+def test_text_columns_sort_both_ways(app):
+    model = ConnectionTableModel()
+    fill(model, [1, 2, 3])
+    for ip, domain in (("198.18.0.0", "b.example"), ("198.18.0.1", "a.example"), ("198.18.0.2", "b.example.org")):
+        model.update_domain(ip, domain)
+    model.sort(COL_DOMAIN, Qt.DescendingOrder)
+    assert column(model, "domain") == ["b.example.org", "b.example", "a.example"]
+    model.sort(COL_DOMAIN, Qt.AscendingOrder)
+    assert column(model, "domain") == ["a.example", "b.example", "b.example.org"]
+    model.sort(-1)
+    assert column(model, "dst_ip") == ["198.18.0.0", "198.18.0.1", "198.18.0.2"] # Insertion order
+    assert_indexes_consistent(model)
+
+def test_data_changed_covers_only_the_changed_rows(app):
+    model = ConnectionTableModel()
+    model.sort(COL_VOLUME, Qt.DescendingOrder)
+    flows = fill(model, range(100, 0, -1))
+    model.apply_moves()
+    ranges = []
+    model.dataChanged.connect(lambda top_left, bottom_right, roles=(): ranges.append(
+        (top_left.row(), bottom_right.row(), top_left.column(), bottom_right.column())))
+    model.begin_batch()
+    model.update_rates([(flows[2].key, 1.0), (flows[3].key, 1.0), (flows[90].key, 1.0)])
+    model.end_batch()
+    assert ranges == [(2, 3, COL_RATE, COL_RATE), (90, 90, COL_RATE, COL_RATE)]
+    ranges.clear()
+    flows[50].interface = "NordLynx" # Changes the row's color
+    model.add_or_update(flows[50].key, flows[50])
+    assert ranges == [(50, 50, COL_IP, model.columnCount() - 1)]
+
+def test_layout_changes_are_throttled(app):
+    model = ConnectionTableModel()
+    model.sort(COL_VOLUME, Qt.DescendingOrder)
+    flows = fill(model, [5, 4, 3])
+    model.apply_moves()
+    layouts = []
+    model.layoutChanged.connect(lambda *args: layouts.append(1))
+    for volume in (10, 20, 30):
+        flows[2].volume = volume
+        model.add_or_update(flows[2].key, flows[2])
+    assert not layouts and model.record(2)["volume"] == 30 # Shown in place until the timer fires
+    model.apply_moves()
+    assert layouts == [1] and column(model, "volume") == [30, 5, 4]
+
+def test_persistent_indexes_follow_moved_rows(app):
+    model = ConnectionTableModel()
+    model.sort(COL_VOLUME, Qt.DescendingOrder)
+    flows = fill(model, [3, 2, 1])
+    model.apply_moves()
+    selected = QPersistentModelIndex(model.index(2, COL_VOLUME))
+    flows[2].volume = 100
+    model.add_or_update(flows[2].key, flows[2])
+    model.apply_moves()
+    assert selected.row() == 0 and model.record(0)["key"] == flows[2].key
+
+def test_remove_keys(app):
+    model = ConnectionTableModel()
+    model.sort(COL_VOLUME, Qt.AscendingOrder)
+    flows = fill(model, range(10))
+    model.apply_moves()
+    flows[4].volume = 100 # Still misplaced when removed
+    model.add_or_update(flows[4].key, flows[4])
+    model.remove_keys([flows[i].key for i in (0, 1, 4, 7)] + ["unknown"])
+    assert column(model, "volume") == [2, 3, 5, 6, 8, 9]
+    assert model.row_for_key(flows[4].key) == -1 and model.rows_for_ip(flows[4].dst_ip) == []
+    model.apply_moves()
+    assert_indexes_consistent(model)
+
+class CountingFilter:
+    def __init__(self, flow_filter):
+        self.flow_filter = flow_filter
+        self.fields = flow_filter.fields
+        self.calls = 0
+
+    def matches(self, record):
+        self.calls += 1
+        return self.flow_filter.matches(record)
+
+def test_proxy_refilters_only_on_changes_to_filtered_columns(app):
+    model = ConnectionTableModel()
+    flows = fill(model, [1, 2, 3, 4])
+    proxy = ConnectionFilterProxyModel()
+    proxy.setSourceModel(model)
+    counting = CountingFilter(compile_filter("domain=example"))
+    proxy.set_flow_filter(counting)
+    assert proxy.rowCount() == 0 and counting.calls == 4
+    model.begin_batch()
+    model.update_rates([(record.key, 1.0) for record in flows])
+    model.end_batch()
+    assert counting.calls == 4 # Rates are not filtered on
+    model.update_domain(flows[1].dst_ip, "a.example")
+    QCoreApplication.processEvents()
+    assert counting.calls == 5
+    assert [proxy.index(row, COL_IP).data() for row in range(proxy.rowCount())] == [flows[1].dst_ip]
+    model.update_domain(flows[1].dst_ip, "other.org")
+    QCoreApplication.processEvents()
+    assert proxy.rowCount() == 0
+    added = flow(9)
+    model.add_or_update(added.key, added)
+    assert proxy.rowCount() == 0 and counting.calls == 7 # New rows are still tested on insert
@@ -0,0 +1,210 @@
+# tests/test_dns_resolver.py
+
+import socket
+import threading
+import time
+import dns.flags
+import dns.message
+import dns.rcode
+import dns.resolver
+import dns.reversename
+import dns.rrset
+import pytest
+from dns_resolver import ReverseDnsResolver
+
+class StubDnsServer:
+    """UDP DNS server on 127.0.0.1 answering PTR queries from a table.
+
+    answers maps an IP to ("ptr", name, ttl), ("nxdomain",) or ("drop",)
+    (never answered). Each query is answered from its own thread after
+    delay seconds, and the most queries waiting at once is recorded.
+    """
+
+    def __init__(self, answers, delay=0.0):
+        self.answers = {dns.reversename.from_address(ip): answer for ip, answer in answers.items()}
+        self.delay = delay
+        self.queries = [] # Reverse names, in arrival order
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind(("127.0.0.1", 0))
+        self.port = self._socket.getsockname()[1]
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                data, address = self._socket.recvfrom(512)
+            except OSError:
+                return # Closed
+            threading.Thread(target=self._answer, args=(data, address), daemon=True).start()
+
+    def _answer(self, data, address):
+        query = dns.message.from_wire(data)
+        name = query.question[0].name
+        with self._lock:
+            self.queries.append(name)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delay)
+        answer = self.answers.get(name, ("nxdomain",))
+        response = dns.message.make_response(query)
+        response.flags |= dns.flags.RA
+        if answer[0] == "ptr":
+            response.answer.append(dns.rrset.from_text(name, answer[2], "IN", "PTR", answer[1]))
+        elif answer[0] == "nxdomain":
+            response.set_rcode(dns.rcode.NXDOMAIN)
+        with self._lock:
+            self.active -= 1
+        if answer[0] != "drop":
+            try:
+                self._socket.sendto(response.to_wire(), address)
+            except OSError:
+                pass
+
+    def count(self, ip):
+        return self.queries.count(dns.reversename.from_address(ip))
+
+    def close(self):
+        self._socket.close()
+
+class Results:
+    """Collects the resolver's batches; wait() polls until an IP has an answer."""
+
+    def __init__(self):
+        self.answers = {}
+        self.batches = 0
+
+    def __call__(self, results):
+        self.batches += 1
+        self.answers.update(results)
+
+    def wait(self, *ips, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while not all(ip in self.answers for ip in ips):
+            assert time.monotonic() < deadline, f"no answer for {[ip for ip in ips if ip not in self.answers]}"
+            time.sleep(0.01)
+        return [self.answers.pop(ip) for ip in ips]
+
+def make_resolver(server, results, **kwargs):
+    kwargs.setdefault("flush_interval", 0.01)
+    resolver = ReverseDnsResolver(results, nameservers=["127.0.0.1"], port=server.port, **kwargs)
+    assert resolver.start()
+    return resolver
+
+@pytest.fixture
+def stub():
+    servers = []
+    def start(answers, delay=0.0):
+        servers.append(StubDnsServer(answers, delay))
+        return servers[-1]
+    yield start
+    for server in servers:
+        server.close()
+
+def test_positive_answer_is_cached_for_its_ttl(stub):
+    server = stub({"192.0.2.1": ("ptr", "one.example.", 300), "192.0.2.2": ("ptr", "two.example.", 0)})
+    results = Results()
+    resolver = make_resolver(server, results, min_ttl=0)
+    try:
+        resolver.resolve("192.0.2.1")
+        resolver.resolve("192.0.2.2")
+        assert results.wait("192.0.2.1", "192.0.2.2") == ["one.example", "two.example"]
+        resolver.resolve("192.0.2.1") # Within its TTL
+        resolver.resolve("192.0.2.2") # Expired at once
+        assert results.wait("192.0.2.1", "192.0.2.2") == ["one.example", "two.example"]
+        assert server.count("192.0.2.1") == 1
+        assert server.count("192.0.2.2") == 2
+        assert resolver.stats()["cache_hits"] == 1
+    finally:
+        resolver.stop()
+
+def test_min_ttl_extends_short_answers(stub):
+    server = stub({"192.0.2.3": ("ptr", "short.example.", 0)})
+    results = Results()
+    resolver = make_resolver(server, results, min_ttl=60)
+    try:
+        resolver.resolve("192.0.2.3")
+        results.wait("192.0.2.3")
+        resolver.resolve("192.0.2.3")
+        assert results.wait("192.0.2.3") == ["short.example"]
+        assert server.count("192.0.2.3") == 1
+    finally:
+        resolver.stop()
+
+def test_nxdomain_is_cached_negatively(stub):
+    server = stub({})
+    results = Results()
+    resolver = make_resolver(server, results, negative_ttl=3600)
+    try:
+        resolver.resolve("192.0.2.4")
+        assert results.wait("192.0.2.4") == [None]
+        resolver.resolve("192.0.2.4")
+        assert results.wait("192.0.2.4") == [None]
+        assert server.count("192.0.2.4") == 1
+        stats = resolver.stats()
+        assert stats["negative_hits"] == 1 and stats["timeouts"] == 0 and stats["failures"] == 0
+    finally:
+        resolver.stop()
+
+def test_negative_answers_expire(stub):
+    server = stub({})
+    results = Results()
+    resolver = make_resolver(server, results, negative_ttl=0)
+    try:
+        for _ in range(2):
+            resolver.resolve("192.0.2.5")
+            assert results.wait("192.0.2.5") == [None]
+        assert server.count("192.0.2.5") == 2
+    finally:
+        resolver.stop()
+
+def test_unanswered_query_times_out_and_is_cached(stub):
+    server = stub({"192.0.2.6": ("drop",)})
+    results = Results()
+    resolver = make_resolver(server, results, timeout=0.3, timeout_ttl=120)
+    try:
+        started = time.monotonic()
+        resolver.resolve("192.0.2.6")
+        assert results.wait("192.0.2.6") == [None]
+        assert time.monotonic() - started < 2.0
+        assert resolver.stats()["timeouts"] == 1
+        queries = server.count("192.0.2.6")
+        resolver.resolve("192.0.2.6")
+        assert results.wait("192.0.2.6") == [None]
+        assert server.count("192.0.2.6") == queries
+        assert resolver.stats()["negative_hits"] == 1
+    finally:
+        resolver.stop()
+
+def test_in_flight_queries_are_capped(stub):
+    ips = [f"192.0.2.{i}" for i in range(10, 22)]
+    server = stub({ip: ("ptr", f"host{i}.example.", 300) for i, ip in enumerate(ips)}, delay=0.1)
+    results = Results()
+    resolver = make_resolver(server, results, max_concurrency=3)
+    try:
+        for ip in ips:
+            resolver.resolve(ip)
+        resolver.resolve(ips[0]) # Already in flight: not queried twice
+        assert results.wait(*ips) == [f"host{i}.example" for i in range(len(ips))]
+        assert server.max_active == 3
+        assert resolver.stats()["queries"] == len(ips)
+    finally:
+        resolver.stop()
+
+def test_failed_setup_disables_the_resolver():
+    results = Results()
+    resolver = ReverseDnsResolver(results)
+    def no_configuration():
+        raise dns.resolver.NoResolverConfiguration("no resolv.conf")
+    resolver._make_resolver = no_configuration # pylint: disable=protected-access
+    outcome = []
+    thread = threading.Thread(target=lambda: outcome.append(resolver.start()), daemon=True)
+    thread.start()
+    thread.join(timeout=5)
+    assert outcome == [False], "start() did not return"
+    assert isinstance(resolver.error, dns.resolver.NoResolverConfiguration)
+    resolver.resolve("192.0.2.1") # Ignored
+    resolver.stop()
+    assert results.batches == 0
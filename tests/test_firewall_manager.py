@@ -0,0 +1,303 @@
+# tests/test_firewall_manager.py
+
+import ipaddress
+import queue
+import time
+import pytest
+import firewall_manager
+import ip_classify
+from firewall_manager import FakeBackend, FirewallExecutor, NetshBackend, NftablesBackend
+
+LAN = ["10.0.0.0/8", "192.168.0.0/16", "fe80::/10", "ff02::/16"]
+
+def networks(*texts):
+    return [ipaddress.ip_network(text) for text in texts]
+
+class Completions:
+    """on_complete callback; next() waits for the executor's next report."""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+
+    def __call__(self, blocked, ok):
+        self._queue.put((blocked, ok))
+
+    def next(self, timeout=5.0):
+        return self._queue.get(timeout=timeout)
+
+    def assert_idle(self, wait=0.2):
+        with pytest.raises(queue.Empty):
+            self._queue.get(timeout=wait)
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+@pytest.fixture
+def executor():
+    executors = []
+    def start(backend):
+        completions = Completions()
+        executors.append(FirewallExecutor(backend, lan_subnets=LAN, on_complete=completions))
+        executors[-1].start()
+        return executors[-1], completions
+    yield start
+    for started in executors:
+        started.stop()
+
+# --- FirewallExecutor ---
+
+def test_setup_then_toggle_reports_each_applied_state(executor):
+    backend = FakeBackend()
+    firewall, completions = executor(backend)
+    assert completions.next() == (False, True)
+    assert backend.invocations == [[("setup", LAN)]]
+    firewall.set_block(True)
+    assert completions.next() == (True, True)
+    firewall.set_block(False)
+    assert completions.next() == (False, True)
+    assert backend.invocations[1:] == [[("block", True)], [("block", False)]]
+    assert backend.installed and not backend.blocked
+
+def test_requests_made_during_a_call_are_coalesced(executor):
+    backend = FakeBackend(delay=0.2)
+    firewall, completions = executor(backend)
+    wait_for(lambda: backend.invocations) # Setup is in flight
+    for enabled in (True, False, True):
+        firewall.set_block(enabled)
+    firewall.set_blocked_networks(networks("1.2.3.0/24", "1.2.2.0/24"))
+    firewall.set_blocked_networks(networks("5.6.7.0/24"))
+    assert completions.next() == (False, True)
+    assert completions.next() == (True, True)
+    completions.assert_idle()
+    assert backend.invocations == [
+        [("setup", LAN)],
+        [("block", True), ("destinations", networks("5.6.7.0/24"), [])],
+    ]
+
+def test_toggling_back_before_the_worker_wakes_sends_nothing(executor):
+    backend = FakeBackend(delay=0.2)
+    firewall, completions = executor(backend)
+    wait_for(lambda: backend.invocations)
+    firewall.set_block(True)
+    firewall.set_block(False)
+    assert completions.next() == (False, True)
+    completions.assert_idle()
+    assert len(backend.invocations) == 1
+
+def test_only_the_difference_of_blocked_networks_is_sent(executor):
+    backend = FakeBackend()
+    firewall, completions = executor(backend)
+    completions.next()
+    firewall.set_blocked_networks(networks("1.2.3.0/24", "1.2.2.0/24", "2001:db8::/32"))
+    completions.next()
+    firewall.set_blocked_networks(networks("1.2.2.0/23", "9.9.9.9/32")) # Same /23, collapsed
+    completions.next()
+    assert backend.invocations[1:] == [
+        [("destinations", networks("1.2.2.0/23", "2001:db8::/32"), [])],
+        [("destinations", networks("9.9.9.9/32"), networks("2001:db8::/32"))],
+    ]
+    assert backend.networks == set(networks("1.2.2.0/23", "9.9.9.9/32"))
+
+def test_failed_change_rolls_back_without_retrying(executor):
+    backend = FakeBackend()
+    firewall, completions = executor(backend)
+    completions.next()
+    backend.fail = True
+    firewall.set_block(True)
+    assert completions.next() == (False, False) # Still unblocked
+    completions.assert_idle()
+    assert len(backend.invocations) == 2
+    backend.fail = False
+    firewall.set_blocked_networks(networks("5.6.7.0/24"))
+    assert completions.next() == (False, True)
+    # The failed toggle is not sent again with the next change
+    assert backend.invocations[2] == [("destinations", networks("5.6.7.0/24"), [])]
+    assert firewall.installed
+
+def test_failed_setup_leaves_nothing_to_toggle(executor):
+    backend = FakeBackend(fail=True)
+    firewall, completions = executor(backend)
+    assert completions.next() == (False, False)
+    assert not firewall.installed # The GUI disables the toggle on this
+    firewall.set_block(True)
+    firewall.set_blocked_networks(networks("5.6.7.0/24"))
+    completions.assert_idle()
+    firewall.stop() # The worker has already exited; nothing to tear down
+    assert backend.invocations == [[("setup", LAN)]]
+
+def test_stop_tears_the_rules_down(executor):
+    backend = FakeBackend()
+    firewall, completions = executor(backend)
+    completions.next()
+    firewall.set_block(True)
+    completions.next()
+    firewall.stop()
+    assert completions.next() == (False, True)
+    assert backend.invocations[-1] == [("teardown",)]
+    assert not backend.installed and not backend.blocked
+
+def test_blocked_programs_are_diffed(executor):
+    backend = FakeBackend()
+    firewall, completions = executor(backend)
+    completions.next()
+    firewall.set_blocked_programs([r"C:\a\a.exe", r"C:\b\b.exe"])
+    completions.next()
+    firewall.set_blocked_programs([r"C:\b\b.exe", r"C:\c\c.exe"])
+    completions.next()
+    assert backend.invocations[1:] == [
+        [("programs", [r"C:\a\a.exe", r"C:\b\b.exe"], [])],
+        [("programs", [r"C:\c\c.exe"], [r"C:\a\a.exe"])],
+    ]
+    assert backend.programs == {r"C:\b\b.exe", r"C:\c\c.exe"}
+
+def test_programs_need_a_backend_that_can_block_them():
+    firewall = FirewallExecutor(NftablesBackend(), lan_subnets=LAN)
+    with pytest.raises(ValueError, match="cannot block programs"):
+        firewall.set_blocked_programs([r"/usr/bin/curl"])
+
+# --- Backend command output ---
+
+class RecordingNetsh(NetshBackend):
+    """NetshBackend that keeps each `netsh -f` script instead of running it."""
+
+    def __init__(self, listing=""):
+        super().__init__()
+        self.listing = listing
+        self.scripts = []
+
+    def _run(self, argv, stdin=None):
+        assert argv[:2] == ['netsh', '-f']
+        with open(argv[2], encoding='utf-8') as f:
+            self.scripts.append(f.read())
+        return True
+
+    def _output(self, argv):
+        assert argv == ['netsh', 'advfirewall', 'firewall', 'show', 'rule', 'name=all', 'dir=out']
+        return self.listing
+
+def test_netsh_scripts():
+    backend = RecordingNetsh(listing="Rule Name:  ConmonBlockDestinations-3\n-----\nRule Name:  Other-4\n"
+                                     "-----\nRule Name:  ConmonBlockProgram-0\n")
+    backend.BUCKET_SIZE = 2
+    backend.apply([("setup", LAN), ("block", True)])
+    backend.apply([("destinations", networks("1.2.3.0/24", "5.6.0.0/16", "2001:db8::/32"), [])])
+    backend.apply([("destinations", networks("9.9.9.9/32"), networks("1.2.3.0/24"))])
+    backend.apply([("destinations", [], networks("2001:db8::/32"))])
+    backend.apply([("teardown",)])
+    assert backend.scripts == [
+        # Stale rules, including the destination rule found in the listing; failures are ignored
+        'advfirewall firewall delete rule name="ConmonBlockInternet"\n'
+        'advfirewall firewall delete rule name="ConmonAllowLAN"\n'
+        'advfirewall firewall delete rule name="ConmonBlockDestinations-3"\n'
+        'advfirewall firewall delete rule name="ConmonBlockProgram-0"\n',
+
+        'advfirewall firewall add rule name="ConmonBlockInternet" dir=out action=block enable=no\n'
+        'advfirewall firewall add rule name="ConmonAllowLAN" dir=out action=allow '
+        'remoteip=10.0.0.0/8,192.168.0.0/16,fe80::/10,ff02::/16 enable=yes\n'
+        'advfirewall firewall set rule name="ConmonBlockInternet" new enable=yes\n',
+
+        'advfirewall firewall add rule name="ConmonBlockDestinations-0" dir=out action=block '
+        'remoteip=1.2.3.0/24,5.6.0.0/16 enable=yes\n'
+        'advfirewall firewall add rule name="ConmonBlockDestinations-1" dir=out action=block '
+        'remoteip=2001:db8::/32 enable=yes\n',
+
+        # The freed slot in rule 0 is reused
+        'advfirewall firewall set rule name="ConmonBlockDestinations-0" new remoteip=5.6.0.0/16,9.9.9.9/32\n',
+
+        'advfirewall firewall delete rule name="ConmonBlockDestinations-1"\n',
+
+        'advfirewall firewall set rule name="ConmonBlockInternet" new enable=no\n'
+        'advfirewall firewall delete rule name="ConmonBlockInternet"\n'
+        'advfirewall firewall delete rule name="ConmonAllowLAN"\n'
+        'advfirewall firewall delete rule name="ConmonBlockDestinations-0"\n',
+    ]
+
+def test_netsh_program_rules():
+    backend = RecordingNetsh()
+    backend.apply([("setup", LAN)]) # A cleanup script and a setup script
+    backend.apply([("programs", [r"C:\Program Files\App\app.exe", r"C:\b.exe"], [])])
+    backend.apply([("programs", [r"C:\c.exe"], [r"C:\Program Files\App\app.exe"])])
+    backend.apply([("teardown",)])
+    assert backend.scripts[2:] == [
+        'advfirewall firewall add rule name="ConmonBlockProgram-0" dir=out action=block '
+        'program="C:\\Program Files\\App\\app.exe" enable=yes\n'
+        'advfirewall firewall add rule name="ConmonBlockProgram-1" dir=out action=block '
+        'program="C:\\b.exe" enable=yes\n',
+
+        # The removed program's rule number is reused
+        'advfirewall firewall delete rule name="ConmonBlockProgram-0"\n'
+        'advfirewall firewall add rule name="ConmonBlockProgram-0" dir=out action=block '
+        'program="C:\\c.exe" enable=yes\n',
+
+        'advfirewall firewall set rule name="ConmonBlockInternet" new enable=no\n'
+        'advfirewall firewall delete rule name="ConmonBlockInternet"\n'
+        'advfirewall firewall delete rule name="ConmonAllowLAN"\n'
+        'advfirewall firewall delete rule name="ConmonBlockProgram-0"\n'
+        'advfirewall firewall delete rule name="ConmonBlockProgram-1"\n',
+    ]
+
+def test_netsh_setup_without_a_listing_still_cleans_up():
+    backend = RecordingNetsh(listing=None) # `show rule` failed
+    backend.apply([("setup", LAN)])
+    assert backend.scripts[0] == ('advfirewall firewall delete rule name="ConmonBlockInternet"\n'
+                                  'advfirewall firewall delete rule name="ConmonAllowLAN"\n')
+
+class RecordingNftables(NftablesBackend):
+    """NftablesBackend that keeps each `nft -f -` input instead of running it."""
+
+    def __init__(self):
+        super().__init__()
+        self.inputs = []
+
+    def _run(self, argv, stdin=None):
+        assert argv == ['nft', '-f', '-']
+        self.inputs.append(stdin)
+        return True
+
+def test_nftables_input():
+    backend = RecordingNftables()
+    backend.apply([("setup", LAN), ("block", True)])
+    backend.apply([("destinations", networks("1.2.3.0/24", "2001:db8::/32"), networks("5.6.0.0/16"))])
+    backend.apply([("block", False)])
+    backend.apply([("teardown",)])
+    assert backend.inputs == [
+        "add table inet conmon\n"
+        "delete table inet conmon\n"
+        "add table inet conmon\n"
+        "add set inet conmon blocked4 { type ipv4_addr; flags interval; }\n"
+        "add set inet conmon blocked6 { type ipv6_addr; flags interval; }\n"
+        "add chain inet conmon internet\n"
+        "add chain inet conmon output { type filter hook output priority 0; policy accept; }\n"
+        "add rule inet conmon output ip daddr @blocked4 drop\n"
+        "add rule inet conmon output ip6 daddr @blocked6 drop\n"
+        "add rule inet conmon output jump internet\n"
+        "flush chain inet conmon internet\n"
+        'add rule inet conmon internet oifname "lo" accept\n'
+        "add rule inet conmon internet ip daddr { 10.0.0.0/8, 192.168.0.0/16 } accept\n"
+        "add rule inet conmon internet ip6 daddr { fe80::/10, ff02::/16 } accept\n"
+        "add rule inet conmon internet drop\n",
+
+        "delete element inet conmon blocked4 { 5.6.0.0/16 }\n"
+        "add element inet conmon blocked4 { 1.2.3.0/24 }\n"
+        "add element inet conmon blocked6 { 2001:db8::/32 }\n",
+
+        "flush chain inet conmon internet\n",
+
+        "add table inet conmon\n"
+        "delete table inet conmon\n",
+    ]
+
+def test_nftables_without_operations_runs_nothing():
+    backend = RecordingNftables()
+    assert backend.apply([])
+    assert backend.inputs == []
+
+def test_lan_subnets_cover_both_families_multicast_and_broadcast(monkeypatch):
+    connected = networks("192.168.1.0/24", "100.64.1.0/24", "2001:db8:1::/64")
+    monkeypatch.setattr(ip_classify, "local_networks", lambda: connected)
+    assert firewall_manager.get_lan_subnets() == [
+        "10.0.0.0/8", "100.64.1.0/24", "169.254.0.0/16", "172.16.0.0/12", "192.168.0.0/16", "224.0.0.0/4",
+        "255.255.255.255/32", "2001:db8:1::/64", "fc00::/7", "fe80::/10", "ff02::/16"]
@@ -0,0 +1,123 @@
+# tests/test_flow_filter.py
+
+import pytest
+import flow_filter as flow_filter_module
+from flow_filter import FilterError, compile_filter
+
+def flow(**fields):
+    record = {"dst_ip": "104.16.1.1", "domain": "cdn.example", "dst_port": 443, "process_name": "chrome.exe",
+              "interface": "Ethernet", "volume": 20 * 10 ** 6, "rate_bps": 2 * 10 ** 6,
+              "location": "Berlin, Germany", "network": "Cloudflare, Inc."}
+    record.update(fields)
+    return record
+
+def matches(text, **fields):
+    return compile_filter(text)(flow(**fields))
+
+def test_empty_filter_is_none():
+    assert compile_filter("   ") is None
+
+@pytest.mark.parametrize("text, expected", [
+    ("process=chrome", True),
+    ("process=CHROME", True), # Text ignores case
+    ("process==chrome", False), # Equals, not contains
+    ("process==chrome.exe", True),
+    ("process!=firefox", True),
+    ('network="cloudflare, inc."', True),
+    ("volume>10MB", True),
+    ("volume>=20M", True),
+    ("volume<20MiB", True), # 20 * 2**20 bytes
+    ("rate>1Mbps", True),
+    ("rate<=1.5M", False),
+    ("port=443", True),
+    ("port!=443", False),
+    ("germany", True), # A bare value matches any text column
+    ("firefox", False),
+])
+def test_comparisons(text, expected):
+    assert matches(text) is expected
+
+def test_and_binds_tighter_than_or():
+    # a OR (b AND c), not (a OR b) AND c
+    assert matches("process=firefox OR port=443 AND interface=wifi") is False
+    assert matches("process=chrome OR port=80 AND interface=wifi") is True
+    assert matches("(process=chrome OR port=80) AND interface=wifi") is False
+
+def test_juxtaposition_is_and():
+    assert matches("process=chrome port=443") is True
+    assert matches("process=chrome port=80") is False
+
+def test_not_applies_to_one_factor():
+    assert matches("NOT process=firefox AND port=443") is True
+    assert matches("NOT (process=chrome AND port=443)") is False
+    assert matches("NOT NOT process=chrome") is True
+
+def test_keywords_ignore_case():
+    assert matches("process=firefox or not port=80") is True
+
+def test_ip_in_cidrs():
+    assert matches("ip in 104.16.0.0/12") is True
+    assert matches("ip in 10.0.0.0/8,104.16.0.0/13") is True
+    assert matches("ip in 104.32.0.0/12") is False
+    assert matches("ip in 2001:db8::/32", dst_ip="2001:db8::1") is True
+    assert matches("ip in 104.16.0.0/12", dst_ip="2001:db8::1") is False # Other family
+    assert matches("ip in 0.0.0.0/0", dst_ip="not an address") is False
+
+def test_port_in_list_and_ranges():
+    assert matches("port in 80,443") is True
+    assert matches("port in 8000-8999", dst_port=8080) is True
+    assert matches("port in 80,8000-8999", dst_port=9000) is False
+
+def test_text_in_list():
+    assert matches("interface in ethernet,wifi") is True
+    assert matches("interface in wifi,nordlynx") is False
+
+def test_regex_operands():
+    assert matches("process~^(chrome|firefox)") is True
+    assert matches("process~^(chrome|firefox)", process_name="firefox") is True
+    assert matches("process~^(chrome|firefox)", process_name="xchrome") is False
+    assert matches("process!~^chrome") is False
+    # Parentheses the regex does not open close the enclosing group
+    assert matches("(process~^(chrome|firefox)) AND port=443") is True
+    assert matches("(NOT process~chrome)") is False
+    assert matches('process~"chrome exe|chrome\\.exe"') is True
+
+def test_memoized_fields_test_each_value_once():
+    flow_filter = compile_filter("process=chrome")
+    for _ in range(3):
+        assert flow_filter(flow())
+    field, memo = flow_filter.memos[0]
+    assert field == "process_name" and memo == {"chrome.exe": True}
+
+def test_full_memos_drop_their_oldest_values(monkeypatch):
+    monkeypatch.setattr(flow_filter_module, "MAX_MEMO_ENTRIES", 8)
+    flow_filter = compile_filter("ip in 10.0.0.0/8")
+    for i in range(9):
+        flow_filter(flow(dst_ip=f"10.0.0.{i}"))
+    _, memo = flow_filter.memos[0]
+    assert list(memo) == [f"10.0.0.{i}" for i in range(2, 9)]
+
+@pytest.mark.parametrize("text, message, position", [
+    ("process=", "Missing value after '='", 8),
+    ("(process=chrome", "Missing ')'", 0),
+    ("process=chrome)", "Unexpected ')'", 14),
+    ("process=chrome AND", "Expression ends early", 18),
+    ("OR port=80", "Unexpected 'OR'", 0),
+    ("volume>10XB", "'10XB' is not a number", 7),
+    ("process>5", "'process' is not numeric", 8),
+    ("process~(", "Bad regular expression", 8),
+    ('process="chrome', "Unterminated quote", 8),
+    ("ip in 300.0.0.0/8", "does not appear to be an IPv4 or IPv6 network", 6),
+])
+def test_errors_point_at_the_offending_text(text, message, position):
+    with pytest.raises(FilterError) as error:
+        compile_filter(text)
+    assert message in str(error.value)
+    assert error.value.position == position
+    assert f"(at character {position + 1})" in str(error.value)
+
+def test_empty_list_items_are_skipped():
+    assert matches("port in 80,,443,") is True
+
+def test_placeholder_example_parses():
+    assert matches("process=chrome volume>10MB OR ip in 104.16.0.0/12") is True
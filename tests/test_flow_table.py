@@ -0,0 +1,64 @@
+# tests/test_flow_table.py
+
+import random
+from collections import Counter
+from flow_table import FlowTable, SpaceSaving
+
+def test_space_saving_bounds_on_a_skewed_stream():
+    rng = random.Random(4)
+    sketch = SpaceSaving(k=20)
+    true = Counter()
+    for _ in range(50000):
+        key = f"flow{min(int(rng.paretovariate(1.1)), 5000)}"
+        weight = rng.randrange(40, 1500)
+        sketch.update(key, weight)
+        true[key] += weight
+    total = sum(true.values())
+    top = sketch.top()
+    assert len(top) == 20
+    assert sum(count for _, count, _ in top) == total # Every update lands in exactly one counter
+    for key, count, error in top:
+        assert count - error <= true[key] <= count
+    for key, weight in true.items():
+        if weight > total / 20:
+            assert key in sketch
+    assert [count for _, count, _ in top] == sorted((count for _, count, _ in top), reverse=True)
+
+def test_space_saving_replaces_the_smallest_counter():
+    sketch = SpaceSaving(k=3)
+    for key, weight in (("a", 10), ("b", 5), ("c", 7), ("b", 4), ("d", 1)):
+        sketch.update(key, weight)
+    # b grew to 9 after its heap entry was made, so c (7) is the smallest
+    assert sketch.top() == [("a", 10, 0), ("b", 9, 0), ("d", 8, 7)]
+    sketch.update("e", 2)
+    assert sorted(sketch.top(2)) == [("a", 10, 0), ("e", 10, 8)]
+    assert "d" not in sketch
+
+def make_table(max_flows, keys, heavy_hitters=100, idle_timeout=300.0):
+    table = FlowTable(max_flows=max_flows, idle_timeout=idle_timeout, heavy_hitters=heavy_hitters)
+    for now, key in enumerate(keys):
+        record = table.add(key, "198.18.0.1", 443, "Ethernet", now=float(now))
+        table.apply_delta(record, 1000, 1, "Unknown", now=float(now))
+    return table
+
+def test_cap_holds_when_every_flow_is_a_heavy_hitter():
+    table = make_table(2, ["a", "b", "c"])
+    assert [record.key for record in table.evict(now=3.0)] == ["a"]
+    assert len(table) == 2 and table.evicted == 1
+
+def test_light_flows_go_before_heavy_hitters_above_the_cap():
+    table = FlowTable(max_flows=3, heavy_hitters=2)
+    for now, (key, length) in enumerate((("heavy", 10 ** 6), ("light1", 1), ("light2", 1), ("light3", 1))):
+        table.apply_delta(table.add(key, "198.18.0.1", 443, "Ethernet", now=float(now)), length, 1, "Unknown",
+                          now=float(now))
+    assert "heavy" in table.heavy_hitters and "light1" not in table.heavy_hitters
+    assert [record.key for record in table.evict(now=4.0)] == ["light1"] # Not heavy, the least recently seen
+    assert [record.key for record in table] == ["heavy", "light2", "light3"]
+
+def test_idle_heavy_hitters_expire():
+    table = make_table(10, ["giant", "small"], idle_timeout=60.0)
+    table.apply_delta(table.get("giant"), 10 ** 9, 1, "Unknown", now=1.0)
+    table.apply_delta(table.get("small"), 1, 1, "Unknown", now=100.0)
+    assert "giant" in table.heavy_hitters
+    assert [record.key for record in table.evict(now=100.0)] == ["giant"]
+    assert [record.key for record in table] == ["small"]
@@ -0,0 +1,69 @@
+# tests/test_geo_databases.py
+
+import ipaddress
+import os
+import sys
+import pytest
+
+pytest.importorskip("geoip2")
+import geoip_lookup
+from geo_databases import GeoDatabases
+from prefix_cache import PrefixCache
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "benchmarks"))
+from mmdb_builder import build_test_databases # pylint: disable=wrong-import-position
+
+@pytest.fixture
+def paths(tmp_path):
+    city_path, asn_path = str(tmp_path / "City.mmdb"), str(tmp_path / "ASN.mmdb")
+    build_test_databases(city_path, asn_path, prefixlen=8, distinct_records=256)
+    return city_path, asn_path
+
+def update(paths, distinct_records):
+    """Rewrites both files; network i answers as before only when i < distinct_records."""
+    build_test_databases(*paths, prefixlen=8, distinct_records=distinct_records)
+    for path in paths: # Make sure the signature changes even within the mtime resolution
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+def test_swap_drops_only_the_entries_the_new_version_answers_differently(paths):
+    cache = PrefixCache()
+    databases = GeoDatabases(*paths, cache=cache)
+    assert databases.check()
+    version, lookup = databases.current
+    for ip in ("1.0.0.1", "100.0.0.1", "200.0.0.1"):
+        result, network = lookup.lookup(ip)
+        databases.cache_result(version, network, result)
+    update(paths, 128)
+    assert not databases.check() # Changed since the last check: may still be being written
+    assert databases.check()
+    assert databases.current[0] == version + 1
+    assert [str(network) for network, _ in cache.items()] == ["1.0.0.0/8", "100.0.0.0/8"]
+    databases.close()
+
+def test_cache_result_refuses_a_replaced_version(paths):
+    cache = PrefixCache()
+    databases = GeoDatabases(*paths, cache=cache)
+    databases.check()
+    old_version, lookup = databases.current
+    result, network = lookup.lookup("1.0.0.1")
+    update(paths, 128)
+    databases.check()
+    databases.check()
+    databases.cache_result(old_version, network, result)
+    assert len(cache) == 0
+    databases.cache_result(old_version + 1, network, result)
+    assert cache.get("1.0.0.1") == result
+    databases.close()
+
+def test_worker_reports_the_version_that_answered(paths, monkeypatch):
+    monkeypatch.setattr(geoip_lookup, "_worker_lookup", None)
+    monkeypatch.setattr(geoip_lookup, "_worker_version", None)
+    geoip_lookup.init_worker(*paths)
+    version, results = geoip_lookup.lookup_batch(["200.0.0.1"], 1)
+    assert version == 1 and results[0][2] == ipaddress.ip_network("200.0.0.0/8")
+    for path in paths:
+        os.remove(path)
+    version, stale = geoip_lookup.lookup_batch(["200.0.0.1"], 2) # Cannot open version 2: answers from 1
+    assert version == 1 and stale == results
+    geoip_lookup._worker_lookup.close() # pylint: disable=protected-access
@@ -0,0 +1,69 @@
+# tests/test_history_store.py
+
+import time
+import pytest
+import history_store
+from flow_engine import FlowEngine
+from history_store import HistoryStore
+
+class RecordingStore:
+    def __init__(self):
+        self.batches = []
+
+    def record_batch(self, timestamp, rows):
+        self.batches.append((timestamp, rows))
+
+def delta(ip, length=100):
+    return {"dst_ip": ip, "dst_port": 443, "interface": "Ethernet", "process_name": "test.exe",
+            "bytes": length, "packets": 1}
+
+def batch(*deltas, captured_at=None):
+    return {"deltas": {f"flow{i}": d for i, d in enumerate(deltas)},
+            "captured_at": time.monotonic() if captured_at is None else captured_at}
+
+def test_unresolved_networks_are_recorded_as_unknown():
+    store = RecordingStore()
+    engine = FlowEngine(history_store=store)
+    engine.apply_batch(batch(delta("198.18.0.1")))
+    engine.apply_resolved([{"ip": "198.18.0.1", "network": None, "country": None}])
+    engine.apply_batch(batch(delta("198.18.0.1")))
+    assert [rows[0][4:6] for _, rows in store.batches] == [("Unknown", "Unknown"), ("Unknown", "Unknown")]
+
+def test_rows_are_stamped_with_the_capture_time():
+    store = RecordingStore()
+    engine = FlowEngine(history_store=store)
+    engine.apply_batch(batch(delta("198.18.0.1"), captured_at=time.monotonic() - 30)) # Waited 30 s in the queues
+    assert abs(store.batches[0][0] - (time.time() - 30)) < 1
+
+@pytest.mark.parametrize("argv, path", [
+    ([], history_store.DEFAULT_HISTORY_PATH),
+    (["--no-history"], None),
+    (["--replay", "x.pcap"], None), # Replayed traffic stays out of the host's history
+    (["--replay", "x.pcap", "--history-db", "replay.db"], "replay.db"),
+    (["--history-db", "other.db", "--no-history"], None),
+])
+def test_history_path_options(argv, path):
+    main = pytest.importorskip("main")
+    options, _ = main.parse_args(["conmon"] + argv)
+    assert options.history_db == path
+
+def test_failed_writes_count_as_dropped(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.db"), flush_interval=0.05)
+    store.start()
+    # A NULL rollup value fails the whole transaction
+    store.record_batch(time.time(), [("test.exe", "198.18.0.1", 443, "Ethernet", None, "NL", 100, 1)])
+    store.stop()
+    assert store.stats()["dropped_batches"] == 1 and store.rows_written == 0
+    store = HistoryStore(str(tmp_path / "history.db"), flush_interval=0.05)
+    store.start()
+    store.record_batch(time.time(), [("test.exe", "198.18.0.1", 443, "Ethernet", "AS64500", "NL", 100, 1)])
+    store.stop()
+    assert store.dropped_batches == 0 and store.top_talkers("asn") == [("AS64500", 100, 1)]
+    store.stop()
+
+def test_main_refuses_a_missing_database(tmp_path, capsys):
+    path = tmp_path / "missing.db"
+    with pytest.raises(SystemExit):
+        history_store.main([str(path)])
+    assert "no history database" in capsys.readouterr().err
+    assert not path.exists()
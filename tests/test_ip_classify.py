@@ -0,0 +1,135 @@
+# tests/test_ip_classify.py
+
+import ipaddress
+import random
+import pytest
+import ip_classify
+from ip_classify import (
+    BENCHMARK, BROADCAST, DOCUMENTATION, IPV4_MAPPED, KINDS, LINK_LOCAL, LOCAL, LOOPBACK, MULTICAST, PRIVATE,
+    PUBLIC, RESERVED, SHARED, UNSPECIFIED, AddressTable, to_number,
+)
+
+@pytest.fixture(autouse=True)
+def no_local_networks():
+    ip_classify.set_local_networks(())
+    yield
+    ip_classify.set_local_networks(())
+
+def kind(table, ip):
+    return table.classify(to_number(ip))
+
+@pytest.mark.parametrize("ip, expected", [
+    ("8.8.8.8", PUBLIC),
+    ("0.1.2.3", RESERVED),
+    ("0.0.0.0", UNSPECIFIED), # /32 inside the reserved /8
+    ("10.255.255.255", PRIVATE),
+    ("11.0.0.0", PUBLIC),
+    ("100.64.0.0", SHARED),
+    ("100.127.255.255", SHARED),
+    ("100.128.0.0", PUBLIC),
+    ("127.0.0.1", LOOPBACK),
+    ("169.254.10.1", LINK_LOCAL),
+    ("172.15.255.255", PUBLIC),
+    ("172.16.0.0", PRIVATE),
+    ("172.31.255.255", PRIVATE),
+    ("172.32.0.0", PUBLIC),
+    ("192.0.0.8", RESERVED),
+    ("192.0.2.1", DOCUMENTATION),
+    ("192.168.0.1", PRIVATE),
+    ("198.18.0.1", BENCHMARK),
+    ("198.19.255.255", BENCHMARK),
+    ("198.20.0.0", PUBLIC),
+    ("224.0.0.251", MULTICAST),
+    ("239.255.255.255", MULTICAST),
+    ("240.0.0.1", RESERVED),
+    ("255.255.255.254", RESERVED),
+    ("255.255.255.255", BROADCAST), # /32 inside the reserved /4
+    ("2606:4700::1", PUBLIC),
+    ("::", UNSPECIFIED),
+    ("::1", LOOPBACK),
+    ("::2", PUBLIC),
+    ("2001:db8::1", DOCUMENTATION),
+    ("2001:2::1", BENCHMARK),
+    ("fc00::1", PRIVATE),
+    ("fdff:ffff::1", PRIVATE),
+    ("fe80::1", LINK_LOCAL),
+    ("febf:ffff::1", LINK_LOCAL),
+    ("fec0::1", PUBLIC),
+    ("ff02::1", MULTICAST),
+])
+def test_most_specific_range_wins(ip, expected):
+    assert kind(AddressTable(), ip) == expected
+
+def test_ipv4_is_mapped_into_ipv6_space():
+    assert to_number("10.1.2.3") == IPV4_MAPPED | 0x0A010203
+    assert to_number("::ffff:10.1.2.3") == to_number("10.1.2.3")
+    table = AddressTable()
+    assert kind(table, "::ffff:10.1.2.3") == PRIVATE
+    assert kind(table, "::ffff:8.8.8.8") == PUBLIC
+    # The same 32 bits outside ::ffff:0:0/96 are an IPv6 address, not 10.1.2.3
+    assert kind(table, "::10.1.2.3") == PUBLIC
+
+def test_to_number_rejects_non_addresses():
+    for text in ("", "example.com", "10.1.2", "1.2.3.4/24"):
+        with pytest.raises(ValueError):
+            to_number(text)
+
+def test_local_subnets_win_ties_and_more_specific_ranges():
+    table = AddressTable([ipaddress.ip_network("192.168.1.0/24"), ipaddress.ip_network("192.0.2.0/24"),
+                          ipaddress.ip_network("10.0.0.0/8"), ipaddress.ip_network("2001:db8::/64")])
+    assert kind(table, "192.168.1.7") == LOCAL
+    assert kind(table, "192.168.2.7") == PRIVATE
+    assert kind(table, "192.0.2.1") == LOCAL # Same prefix as the documentation range
+    assert kind(table, "10.9.9.9") == LOCAL # Same prefix as the private range
+    assert kind(table, "2001:db8::5") == LOCAL
+    assert kind(table, "2001:db8:1::5") == DOCUMENTATION
+
+def test_intervals_are_sorted_and_disjoint():
+    table = AddressTable([ipaddress.ip_network("192.168.1.0/24")])
+    for starts, ends in ((table.starts, table.ends), (table.uncaptured_starts, table.uncaptured_ends)):
+        assert all(start <= end for start, end in zip(starts, ends))
+        assert all(end < start for end, start in zip(ends, starts[1:]))
+
+def test_is_captured():
+    table = ip_classify.set_local_networks([ipaddress.ip_network("192.0.2.0/24")])
+    for ip in ("8.8.8.8", "100.64.0.1", "198.18.0.5", "203.0.113.1", "2606:4700::1", "2001:db8::1"):
+        assert ip_classify.is_captured(to_number(ip)) and table.is_captured(to_number(ip)), ip
+    for ip in ("10.0.0.1", "127.0.0.1", "169.254.0.1", "224.0.0.1", "255.255.255.255", "0.0.0.0", "240.0.0.1",
+               "192.0.2.1", "::1", "fe80::1", "fd00::1", "ff02::1", "::"):
+        assert not ip_classify.is_captured(to_number(ip)) and not table.is_captured(to_number(ip)), ip
+
+def test_is_routable_only_for_public_addresses():
+    assert ip_classify.is_routable("8.8.8.8")
+    assert ip_classify.is_routable("2606:4700::1")
+    for ip in ("10.0.0.1", "198.18.0.1", "192.0.2.1", "::1", "not an address", ""):
+        assert not ip_classify.is_routable(ip)
+
+def test_networks_round_trip():
+    table = AddressTable()
+    assert table.networks({SHARED}) == [ipaddress.ip_network("100.64.0.0/10")]
+    assert table.networks({BROADCAST, UNSPECIFIED}) == [
+        ipaddress.ip_network("0.0.0.0/32"), ipaddress.ip_network("255.255.255.255/32"),
+        ipaddress.ip_network("::/128")]
+    # 240.0.0.0/4 minus the broadcast address
+    reserved = [network for network in table.networks({RESERVED}) if network.version == 4]
+    assert ipaddress.ip_network("240.0.0.0/5") in reserved
+    assert ipaddress.ip_network("255.255.255.254/32") in reserved
+    assert all(ipaddress.ip_address("255.255.255.255") not in network for network in reserved)
+
+def test_set_local_networks_rebuilds_only_on_change():
+    subnet = ipaddress.ip_network("192.0.2.0/24")
+    table = ip_classify.set_local_networks([subnet])
+    assert ip_classify.set_local_networks([subnet]) is table
+    assert ip_classify.table() is table
+    assert ip_classify.classify_ip("192.0.2.1") == LOCAL
+    assert ip_classify.set_local_networks(()) is not table
+    assert ip_classify.classify_ip("192.0.2.1") == DOCUMENTATION
+
+def test_classify_array_matches_classify():
+    np = pytest.importorskip("numpy")
+    table = AddressTable([ipaddress.ip_network("198.51.100.0/25")])
+    rng = random.Random(1)
+    values = [rng.getrandbits(32) for _ in range(20000)]
+    values += [0, 0xFFFFFFFF, 0x0A000000, 0x0AFFFFFF, 0x0B000000, 0xC6336400, 0xC633647F, 0xC6336480]
+    codes = table.classify_array(np.array(values, dtype=np.uint32))
+    assert [KINDS[code] for code in codes.tolist()] == [table.classify(IPV4_MAPPED | value) for value in values]
@@ -0,0 +1,47 @@
+# tests/test_process_cache.py
+
+from collections import namedtuple
+import psutil
+from process_cache import ProcessCache
+
+Address = namedtuple("Address", "ip port")
+Connection = namedtuple("Connection", "pid laddr")
+
+def scanning(monkeypatch, owners):
+    """Makes scans see the local ports in owners ({port: (pid, name)}), which the test may change later."""
+    class Process:
+        def __init__(self, pid):
+            self.pid = pid
+
+        def name(self):
+            return next(name for pid, name in owners.values() if pid == self.pid)
+
+    monkeypatch.setattr(psutil, "net_connections", lambda kind: [
+        Connection(pid, Address("192.0.2.1", port)) for port, (pid, _) in owners.items()])
+    monkeypatch.setattr(psutil, "Process", Process)
+
+def test_memoized_flows_outlive_the_socket_until_the_port_changes_owner(monkeypatch):
+    owners = {50000: (10, "chrome.exe")}
+    scanning(monkeypatch, owners)
+    cache = ProcessCache(min_lookup_interval=0)
+    flow = ("198.18.0.1", 50000, 443)
+    assert cache.lookup(50000, flow) == "chrome.exe" # Scanned on demand
+    del owners[50000]
+    cache._scan() # pylint: disable=protected-access
+    assert cache.lookup(50000, flow) == "chrome.exe" and cache.flow_hits == 1
+    owners[50000] = (20, "curl.exe")
+    cache._scan() # pylint: disable=protected-access
+    assert cache.lookup(50000, flow) == "curl.exe"
+    assert cache.stats()["flows_memoized"] == 1
+
+def test_forget_and_the_cap_drop_memoized_flows(monkeypatch):
+    owners = {port: (10, "chrome.exe") for port in range(50000, 50004)}
+    scanning(monkeypatch, owners)
+    cache = ProcessCache(min_lookup_interval=0, max_flows=3)
+    for port in owners:
+        cache.lookup(port, ("198.18.0.1", port, 443 if port < 50003 else 80))
+    assert cache.stats()["flows_memoized"] == 3 # The oldest went at the cap
+    cache.forget("198.18.0.1", 443)
+    assert cache.stats()["flows_memoized"] == 1
+    cache.forget("198.18.0.1", 80)
+    assert cache.stats()["flows_memoized"] == 0
@@ -0,0 +1,164 @@
+# tests/test_raw_capture.py
+
+import io
+import struct
+import pytest
+import raw_capture
+from raw_capture import (
+    LINKTYPE_ETHERNET, LINKTYPE_LINUX_SLL, LINKTYPE_NULL, LINKTYPE_RAW, PCAPNG_BYTE_ORDER_MAGIC, PCAPNG_EPB,
+    PCAPNG_IDB, PCAPNG_OPT_TSRESOL, PCAPNG_PB, PCAPNG_SHB, PCAPNG_SPB, PcapNgStreamSource, PcapStreamSource,
+    open_capture_file, parse_frame,
+)
+
+def udp4(dst=(8, 8, 4, 4), dst_port=53):
+    return (struct.pack('!BBHHHBBH4B4B', 0x45, 0, 28, 0, 0, 64, raw_capture.IPPROTO_UDP, 0, 192, 0, 2, 2, *dst)
+            + struct.pack('!HHHH', 40000, dst_port, 8, 0))
+
+def padded(data):
+    return data + bytes(-len(data) % 4)
+
+# --- pcapng writers ---
+
+def block(order, block_type, body):
+    body = padded(body)
+    return struct.pack(order + 'II', block_type, len(body) + 12) + body + struct.pack(order + 'I', len(body) + 12)
+
+def section(order):
+    return block(order, PCAPNG_SHB, struct.pack(order + 'IHHq', PCAPNG_BYTE_ORDER_MAGIC, 1, 0, -1))
+
+def interface(order, linktype, tsresol=None, snaplen=0):
+    options = b''
+    if tsresol is not None:
+        options = struct.pack(order + 'HH', 2, 2) + b'lo' + bytes(2) # An unrelated option before if_tsresol
+        options += struct.pack(order + 'HHB', PCAPNG_OPT_TSRESOL, 1, tsresol) + bytes(3)
+        options += struct.pack(order + 'HH', 0, 0)
+    return block(order, PCAPNG_IDB, struct.pack(order + 'HHI', linktype, 0, snaplen) + options)
+
+def enhanced(order, interface_id, timestamp, data, wire_length=None):
+    header = struct.pack(order + 'IIIII', interface_id, timestamp >> 32, timestamp & 0xFFFFFFFF, len(data),
+                         len(data) if wire_length is None else wire_length)
+    return block(order, PCAPNG_EPB, header + data)
+
+def records(source):
+    return [(timestamp, bytes(frame), wire_length, linktype)
+            for timestamp, frame, wire_length, linktype in source.records(lambda: True)]
+
+@pytest.mark.parametrize("order", ['<', '>'])
+def test_pcapng_interfaces_resolutions_and_packet_blocks(order):
+    packet = udp4()
+    stream = (section(order)
+              + interface(order, LINKTYPE_RAW) # Default resolution: microseconds
+              + interface(order, LINKTYPE_RAW, tsresol=9) # 10**-9
+              + interface(order, LINKTYPE_RAW, tsresol=0x80 | 10) # 2**-10
+              + block(order, 0x00000004, b'name resolution block') # Skipped
+              + enhanced(order, 0, 1_500_000, packet, wire_length=1500)
+              + enhanced(order, 1, 2_250_000_000, packet)
+              + enhanced(order, 2, 3 * 1024 + 512, packet)
+              + enhanced(order, 3, 0, packet) # Undescribed interface: dropped
+              + block(order, PCAPNG_SPB, struct.pack(order + 'I', len(packet)) + packet)
+              + block(order, PCAPNG_PB, struct.pack(order + 'HHIIII', 1, 0, 0, 4_000_000_000, len(packet),
+                                                    len(packet)) + packet))
+    assert records(PcapNgStreamSource(io.BytesIO(stream))) == [
+        (1.5, packet, 1500, LINKTYPE_RAW),
+        (2.25, packet, len(packet), LINKTYPE_RAW),
+        (3.5, packet, len(packet), LINKTYPE_RAW),
+        (0.0, packet, len(packet), LINKTYPE_RAW), # Simple Packet Blocks belong to interface 0
+        (4.0, packet, len(packet), LINKTYPE_RAW),
+    ]
+
+def test_pcapng_sections_reset_interfaces_and_byte_order():
+    first, second = udp4((1, 1, 1, 1)), udp4((9, 9, 9, 9))
+    stream = (section('<') + interface('<', LINKTYPE_RAW, tsresol=3) + enhanced('<', 0, 7000, first)
+              + section('>') + interface('>', LINKTYPE_NULL)
+              + enhanced('>', 0, 8_000_000, struct.pack('<I', 2) + second)
+              + section('<') + enhanced('<', 0, 9, first)) # No interfaces in this section yet
+    source = PcapNgStreamSource(io.BytesIO(stream))
+    assert records(source) == [
+        (7.0, first, len(first), LINKTYPE_RAW),
+        (8.0, struct.pack('<I', 2) + second, len(second) + 4, LINKTYPE_NULL),
+    ]
+    assert source.byte_order == '<' and source.interfaces == []
+
+def test_pcapng_grows_its_buffer_for_large_blocks():
+    jumbo = udp4() + bytes(70000)
+    stream = section('<') + interface('<', LINKTYPE_RAW) + enhanced('<', 0, 0, jumbo)
+    assert records(PcapNgStreamSource(io.BytesIO(stream)))[0][1] == jumbo
+
+def test_pcapng_errors():
+    with pytest.raises(ValueError, match="Not a pcapng stream"):
+        PcapNgStreamSource(io.BytesIO(b'\xd4\xc3\xb2\xa1' + bytes(20)))
+    with pytest.raises(ValueError, match="byte-order magic"):
+        PcapNgStreamSource(io.BytesIO(struct.pack('<III', PCAPNG_SHB, 28, 0x12345678) + bytes(16)))
+    with pytest.raises(ValueError, match="Truncated"):
+        PcapNgStreamSource(io.BytesIO(section('<')[:20]))
+    stream = section('<') + struct.pack('<II', PCAPNG_EPB, 4)
+    with pytest.raises(ValueError, match="Corrupt pcapng block length"):
+        records(PcapNgStreamSource(io.BytesIO(stream)))
+    # A packet cut off at the end of a stream being written ends the records quietly
+    truncated = section('<') + interface('<', LINKTYPE_RAW) + enhanced('<', 0, 0, udp4())[:-10]
+    assert records(PcapNgStreamSource(io.BytesIO(truncated))) == []
+
+# --- Classic pcap ---
+
+def pcap(order, nanoseconds, linktype, packets, snaplen=262144):
+    magic = 0xA1B23C4D if nanoseconds else 0xA1B2C3D4
+    data = struct.pack(order + 'IHHiIII', magic, 2, 4, 0, 0, snaplen, linktype)
+    for seconds, fraction, packet in packets:
+        data += struct.pack(order + 'IIII', seconds, fraction, len(packet), len(packet) + 100) + packet
+    return data
+
+@pytest.mark.parametrize("order", ['<', '>'])
+@pytest.mark.parametrize("nanoseconds", [False, True])
+def test_pcap_byte_orders_and_resolutions(order, nanoseconds):
+    packet = udp4()
+    stream = pcap(order, nanoseconds, LINKTYPE_ETHERNET, [(5, 250_000_000 if nanoseconds else 250_000, packet)])
+    source = PcapStreamSource(io.BytesIO(stream))
+    assert source.byte_order == order
+    assert records(source) == [(5.25, packet, len(packet) + 100, LINKTYPE_ETHERNET)]
+
+def test_pcap_truncated_record_ends_the_stream():
+    stream = pcap('<', False, LINKTYPE_RAW, [(1, 0, udp4()), (2, 0, udp4())])
+    assert len(records(PcapStreamSource(io.BytesIO(stream[:-5])))) == 1
+    with pytest.raises(ValueError, match="Not a pcap stream"):
+        PcapStreamSource(io.BytesIO(stream[:10]))
+
+def test_open_capture_file_picks_the_reader(tmp_path):
+    paths = {}
+    for name, data in (("a.pcap", pcap('>', False, LINKTYPE_RAW, [(1, 0, udp4())])),
+                       ("b.pcapng", section('>') + interface('>', LINKTYPE_RAW) + enhanced('>', 0, 0, udp4())),
+                       ("c.txt", b"not a capture")):
+        paths[name] = tmp_path / name
+        paths[name].write_bytes(data)
+    for name, reader in (("a.pcap", PcapStreamSource), ("b.pcapng", PcapNgStreamSource)):
+        source = open_capture_file(str(paths[name]))
+        try:
+            assert isinstance(source, reader)
+            assert [parse_frame(frame, linktype) for frame, _, linktype in source.frames(lambda: True)] == [
+                ("8.8.4.4", 40000, 53)]
+        finally:
+            source.close()
+    with pytest.raises(ValueError, match="neither a pcap nor a pcapng file"):
+        open_capture_file(str(paths["c.txt"]))
+
+# --- Link types ---
+
+@pytest.mark.parametrize("linktype, header", [
+    (LINKTYPE_RAW, b''),
+    (raw_capture.LINKTYPE_IPV4, b''),
+    (LINKTYPE_ETHERNET, bytes(12) + b'\x08\x00'),
+    (LINKTYPE_ETHERNET, bytes(12) + b'\x81\x00\x00\x07\x81\x00\x00\x08\x08\x00'), # Stacked VLAN tags
+    (LINKTYPE_NULL, struct.pack('<I', 2)), # Family in the capturing host's byte order
+    (LINKTYPE_NULL, struct.pack('>I', 2)),
+    (LINKTYPE_LINUX_SLL, bytes(14) + b'\x08\x00'),
+])
+def test_link_layer_headers_are_skipped(linktype, header):
+    assert parse_frame(memoryview(header + udp4()), linktype) == ("8.8.4.4", 40000, 53)
+
+@pytest.mark.parametrize("linktype, header", [
+    (LINKTYPE_ETHERNET, bytes(12) + b'\x08\x06'), # ARP
+    (LINKTYPE_NULL, struct.pack('<I', 7)),
+    (LINKTYPE_LINUX_SLL, bytes(14) + b'\x08\x06'),
+    (147, b''), # A user DLT we do not know
+])
+def test_other_link_layer_payloads_are_ignored(linktype, header):
+    assert parse_frame(memoryview(header + udp4()), linktype) is None